@@ -1,3 +1,51 @@
-from django.test import TestCase  # noqa
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase
+
+from storages.redis import RedisUtil
+from storages.redis.rate_limit import RateLimiter, parse_rate
+
+
+# 需要 Redis
+class RateLimiterTest(TestCase):
+    name = "Test:Login"
+
+    def tearDown(self) -> None:
+        RedisUtil.r.delete(*RedisUtil.r.keys(f"RateLimit:{self.name}:*") or ["_"])
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("10/m"), (10, 60))
+        self.assertEqual(parse_rate("3/2"), (3, 2))
+
+    def test_shared_between_processes(self):
+        # 两个实例模拟两个进程, 共用 Redis 计数
+        a, b = RateLimiter.from_rate(self.name, "3/m"), RateLimiter.from_rate(self.name, "3/m")
+        self.assertEqual([a.hit("ip:1"), b.hit("ip:1"), a.hit("ip:1")], [0, 0, 0])
+        retry_after = b.hit("ip:1")
+        self.assertTrue(19 < retry_after <= 20)
+        # 已拒绝的 identity 在本进程内直接拒绝, 其他 identity 不受影响
+        self.assertTrue(b.hit("ip:1"))
+        self.assertEqual(b.hit("ip:2"), 0)
+
+    def test_refused_hit_not_counted_locally(self):
+        # 1/m: a 放行后 b 在 59 秒时被 Redis 拒绝, 60 秒后 b 应放行, 不被本进程 TAT 锁住
+        a, b = RateLimiter.from_rate(self.name, "1/m"), RateLimiter.from_rate(self.name, "1/m")
+        clock, tats = [1000.0], {}
+
+        def script(keys, args):
+            # 与 GCRA_SCRIPT 相同的计算, 时间取测试时钟
+            now = int(clock[0] * 1000000)
+            new_tat = max(tats.get(keys[0], 0), now) + args[0]
+            if new_tat - now > args[1]:
+                return max(-(-(new_tat - now - args[1]) // 1000), 1)
+            tats[keys[0]] = new_tat
+            return 0
+
+        a._script = b._script = script
+        with mock.patch("storages.redis.rate_limit.time.monotonic", lambda: clock[0]):
+            self.assertEqual(a.hit("ip:1"), 0)
+            clock[0] += 59
+            self.assertTrue(0 < b.hit("ip:1") <= 1)
+            clock[0] += 1.01
+            self.assertEqual(b.hit("ip:1"), 0)
+            self.assertTrue(b.hit("ip:1"))
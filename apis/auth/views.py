@@ -13,7 +13,7 @@ from common import messages
 from apis.auth import schemas, serializers
 from apis.responses import RestResponse
 from apis.permissions import AuthorizedServicePermission
-from common.decorators import custom_swagger_auto_schema
+from common.decorators import rate_limit, custom_swagger_auto_schema
 from apis.account.serializers import ProfileSerializer, get_profile_system_resource
 from storages.relational.models.account import Profile, SystemResource
 from storages.relational.models.third_service import ThirdService, ReferenceProfile
@@ -46,6 +46,7 @@ class LoginView(ObtainJSONWebToken):
     @custom_swagger_auto_schema(
         request_body=schemas.LoginSerializer, responses={"200": serializers.LoginResponse}, security=[]
     )
+    @rate_limit("10/m", key="ip")
     def post(self, request, *args, **kwargs):
         profile = request.body_data["user"]
         if not profile:
@@ -116,6 +117,7 @@ class ChangePasswordView(ObtainJSONWebToken):
     @custom_swagger_auto_schema(
         request_body=schemas.ChangePasswordSerializer, responses={status.HTTP_200_OK: RestResponse.success_schema}
     )
+    @rate_limit("5/m")
     def post(self, request, *args, **kwargs):
         profile = request.user  # type: Profile
 
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apis.chat"
+
+    def ready(self):
+        from apis.chat import signals  # noqa
@@ -0,0 +1,92 @@
+"""
+WebSocket 帧编解码, 每个连接协商一种
+    json: 原有格式, JSON 字节帧
+    compact: 顶层字段使用短键的 JSON, 解码时兼容原字段名
+    msgpack: MessagePack 二进制帧
+协商方式: 子协议 chat.{name} 优先, 其次 query 参数 codec={name}, 默认 json
+"""
+import logging
+from typing import Any, Dict, Tuple, Union, Optional
+from urllib.parse import parse_qs
+
+import ujson
+import msgpack
+
+logger = logging.getLogger("chat.consumers.codec")
+
+SUBPROTOCOL_PREFIX = "chat."
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, content: Any) -> bytes:
+        return ujson.dumps(content).encode()
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return ujson.loads(data)
+
+
+class CompactJsonCodec(JsonCodec):
+    name = "compact"
+
+    # 服务端回复
+    encode_keys: Dict[str, str] = {
+        "code": "c",
+        "message_type": "mt",
+        "chat_type": "ct",
+        "sender": "s",
+        "context": "x",
+        "time": "t",
+        "content": "d",
+    }
+    # 客户端消息
+    decode_keys: Dict[str, str] = {
+        "ct": "chat_type",
+        "mt": "message_type",
+        "r": "receiver_id",
+        "d": "content",
+    }
+
+    def encode(self, content: Any) -> bytes:
+        if isinstance(content, dict):
+            content = {self.encode_keys.get(k, k): v for k, v in content.items()}
+        return ujson.dumps(content).encode()
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        content = ujson.loads(data)
+        if isinstance(content, dict):
+            content = {self.decode_keys.get(k, k): v for k, v in content.items()}
+        return content
+
+
+class MsgpackCodec(JsonCodec):
+    name = "msgpack"
+
+    def encode(self, content: Any) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):
+            # 客户端误发文本帧时按 JSON 处理
+            return ujson.loads(data)
+        return msgpack.unpackb(data, raw=False)
+
+
+CODECS: Dict[str, JsonCodec] = {codec.name: codec for codec in (JsonCodec(), CompactJsonCodec(), MsgpackCodec())}
+DEFAULT_CODEC = CODECS[JsonCodec.name]
+
+
+def negotiate_codec(scope: dict) -> Tuple[JsonCodec, Optional[str]]:
+    """
+    返回 (codec, 需要回应的子协议)
+    """
+    for subprotocol in scope.get("subprotocols") or []:
+        if subprotocol.startswith(SUBPROTOCOL_PREFIX):
+            codec = CODECS.get(subprotocol[len(SUBPROTOCOL_PREFIX) :])
+            if codec:
+                return codec, subprotocol
+    names = parse_qs(scope.get("query_string", b"").decode()).get("codec")
+    if names and names[0] in CODECS:
+        return CODECS[names[0]], None
+    return DEFAULT_CODEC, None
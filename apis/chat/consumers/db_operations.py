@@ -1,5 +1,6 @@
 from typing import List, Union, Optional, Awaitable
 
+from cachetools import TTLCache
 from channels.db import database_sync_to_async
 
 from common.utils import flatten_list
@@ -16,14 +17,29 @@ from storages.relational.models import (
 )
 
 
+SYSTEM_SENDER_CACHE_EXPIRE = 60
+_system_sender_cache = TTLCache(maxsize=1, ttl=SYSTEM_SENDER_CACHE_EXPIRE)
+
+
 @database_sync_to_async
-def get_system_sender():
+def _get_system_sender():
     config = Config.objects.filter(key="system_info").first()
     if not config:
         return defines.message_content.SenderInfo(id="df-lanka", avatar=None, nickname="df-lanka")
     return defines.message_content.SenderInfo(**config.value)
 
 
+async def get_system_sender() -> defines.message_content.SenderInfo:
+    """
+    系统消息发送者, 进程内缓存避免每条系统回复都查询数据库
+    """
+    sender = _system_sender_cache.get("system_info")
+    if sender is None:
+        sender = await _get_system_sender()
+        _system_sender_cache["system_info"] = sender
+    return sender
+
+
 @database_sync_to_async
 def get_chat_instance(
     chat_type: defines.chat_type.ChatType, profile_id: int, receiver_id: int
@@ -69,13 +85,13 @@ def get_group_ids_with_profile_pk(profile_id) -> Awaitable[List]:
 @database_sync_to_async
 def update_unread_messages(chat_instance_id, profile_id, message_id):
     """
-    message_id 之前的都已读
+    profile_id 收到的 message_id 之前的都已读
     """
     DialogMessage.objects.filter(
-        dialog_id=chat_instance_id, sender_id=profile_id, read=False, id__lte=message_id
+        dialog_id=chat_instance_id, receiver_id=profile_id, read=False, id__lte=message_id
     ).update(read=True)
 
 
 @database_sync_to_async
-def get_user_file_with_pk(profile_id, file_id) -> Awaitable[UploadedFile]:
-    return UploadedFile.objects.filter(profile_id=profile_id, file_id=file_id).only("id", "size").first()
+def get_file_with_pk(file_id) -> Awaitable[Optional[UploadedFile]]:
+    return UploadedFile.objects.filter(id=file_id).first()
@@ -2,18 +2,26 @@ import enum
 from typing import Literal, TypedDict
 
 from apis.chat.consumers.defines.reply import ServiceReplyData
+from apis.chat.consumers.defines.message_content import MessageUnreadCount
 
 
 @enum.unique
 class ChannelsMessageType(str, enum.Enum):
     chat_message = "group.message"
+    unread_count = "unread.count"
 
 
 ChannelsMessageType_ = Literal[
     ChannelsMessageType.chat_message,
+    ChannelsMessageType.unread_count,
 ]
 
 
 class ChannelsMessageData(TypedDict):
     type: Literal["group.message"]
     content: ServiceReplyData
+
+
+class ChannelsUnreadCountData(TypedDict):
+    type: Literal["unread.count"]
+    content: MessageUnreadCount
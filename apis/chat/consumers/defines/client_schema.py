@@ -5,6 +5,7 @@ from apis.chat.consumers.defines.message_type import MessageType
 from apis.chat.consumers.defines.message_content import (
     FileContent,
     ShareContent,
+    InboxAckContent,
     ContentTextType,
     LocationContent,
     MessageIDContent,
@@ -15,4 +16,6 @@ class MessageSchema(TypedDict):
     chat_type: ChatType
     message_type: MessageType
     receiver_id: Optional[int]
-    content: Optional[Union[ContentTextType, FileContent, LocationContent, ShareContent, MessageIDContent]]
+    content: Optional[
+        Union[ContentTextType, FileContent, LocationContent, ShareContent, MessageIDContent, InboxAckContent]
+    ]
@@ -78,3 +78,12 @@ class ShareContent(UserIdentifier):
 
 class MessageUnreadCount(MessageIdentifier):
     count: int
+
+
+class InboxAckContent(TypedDict):
+    id: str  # 已收到的最后一条离线消息 id
+
+
+class OfflineMessagesContent(TypedDict):
+    last_id: str
+    messages: List[dict]
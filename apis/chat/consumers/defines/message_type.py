@@ -25,6 +25,7 @@ class ClientMessageType(str, enum.Enum):
     Typing = "typing"
     StopTyping = "stop_typing"
     MessageRead = "message_read"
+    InboxAck = "inbox_ack"  # 确认已收到离线消息
 
 
 class TextTag(str, enum.Enum):
@@ -51,6 +52,7 @@ class ServerOnlyMessageType(str, enum.Enum):
 
     MessageSent = "message_sent"  # 发送成功回复 message_id 由 chat_instance 和 message_id 唯一组成
     MessageNewUnRead = "message_new_unread"
+    OfflineMessages = "offline_messages"  # 重连后批量推送离线消息
 
 
 @enum.unique
@@ -11,6 +11,7 @@ from apis.chat.consumers.defines.message_content import (
     LocationContent,
     MessageIDContent,
     MessageUnreadCount,
+    OfflineMessagesContent,
 )
 
 
@@ -22,5 +23,14 @@ class ServiceReplyData(TypedDict):
     context: str
     time: str
     content: Optional[
-        Union[str, ContentTextType, FileContent, LocationContent, ShareContent, MessageIDContent, MessageUnreadCount]
+        Union[
+            str,
+            ContentTextType,
+            FileContent,
+            LocationContent,
+            ShareContent,
+            MessageIDContent,
+            MessageUnreadCount,
+            OfflineMessagesContent,
+        ]
     ]
@@ -14,6 +14,8 @@ class Code(enum.IntEnum):
     RelationShipNotExists = 40003
     ReceiverNotExists = 40004
     FileDoesNotExist = 40005
+    RateLimited = 40006
+    FrameTooLarge = 40007
 
     # other
     ForbiddenAction = 50000
@@ -28,6 +30,8 @@ class Message(str, enum.Enum):
     RelationShipNotExists = "%s关系未建立，无法发送消息"
     ReceiverNotExists = "接收方不存在"
     FileDoesNotExist = "文件不存在"
+    RateLimited = "发送过于频繁"
+    FrameTooLarge = "消息体过大"
 
     # other
     ForbiddenAction = "禁止%s"
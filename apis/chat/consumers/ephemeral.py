@@ -0,0 +1,92 @@
+"""
+临时事件(typing、stop_typing)合并
+    同一连接对同一接收方, 距上次投递超过窗口时立即投递;
+    窗口内的事件只保留最新状态, 窗口结束时若状态有变化再投递一次, 重复状态直接丢弃
+"""
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Callable, Hashable, Optional, Awaitable
+
+logger = logging.getLogger("chat.consumers.ephemeral")
+
+Deliver = Callable[[], Awaitable[Any]]
+
+
+class _Entry:
+    __slots__ = ("state", "sent_at", "pending", "timer")
+
+    def __init__(self):
+        self.state: Optional[str] = None
+        self.sent_at: float = 0
+        self.pending: Optional[tuple] = None  # (state, deliver)
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class EphemeralCoalescer:
+    """
+    单连接的临时事件合并
+    """
+
+    def __init__(self, window: float, maxsize: int = 256):
+        self.window = window
+        self.maxsize = maxsize
+        self._entries: Dict[Hashable, _Entry] = {}
+        self.submitted = 0
+        self.delivered = 0
+
+    def _get_entry(self, key: Hashable, now: float) -> _Entry:
+        entry = self._entries.get(key)
+        if entry is None:
+            if len(self._entries) >= self.maxsize:
+                # 清理窗口已结束且无待投递事件的接收方
+                for stale_key in [
+                    k for k, v in self._entries.items() if v.timer is None and now - v.sent_at >= self.window
+                ]:
+                    del self._entries[stale_key]
+            entry = self._entries[key] = _Entry()
+        return entry
+
+    async def submit(self, key: Hashable, state: str, deliver: Deliver):
+        """
+        state 用于判断是否重复; deliver 为实际投递的协程函数
+        """
+        self.submitted += 1
+        now = time.monotonic()
+        entry = self._get_entry(key, now)
+        elapsed = now - entry.sent_at
+        if entry.timer is None and elapsed >= self.window:
+            entry.state, entry.sent_at = state, now
+            self.delivered += 1
+            await deliver()
+            return
+        if entry.timer is None:
+            if state == entry.state:
+                return
+            entry.timer = asyncio.get_running_loop().call_later(self.window - elapsed, self._flush, key)
+        entry.pending = (state, deliver)
+
+    def _flush(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        entry.timer = None
+        pending, entry.pending = entry.pending, None
+        if pending is None or pending[0] == entry.state:
+            return
+        entry.state, entry.sent_at = pending[0], time.monotonic()
+        self.delivered += 1
+        asyncio.get_running_loop().create_task(self._deliver(pending[1]))
+
+    @staticmethod
+    async def _deliver(deliver: Deliver):
+        try:
+            await deliver()
+        except Exception as e:
+            logger.exception(e)
+
+    def close(self):
+        for entry in self._entries.values():
+            if entry.timer is not None:
+                entry.timer.cancel()
+        self._entries.clear()
@@ -0,0 +1,188 @@
+"""
+聊天文件元数据缓存
+    Chat:File:{file_id} UploadedFile 元数据(JSON), 上传(保存)时写入, 删除时失效, 未命中时回源数据库, 空串表示文件不存在
+    Chat:File:Url:{file_id} 预签名 URL, 在有效期的前 80% 内复用, 同一文件的消息无论多少接收方只签名一次
+    签名 URL 很快过期, 只随实时推送下发; 数据库、历史缓存、离线收件箱只保存 id、label、size、extension,
+    读取历史消息、推送离线消息时重新获取 URL
+"""
+import logging
+from typing import Dict, List, Tuple, Iterable, Optional
+
+import ujson
+
+from storages.redis import RedisUtil, AsyncRedisUtil, keys
+from apis.chat.consumers import defines
+from storages.relational.models import UploadedFile
+from apis.chat.consumers.db_operations import get_file_with_pk
+
+logger = logging.getLogger("chat.consumers.files")
+
+FILE_META_EXPIRE = 60 * 60 * 24
+FILE_MISSING_EXPIRE = 60
+# 签名 URL 剩余有效期低于该比例时重新签名, 保证接收方拿到的 URL 仍有余量
+URL_REFRESH_MARGIN = 0.2
+
+FILE_MESSAGE_TYPES = {
+    defines.message_type.MessageType.Picture.value,
+    defines.message_type.MessageType.Video.value,
+    defines.message_type.MessageType.Audio.value,
+    defines.message_type.MessageType.File.value,
+}
+
+
+def file_key(file_id: int) -> str:
+    return keys.RedisCacheKey.ChatFileKey.format(file_id=file_id)
+
+
+def file_url_key(file_id: int) -> str:
+    return keys.RedisCacheKey.ChatFileUrlKey.format(file_id=file_id)
+
+
+def serialize_file_meta(instance: UploadedFile) -> Dict:
+    return {
+        "id": instance.id,
+        "profile_id": instance.profile_id,
+        "name": instance.file.name,
+        "label": instance.label,
+        "size": instance.size,
+        "extension": instance.extension,
+    }
+
+
+def cache_file_meta(instance: UploadedFile):
+    RedisUtil.r.delete(file_url_key(instance.id))
+    RedisUtil.set(file_key(instance.id), ujson.dumps(serialize_file_meta(instance)), exp=FILE_META_EXPIRE)
+
+
+def invalidate_file_meta(file_id: int):
+    RedisUtil.r.delete(file_key(file_id), file_url_key(file_id))
+
+
+async def get_file_meta(file_id: int, cached: Optional[str] = None) -> Optional[Dict]:
+    """
+    cached 为已批量读取的缓存值
+    """
+    value = cached if cached is not None else await AsyncRedisUtil.r.get(file_key(file_id), encoding="utf-8")
+    if value is None:
+        instance = await get_file_with_pk(file_id)
+        value = ujson.dumps(serialize_file_meta(instance)) if instance else ""
+        await AsyncRedisUtil.r.set(
+            file_key(file_id), value, expire=FILE_META_EXPIRE if instance else FILE_MISSING_EXPIRE
+        )
+    return ujson.loads(value) if value else None
+
+
+def _sign_url(meta: Dict) -> Tuple[str, int]:
+    """
+    返回 (url, 缓存时间)
+    """
+    storage = UploadedFile._meta.get_field("file").storage
+    # 对象存储为本地签名计算, 不涉及网络请求
+    url = storage.url(meta["name"])
+    expire_time = getattr(storage, "expire_time", None)
+    return url, int(expire_time * (1 - URL_REFRESH_MARGIN)) if expire_time else FILE_META_EXPIRE
+
+
+async def get_file_url(meta: Dict, cached: Optional[str] = None) -> str:
+    url = cached or await AsyncRedisUtil.r.get(file_url_key(meta["id"]), encoding="utf-8")
+    if url:
+        return url
+    url, expire = _sign_url(meta)
+    if expire > 0:
+        await AsyncRedisUtil.r.set(file_url_key(meta["id"]), url, expire=expire)
+    return url
+
+
+async def get_file_urls(file_ids: Iterable[int]) -> Dict[int, str]:
+    """
+    批量获取 URL, 文件不存在时不返回
+    """
+    file_ids = set(file_ids)
+    cached = await AsyncRedisUtil.mget_many(
+        [key for file_id in file_ids for key in (file_key(file_id), file_url_key(file_id))], decode=str
+    )
+    urls = {}
+    for file_id in file_ids:
+        meta = await get_file_meta(file_id, cached[file_key(file_id)])
+        if meta:
+            urls[file_id] = await get_file_url(meta, cached[file_url_key(file_id)])
+    return urls
+
+
+def get_file_urls_sync(file_ids: Iterable[int]) -> Dict[int, str]:
+    """
+    get_file_urls 的同步版本, 用于同步视图
+    """
+    file_ids = set(file_ids)
+    cached = RedisUtil.mget_many(
+        [key for file_id in file_ids for key in (file_key(file_id), file_url_key(file_id))], decode=str
+    )
+    urls, metas = {}, {}
+    for file_id in file_ids:
+        if cached[file_url_key(file_id)]:
+            urls[file_id] = cached[file_url_key(file_id)]
+        elif cached[file_key(file_id)]:
+            metas[file_id] = ujson.loads(cached[file_key(file_id)])
+    uncached = file_ids - urls.keys() - metas.keys()
+    if uncached:
+        for instance in UploadedFile.objects.filter(id__in=uncached):
+            metas[instance.id] = serialize_file_meta(instance)
+    signed, expires = {}, {}
+    for file_id, meta in metas.items():
+        urls[file_id], expire = _sign_url(meta)
+        if expire > 0:
+            signed[file_url_key(file_id)], expires[file_url_key(file_id)] = urls[file_id], expire
+    RedisUtil.set_many(signed, exps=expires)
+    return urls
+
+
+async def get_file_content(profile_id: int, file_id: int) -> Optional[defines.message_content.FileContent]:
+    """
+    只能发送自己上传的文件, 文件不存在或为空时返回 None
+    """
+    # 元数据与 URL 一次往返读取
+    cached = await AsyncRedisUtil.mget_many([file_key(file_id), file_url_key(file_id)], decode=str)
+    meta = await get_file_meta(file_id, cached[file_key(file_id)])
+    if not meta or meta["profile_id"] != profile_id or meta["size"] <= 0:
+        return None
+    url = await get_file_url(meta, cached[file_url_key(file_id)])
+    return defines.message_content.FileContent(
+        id=meta["id"], url=url, label=meta["label"], size=meta["size"], extension=meta["extension"]
+    )
+
+
+def stored_file_content(content: defines.message_content.FileContent) -> Dict:
+    """
+    持久化的文件消息内容, 不含 URL
+    """
+    return {key: value for key, value in content.items() if key != "url"}
+
+
+def _file_contents(messages: List[Dict], type_field: str, content_field: str) -> List[Dict]:
+    return [
+        message[content_field]
+        for message in messages
+        if message.get(type_field) in FILE_MESSAGE_TYPES
+        and isinstance(message.get(content_field), dict)
+        and str(message[content_field].get("id", "")).isdigit()
+    ]
+
+
+def sign_history_files(messages: List[Dict]):
+    """
+    历史消息(history.serialize_message)中的文件内容填充当前有效的 URL, 文件已删除时为 None
+    """
+    contents = _file_contents(messages, "type", "value")
+    urls = get_file_urls_sync(int(content["id"]) for content in contents) if contents else {}
+    for content in contents:
+        content["url"] = urls.get(int(content["id"]))
+
+
+async def sign_reply_files(replies: List[Dict]):
+    """
+    离线消息(ServiceReplyData)中的文件内容填充当前有效的 URL, 文件已删除时为 None
+    """
+    contents = _file_contents(replies, "message_type", "content")
+    urls = await get_file_urls(int(content["id"]) for content in contents) if contents else {}
+    for content in contents:
+        content["url"] = urls.get(int(content["id"]))
@@ -1,50 +1,130 @@
+import asyncio
 import logging
 import datetime
-from typing import Set, Optional
+import functools
+from typing import Set, Dict, List, Tuple, Optional
 
 import storages.relational.models.chat
 from storages.redis import AsyncRedisUtil, keys
 from apis.chat.consumers import defines
 from apis.chat.consumers.mixins import ServerReply
-from storages.relational.models import UploadedFile
-from apis.chat.consumers.db_operations import (
-    get_receiver,
-    save_message,
-    get_chat_instance,
-    get_user_file_with_pk,
-    update_unread_messages,
-)
+from apis.chat.consumers.inbox import STREAM_ID_PATTERN, ack_inbox, append_inbox
+from apis.chat.consumers.unread import incr_unread, reset_unread
+from apis.chat.consumers.limiter import EPHEMERAL_MESSAGE_TYPES
+from apis.chat.consumers.history import append_message
+from apis.chat.consumers.receipt import mark_group_read
+from apis.chat.consumers.validators import CONTENT_CHECKERS
+from apis.chat.consumers.files import get_file_content, stored_file_content
+from apis.chat.consumers.db_operations import save_message, update_unread_messages
 
 logger = logging.getLogger("chat.consumers.handler")
 
 
-class BaseHandler:
+async def get_profile_channel_names(profile_id: int) -> List[str]:
+    """
+    用户全部在线设备的 channel name
+    """
+    channel_names = await AsyncRedisUtil.r.mget(
+        *[
+            keys.RedisCacheKey.ProfileConnectionKey.format(profile_id=profile_id, device_code=device_code.value)
+            for device_code in defines.device.DeviceCode
+        ],
+        encoding="utf-8",
+    )
+    return [channel_name for channel_name in channel_names if channel_name]
+
+
+async def send_unread_count(
+    consumer: ServerReply, profile_id: int, chat_instance_id: int, message_id: int, count: int
+):
+    for channel_name in await get_profile_channel_names(profile_id):
+        await consumer.channel_layer.send(
+            channel_name,
+            defines.channels_message.ChannelsUnreadCountData(
+                type="unread.count",
+                content=defines.message_content.MessageUnreadCount(
+                    chat_instance_id=chat_instance_id, message_id=message_id, count=count
+                ),
+            ),
+        )
+
+
+class HandlerMeta(type):
+    """
+    类创建时生成分发表: (chat_type, message_type): (ChatType, MessageType, handle_xxx, content 校验函数)
+    """
+
+    def __new__(mcs, name, bases, attrs):
+        cls = super().__new__(mcs, name, bases, attrs)
+        cls.dispatch_table = {}
+        for chat_type in defines.chat_type.ChatType:
+            if chat_type.value not in cls.support_chat_type:
+                continue
+            for message_type in defines.message_type.ClientMessageType:
+                if message_type.value not in cls.support_message_type:
+                    continue
+                message_handler = getattr(cls, f"handle_{message_type.value}", None)
+                if not message_handler:
+                    continue
+                cls.dispatch_table[(chat_type.value, message_type.value)] = (
+                    chat_type,
+                    defines.message_type.MessageType(message_type.value),
+                    message_handler,
+                    CONTENT_CHECKERS.get(message_type.value),
+                )
+        return cls
+
+
+class BaseHandler(metaclass=HandlerMeta):
     """
     处理 和 转发
     """
 
     support_chat_type: Set = {i.value for i in defines.chat_type.ChatType}
     support_message_type: Set = {i.value for i in defines.message_type.ClientMessageType}
+    dispatch_table: Dict[Tuple[str, str], Tuple] = {}
+    _warming_relations: Set = set()
 
-    async def handle(self, consumer: ServerReply, content: defines.client_schema.MessageSchema, **kwargs):
-
-        current_chat_type = content.get("chat_type")
-        # chatType校验
+    def _unsupported(self, current_chat_type, current_message_type) -> defines.exceptions.ServiceException:
         if current_chat_type not in self.support_chat_type:
             logger.warning(f"UnSupported chat type: {current_chat_type}")
-            raise defines.exceptions.ServiceException(
+            return defines.exceptions.ServiceException(
                 code=defines.service.Code.UnSupportedType, message=defines.service.Message.UnSupportedType % "chatType"
             )
-        current_chat_type = defines.chat_type.ChatType(current_chat_type)
-        # messageType 校验
-        current_message_type = content.get("message_type")
         if current_message_type not in self.support_message_type:
             logger.warning(f"UnSupported message type: {current_message_type}")
-            raise defines.exceptions.ServiceException(
+            return defines.exceptions.ServiceException(
                 code=defines.service.Code.UnSupportedType,
                 message=defines.service.Message.UnSupportedType % "messageType",
             )
-        current_message_type = defines.message_type.MessageType(current_message_type)
+        logger.warning(f"No handler for message type: {current_message_type}")
+        return defines.exceptions.ServiceException(
+            code=defines.service.Code.UnSupportedType, message=defines.service.Message.UnSupportedType % "消息"
+        )
+
+    async def handle(self, consumer: ServerReply, content: defines.client_schema.MessageSchema, **kwargs):
+        current_chat_type = content.get("chat_type")
+        current_message_type = content.get("message_type")
+        try:
+            dispatch = self.dispatch_table.get((current_chat_type, current_message_type))
+        except TypeError:  # 不可哈希的值
+            dispatch = None
+        if dispatch is None:
+            raise self._unsupported(current_chat_type, current_message_type)
+        current_chat_type, current_message_type, message_handler, checker = dispatch
+        if current_message_type.value in EPHEMERAL_MESSAGE_TYPES:
+            await self.handle_ephemeral(
+                consumer, current_chat_type, current_message_type, message_handler, content, **kwargs
+            )
+            return
+
+        # content 校验
+        value = content.get("content")
+        if not value or (checker is not None and not checker(value)):
+            logger.warning(f"Invalid content for message type: {current_message_type.value}")
+            raise defines.exceptions.ServiceException(
+                code=defines.service.Code.UnSupportedType, message=defines.service.Message.UnSupportedType % "消息"
+            )
 
         # 接收者校验
         receiver_id = content.get("receiver_id")
@@ -52,15 +132,21 @@ class BaseHandler:
             chat_instance_id = None
             related_id = None
         else:
-            chat_instance = await get_chat_instance(current_chat_type, consumer.profile.pk, receiver_id)
-            if not chat_instance:
+            try:
+                receiver_id = int(receiver_id)
+            except (TypeError, ValueError):
+                logger.warning(f"Invalid receiver id: {receiver_id}")
+                raise defines.exceptions.ServiceException(
+                    code=defines.service.Code.ReceiverNotExists, message=defines.service.Message.ReceiverNotExists,
+                )
+            # 关系存在则接收方必然存在(外键级联), 无需再查询接收方
+            chat_instance_id = await consumer.relation_cache.get_chat_instance_id(current_chat_type, receiver_id)
+            if not chat_instance_id:
                 logger.warning(f"Relation doesnt exists: {current_chat_type}-{consumer.profile.pk}-{receiver_id}")
                 raise defines.exceptions.ServiceException(
                     code=defines.service.Code.RelationShipNotExists,
                     message=defines.service.Message.RelationShipNotExists,
                 )
-            chat_instance_id = chat_instance.id
-            receiver = await get_receiver(current_chat_type, receiver_id)
             if current_chat_type == defines.chat_type.ChatType.Dialog:
                 if receiver_id == consumer.profile.id:
                     logger.warning(f"Forbidden action: send to self")
@@ -68,23 +154,61 @@ class BaseHandler:
                         code=defines.service.Code.ForbiddenAction,
                         message=defines.service.Message.ForbiddenAction % "给自己发送消息",
                     )
-            related_id = receiver.id
-        message_handler = getattr(self, f"handle_{current_message_type.value}")
-        if not message_handler:
-            logger.warning(f"No handler for message type: {current_message_type.value}")
-            raise defines.exceptions.ServiceException(
-                code=defines.service.Code.UnSupportedType, message=defines.service.Message.UnSupportedType % "消息"
-            )
-        value = content.get("content")
-        if not value:
-            logger.warning(f"client send empty content")
-            raise defines.exceptions.ServiceException(
-                code=defines.service.Code.UnSupportedType, message=defines.service.Message.UnSupportedType % "消息"
-            )
+            related_id = receiver_id
         await message_handler(
-            current_chat_type, current_message_type, value, consumer, chat_instance_id, related_id, **kwargs
+            self, current_chat_type, current_message_type, value, consumer, chat_instance_id, related_id, **kwargs
+        )
+
+    async def handle_ephemeral(
+        self, consumer: ServerReply, current_chat_type, current_message_type, message_handler, content, **kwargs
+    ):
+        """
+        临时事件快速通道: 不落库、不查库, 关系只查缓存, 校验失败静默丢弃, 按接收方合并后投递
+        """
+        if current_chat_type != defines.chat_type.ChatType.Dialog:
+            # 只有私聊的时候才有 typing 和 stop_typing
+            return
+        try:
+            receiver_id = int(content.get("receiver_id"))
+        except (TypeError, ValueError):
+            return
+        if receiver_id == consumer.profile.id:
+            return
+        chat_instance_id = await consumer.relation_cache.get_chat_instance_id(
+            current_chat_type, receiver_id, load=False
+        )
+        if not chat_instance_id:
+            # 关系未缓存时丢弃本次事件, 在后台加载关系供后续事件使用
+            warming_key = (consumer.profile.id, current_chat_type, receiver_id)
+            if warming_key not in self._warming_relations:
+                self._warming_relations.add(warming_key)
+                asyncio.get_running_loop().create_task(self._warm_relation(consumer, warming_key))
+            return
+        await consumer.ephemeral_coalescer.submit(
+            (current_chat_type, receiver_id),
+            current_message_type.value,
+            functools.partial(
+                message_handler,
+                self,
+                current_chat_type,
+                current_message_type,
+                content.get("content"),
+                consumer,
+                chat_instance_id,
+                receiver_id,
+                **kwargs,
+            ),
         )
 
+    async def _warm_relation(self, consumer: ServerReply, warming_key):
+        _, chat_type, receiver_id = warming_key
+        try:
+            await consumer.relation_cache.get_chat_instance_id(chat_type, receiver_id)
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            self._warming_relations.discard(warming_key)
+
     @staticmethod
     async def transfer_message(
         current_chat_type, current_message_type, value, consumer: ServerReply, related_id, **kwargs
@@ -106,29 +230,39 @@ class BaseHandler:
                 ),
             )
         elif current_chat_type == defines.chat_type.ChatType.Dialog:
-            for device_code in defines.device.DeviceCode:
-                channel_name = await AsyncRedisUtil.r.get(
-                    keys.RedisCacheKey.ProfileConnectionKey.format(
-                        profile_id=related_id, device_code=device_code.value
-                    ),
-                    encoding="utf-8",
-                )
-                if channel_name:
-                    await consumer.channel_layer.send(
-                        channel_name,
-                        defines.channels_message.ChannelsMessageData(
-                            type="group.message",
-                            content=consumer.gen_reply(
-                                code=defines.service.Code.Success,
-                                message_type=current_message_type,
-                                chat_type=current_chat_type,
-                                sender_info=await consumer.gen_sender_info(),
-                                context=channel_name,
-                                time=kwargs["message_time"],
-                                content=value,
-                            ),
+            channel_names = await get_profile_channel_names(related_id)
+            if not channel_names:
+                # 接收方全部设备离线, 存入离线收件箱, 临时事件直接丢弃
+                if current_message_type.value not in EPHEMERAL_MESSAGE_TYPES:
+                    await append_inbox(
+                        related_id,
+                        consumer.gen_reply(
+                            code=defines.service.Code.Success,
+                            message_type=current_message_type,
+                            chat_type=current_chat_type,
+                            sender_info=await consumer.gen_sender_info(),
+                            context="",  # 推送时填充为接收连接的 channel name
+                            time=kwargs["message_time"],
+                            content=kwargs.get("stored_value", value),
                         ),
                     )
+                return
+            for channel_name in channel_names:
+                await consumer.channel_layer.send(
+                    channel_name,
+                    defines.channels_message.ChannelsMessageData(
+                        type="group.message",
+                        content=consumer.gen_reply(
+                            code=defines.service.Code.Success,
+                            message_type=current_message_type,
+                            chat_type=current_chat_type,
+                            sender_info=await consumer.gen_sender_info(),
+                            context=channel_name,
+                            time=kwargs["message_time"],
+                            content=value,
+                        ),
+                    ),
+                )
         else:
             raise defines.exceptions.ServiceException(
                 code=defines.service.Code.UnSupportedType, message=defines.service.Message.UnSupportedType % "持久化信息类型"
@@ -154,16 +288,54 @@ class BaseHandler:
         )
         return message
 
+    @staticmethod
+    async def notify_unread(current_chat_type, consumer: ServerReply, chat_instance_id, related_id, message_id):
+        """
+        私聊接收方未读数 +1 并推送到其全部设备
+        """
+        if current_chat_type != defines.chat_type.ChatType.Dialog:
+            return
+        count = await incr_unread(related_id, current_chat_type, chat_instance_id, message_id)
+        await send_unread_count(consumer, related_id, chat_instance_id, message_id, count)
+
+    async def save_and_transfer(
+        self,
+        current_chat_type,
+        current_message_type,
+        value,
+        consumer,
+        chat_instance_id,
+        related_id,
+        transfer_value=None,
+    ):
+        """
+        transfer_value: 实时推送的内容, 默认与持久化的 value 相同
+        """
+        message = await self.save_message(
+            current_chat_type, current_message_type, value, consumer, chat_instance_id, related_id
+        )
+        # 先写入历史缓存再推送, 收到推送的客户端拉取历史时能看到该消息
+        history_id = related_id if current_chat_type == defines.chat_type.ChatType.Group else chat_instance_id
+        await append_message(current_chat_type, history_id, message)
+        await self.transfer_message(
+            current_chat_type,
+            current_message_type,
+            value if transfer_value is None else transfer_value,
+            consumer,
+            related_id,
+            message_time=message.create_time,
+            stored_value=value,
+        )
+        await self.notify_unread(current_chat_type, consumer, chat_instance_id, related_id, message.id)
+        return message
+
     async def handle_text(
         self, current_chat_type, current_message_type, value, consumer, chat_instance_id, related_id, **kwargs
     ):
         if current_chat_type in [defines.chat_type.ChatType.Group, defines.chat_type.ChatType.Dialog]:
-            message = await self.save_message(
+            await self.save_and_transfer(
                 current_chat_type, current_message_type, value, consumer, chat_instance_id, related_id
             )
-            await self.transfer_message(
-                current_chat_type, current_message_type, value, consumer, related_id, message_time=message.create_time
-            )
         else:
             # system 处理
             pass
@@ -172,12 +344,9 @@ class BaseHandler:
         self, current_chat_type, current_message_type, value, consumer, chat_instance_id, related_id, **kwargs
     ):
         if current_chat_type in [defines.chat_type.ChatType.Group, defines.chat_type.ChatType.Dialog]:
-            message = await self.save_message(
+            await self.save_and_transfer(
                 current_chat_type, current_message_type, value, consumer, chat_instance_id, related_id
             )
-            await self.transfer_message(
-                current_chat_type, current_message_type, value, consumer, related_id, message_time=message.create_time
-            )
         else:
             # system 处理
             pass
@@ -194,16 +363,20 @@ class BaseHandler:
                     message=defines.service.Message.UnSupportedType % "content",
                 )
 
-            file_instance: UploadedFile = await get_user_file_with_pk(consumer.profile.id, file_id)
-            if not file_instance or file_instance.size <= 0:
+            # 消息内容以缓存的文件信息为准, 不使用客户端上传的内容; 签名 URL 只随实时推送下发, 不持久化
+            file_content = await get_file_content(consumer.profile.id, file_id)
+            if not file_content:
                 raise defines.exceptions.ServiceException(
                     code=defines.service.Code.FileDoesNotExist, message=defines.service.Message.FileDoesNotExist
                 )
-            message = await self.save_message(
-                current_chat_type, current_message_type, value, consumer, chat_instance_id, related_id
-            )
-            await self.transfer_message(
-                current_chat_type, current_message_type, value, consumer, related_id, message_time=message.create_time
+            await self.save_and_transfer(
+                current_chat_type,
+                current_message_type,
+                stored_file_content(file_content),
+                consumer,
+                chat_instance_id,
+                related_id,
+                transfer_value=file_content,
             )
         else:
             # system 处理
@@ -234,12 +407,9 @@ class BaseHandler:
         self, current_chat_type, current_message_type, value, consumer, chat_instance_id, related_id, **kwargs
     ):
         if current_chat_type in [defines.chat_type.ChatType.Group, defines.chat_type.ChatType.Dialog]:
-            message = await self.save_message(
+            await self.save_and_transfer(
                 current_chat_type, current_message_type, value, consumer, chat_instance_id, related_id
             )
-            await self.transfer_message(
-                current_chat_type, current_message_type, value, consumer, related_id, message_time=message.create_time
-            )
         else:
             # system 处理
             pass
@@ -293,6 +463,9 @@ class BaseHandler:
             私聊已读
             """
             await update_unread_messages(chat_instance_id, consumer.profile.id, value["message_id"])
+            await reset_unread(consumer.profile.id, current_chat_type, chat_instance_id)
+            # 同步到自己的其他设备
+            await send_unread_count(consumer, consumer.profile.id, chat_instance_id, value["message_id"], 0)
             await self.transfer_message(
                 current_chat_type,
                 current_message_type,
@@ -303,9 +476,25 @@ class BaseHandler:
             )
         elif current_chat_type == defines.chat_type.ChatType.Group:
             """
-            群聊已读
+            群聊已读, 只更新已读水位, 不逐条通知群成员, 已读人数通过接口查询
             """
-            pass
+            await mark_group_read(related_id, consumer.profile.id, value["message_id"])
         else:
             # 非系统类型
             pass
+
+    async def handle_inbox_ack(
+        self, current_chat_type, current_message_type, value, consumer, chat_instance_id, related_id, **kwargs
+    ):
+        if current_chat_type == defines.chat_type.ChatType.SystemCenter:
+            """
+            确认离线消息, 删除已收到的部分
+            """
+            if not STREAM_ID_PATTERN.match(value["id"]):
+                raise defines.exceptions.ServiceException(
+                    code=defines.service.Code.UnSupportedType,
+                    message=defines.service.Message.UnSupportedType % "content",
+                )
+            await ack_inbox(consumer.profile.id, value["id"])
+        else:
+            pass
@@ -0,0 +1,110 @@
+"""
+最近消息缓存
+    Chat:History:{chat_type}:{chat_id} 列表保存最新的 HISTORY_CACHE_SIZE 条消息(新消息在前), 发送时追加
+    Dialog 的 chat_id 为 Dialog.id, Group 的 chat_id 为 Group.id
+    缓存始终是最新的一段连续消息, 不足的部分按 id 倒序从数据库分页读取
+"""
+import logging
+from typing import Dict, List, Union, Optional
+
+import ujson
+
+from common.utils import COMMON_TIME_STRING
+from storages.redis import RedisUtil, AsyncRedisUtil, keys
+from apis.chat.consumers import defines
+from storages.relational.models import GroupMessage, DialogMessage
+
+logger = logging.getLogger("chat.consumers.history")
+
+HISTORY_CACHE_SIZE = 50
+HISTORY_CACHE_EXPIRE = 60 * 60 * 24
+HISTORY_PAGE_SIZE = 20
+
+# 缓存不存在时才回填, 避免覆盖并发追加的新消息; KEYS: history list; ARGV: expire, size, *messages
+BACKFILL_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    return 0
+end
+for i = 3, #ARGV do
+    redis.call("RPUSH", KEYS[1], ARGV[i])
+end
+redis.call("LTRIM", KEYS[1], 0, tonumber(ARGV[2]) - 1)
+redis.call("EXPIRE", KEYS[1], ARGV[1])
+return 1
+"""
+
+
+def history_key(chat_type: defines.chat_type.ChatType, chat_id: int) -> str:
+    return keys.RedisCacheKey.ChatHistoryKey.format(chat_type=chat_type.value, chat_id=chat_id)
+
+
+def serialize_message(chat_type: defines.chat_type.ChatType, message: Union[GroupMessage, DialogMessage]) -> Dict:
+    return {
+        "id": message.id,
+        "sender_id": message.profile_id if chat_type == defines.chat_type.ChatType.Group else message.sender_id,
+        "type": getattr(message.type, "value", message.type),
+        "value": message.value,
+        "create_time": message.create_time.strftime(COMMON_TIME_STRING),
+    }
+
+
+async def append_message(
+    chat_type: defines.chat_type.ChatType, chat_id: int, message: Union[GroupMessage, DialogMessage]
+):
+    key = history_key(chat_type, chat_id)
+    pipe = AsyncRedisUtil.r.pipeline()
+    pipe.lpush(key, ujson.dumps(serialize_message(chat_type, message)))
+    pipe.ltrim(key, 0, HISTORY_CACHE_SIZE - 1)
+    pipe.expire(key, HISTORY_CACHE_EXPIRE)
+    await pipe.execute()
+
+
+def _query_messages(
+    chat_type: defines.chat_type.ChatType, chat_id: int, before_id: Optional[int], limit: int
+) -> List[Dict]:
+    """
+    按 id 倒序的 keyset 分页, 使用 dialog/group 外键索引
+    """
+    if chat_type == defines.chat_type.ChatType.Group:
+        queryset = GroupMessage.objects.filter(group_id=chat_id)
+    else:
+        queryset = DialogMessage.objects.filter(dialog_id=chat_id)
+    if before_id:
+        queryset = queryset.filter(id__lt=before_id)
+    return [serialize_message(chat_type, message) for message in queryset.order_by("-id")[:limit]]
+
+
+def get_history(
+    chat_type: defines.chat_type.ChatType, chat_id: int, before_id: Optional[int] = None, limit: int = HISTORY_PAGE_SIZE
+) -> List[Dict]:
+    """
+    返回 id 小于 before_id 的最新 limit 条消息, 新消息在前
+    """
+    key = history_key(chat_type, chat_id)
+    cached = RedisUtil.r.lrange(key, 0, -1)
+    if not cached and not before_id:
+        messages = _query_messages(chat_type, chat_id, None, HISTORY_CACHE_SIZE)
+        if messages:
+            RedisUtil.r.eval(
+                BACKFILL_SCRIPT,
+                1,
+                key,
+                HISTORY_CACHE_EXPIRE,
+                HISTORY_CACHE_SIZE,
+                *[ujson.dumps(message) for message in messages],
+            )
+        return messages[:limit]
+
+    messages, seen = [], set()
+    for item in cached:
+        message = ujson.loads(item)
+        # 回填与追加并发时可能重复
+        if message["id"] in seen or (before_id and message["id"] >= before_id):
+            continue
+        seen.add(message["id"])
+        messages.append(message)
+        if len(messages) >= limit:
+            return messages
+    if messages:
+        before_id = messages[-1]["id"]
+    return messages + _query_messages(chat_type, chat_id, before_id, limit - len(messages))
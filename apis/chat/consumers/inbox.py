@@ -0,0 +1,58 @@
+"""
+离线收件箱
+    Profile:Inbox:{profile_id} Stream, 私聊接收方全部设备离线时追加, 长度上限 INBOX_MAXLEN(近似裁剪)
+    重连后一次性推送全部离线消息, 客户端回复 inbox_ack 后删除已确认的部分, 未确认的下次重连再推送
+"""
+import re
+import logging
+from typing import List, Tuple, Optional
+
+import ujson
+
+from conf.config import local_configs
+from storages.redis import AsyncRedisUtil, keys
+
+logger = logging.getLogger("chat.consumers.inbox")
+
+STREAM_ID_PATTERN = re.compile(r"^\d+-\d+$")
+
+# 删除 id 不大于 ARGV[1] 的消息; KEYS: inbox stream
+ACK_SCRIPT = """
+local entries = redis.call("XRANGE", KEYS[1], "-", ARGV[1])
+for _, entry in ipairs(entries) do
+    redis.call("XDEL", KEYS[1], entry[1])
+end
+if redis.call("XLEN", KEYS[1]) == 0 then
+    redis.call("DEL", KEYS[1])
+end
+return #entries
+"""
+
+
+def inbox_key(profile_id: int) -> str:
+    return keys.RedisCacheKey.ProfileInboxKey.format(profile_id=profile_id)
+
+
+async def append_inbox(profile_id: int, reply: dict):
+    key = inbox_key(profile_id)
+    pipe = AsyncRedisUtil.r.pipeline()
+    pipe.xadd(key, {"data": ujson.dumps(reply)}, max_len=local_configs.CHAT.INBOX_MAXLEN)
+    pipe.expire(key, local_configs.CHAT.INBOX_EXPIRE)
+    await pipe.execute()
+
+
+async def read_inbox(profile_id: int) -> Tuple[Optional[str], List[dict]]:
+    """
+    返回 (最后一条消息 id, 全部离线消息), 按时间正序
+    """
+    entries = await AsyncRedisUtil.r.xrange(inbox_key(profile_id), count=local_configs.CHAT.INBOX_MAXLEN)
+    if not entries:
+        return None, []
+    return entries[-1][0].decode(), [ujson.loads(fields[b"data"]) for _, fields in entries]
+
+
+async def ack_inbox(profile_id: int, last_id: str) -> int:
+    """
+    返回删除的消息数
+    """
+    return await AsyncRedisUtil.r.eval(ACK_SCRIPT, keys=[inbox_key(profile_id)], args=[last_id])
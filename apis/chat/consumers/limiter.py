@@ -0,0 +1,113 @@
+"""
+入站限流
+    连接级、用户级(进程内共享)令牌桶, 可选 Redis 用户级令牌桶做跨进程限流
+    令牌不足时先丢弃 typing 等临时事件, 令牌耗尽后拒绝其他消息
+"""
+import time
+import enum
+import logging
+from typing import Optional
+
+from cachetools import TTLCache
+
+from conf.config import local_configs
+from storages.redis import AsyncRedisUtil, keys
+from apis.chat.consumers import defines
+
+logger = logging.getLogger("chat.consumers.limiter")
+
+EPHEMERAL_MESSAGE_TYPES = {
+    defines.message_type.MessageType.Typing.value,
+    defines.message_type.MessageType.StopTyping.value,
+}
+
+# KEYS: bucket hash; ARGV: rate, capacity, now(ms), requested
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) / 1000 * rate)
+local allowed = 0
+if tokens >= requested then
+    tokens = tokens - requested
+    allowed = 1
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", ARGV[3])
+redis.call("PEXPIRE", KEYS[1], math.ceil(capacity / rate * 1000))
+return allowed
+"""
+
+
+class FrameDecision(enum.Enum):
+    Accept = "accept"
+    Drop = "drop"  # 静默丢弃
+    Reject = "reject"  # 回复错误
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def consume(self, tokens: float = 1, reserve: float = 0) -> bool:
+        """
+        扣减后剩余令牌不低于 reserve 时扣减成功
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens - tokens < reserve:
+            return False
+        self.tokens -= tokens
+        return True
+
+
+class InboundLimiter:
+    """
+    单连接入站限流
+    """
+
+    _profile_buckets = TTLCache(maxsize=100000, ttl=600)  # profile_id: TokenBucket
+
+    def __init__(self, profile_id: int, config=None):
+        self.config = config or local_configs.CHAT
+        self.profile_id = profile_id
+        self.connection_bucket = TokenBucket(self.config.CONNECTION_RATE, self.config.CONNECTION_BURST)
+
+    @property
+    def profile_bucket(self) -> TokenBucket:
+        bucket = self._profile_buckets.get(self.profile_id)
+        if bucket is None:
+            bucket = TokenBucket(self.config.PROFILE_RATE, self.config.PROFILE_BURST)
+            self._profile_buckets[self.profile_id] = bucket
+        return bucket
+
+    async def _consume_redis(self) -> bool:
+        return bool(
+            await AsyncRedisUtil.r.eval(
+                TOKEN_BUCKET_SCRIPT,
+                keys=[keys.RedisCacheKey.ChatRateLimitKey.format(profile_id=self.profile_id)],
+                args=[self.config.PROFILE_RATE, self.config.PROFILE_BURST, int(time.time() * 1000), 1],
+            )
+        )
+
+    async def check(self, message_type: Optional[str]) -> FrameDecision:
+        ephemeral = message_type in EPHEMERAL_MESSAGE_TYPES
+        connection_reserve = self.connection_bucket.capacity * self.config.EPHEMERAL_RESERVE_RATIO if ephemeral else 0
+        if not self.connection_bucket.consume(reserve=connection_reserve):
+            return FrameDecision.Drop if ephemeral else FrameDecision.Reject
+        profile_bucket = self.profile_bucket
+        profile_reserve = profile_bucket.capacity * self.config.EPHEMERAL_RESERVE_RATIO if ephemeral else 0
+        if not profile_bucket.consume(reserve=profile_reserve):
+            return FrameDecision.Drop if ephemeral else FrameDecision.Reject
+        if self.config.REDIS_RATE_LIMIT and not ephemeral and not await self._consume_redis():
+            return FrameDecision.Reject
+        return FrameDecision.Accept
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from abc import ABC
 from typing import Any, Union, Optional
@@ -9,9 +10,18 @@ from channels_redis.core import RedisChannelLayer
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 
 from common.utils import COMMON_TIME_STRING
+from conf.config import local_configs
 from storages.redis import AsyncRedisUtil, keys
-from apis.chat.consumers import defines
+from apis.chat.consumers import defines, presence
+from apis.chat.consumers.files import sign_reply_files
+from apis.chat.consumers.inbox import read_inbox
+from apis.chat.consumers.unread import get_all_unread
 from storages.relational.models import Group, Profile
+from storages.redis.client_cache import profile_group_cache
+from apis.chat.consumers.limiter import EPHEMERAL_MESSAGE_TYPES, FrameDecision, InboundLimiter
+from apis.chat.consumers.codec import DEFAULT_CODEC, JsonCodec, negotiate_codec
+from apis.chat.consumers.relation import RelationCache
+from apis.chat.consumers.ephemeral import EphemeralCoalescer
 from apis.chat.consumers.decorator import authenticate_required
 from apis.chat.consumers.db_operations import get_system_sender, get_group_ids_with_profile_pk
 
@@ -19,6 +29,14 @@ logger = logging.getLogger("chat.consumers.mixins")
 
 
 class AsyncUJsonWebsocketConsumer(AsyncJsonWebsocketConsumer):
+    """
+    ujson 编解码, 连接可协商其他帧编码(见 codec); 开启发送队列后, 消息经由有界队列按序发送
+    """
+
+    codec: JsonCodec = DEFAULT_CODEC
+    outbound_queue: Optional[asyncio.Queue] = None
+    _outbound_task: Optional[asyncio.Task] = None
+
     @classmethod
     async def decode_json(cls, text_data):
         return ujson.loads(text_data)
@@ -27,11 +45,48 @@ class AsyncUJsonWebsocketConsumer(AsyncJsonWebsocketConsumer):
     async def encode_json(cls, content):
         return ujson.dumps(content)
 
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        data = text_data or bytes_data
+        if not data:
+            raise ValueError("No data section for incoming WebSocket frame!")
+        await self.receive_json(self.codec.decode(data), **kwargs)
+
     async def interrupt(self, code: defines.service.Code):
         logger.warning(f"disconnect with code: {code.value}")
         await self.disconnect(code.value)
         raise StopConsumer()
 
+    def start_outbound(self, maxsize: int):
+        self.outbound_queue = asyncio.Queue(maxsize=maxsize)
+        self._outbound_task = asyncio.get_running_loop().create_task(self._drain_outbound())
+
+    def stop_outbound(self):
+        if self._outbound_task:
+            self._outbound_task.cancel()
+        self.outbound_queue, self._outbound_task = None, None
+
+    async def _drain_outbound(self):
+        while True:
+            text_data, bytes_data = await self.outbound_queue.get()
+            try:
+                await super().send(text_data=text_data, bytes_data=bytes_data)
+            except Exception as e:
+                logger.exception(e)
+
+    async def send(self, text_data=None, bytes_data=None, close=False, ephemeral: bool = False):
+        """
+        队列满时: 临时事件直接丢弃, 其他消息等待, 进而由 channel layer 的容量限制向上游施加背压
+        """
+        if self.outbound_queue is None or close:
+            return await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+        if ephemeral:
+            try:
+                self.outbound_queue.put_nowait((text_data, bytes_data))
+            except asyncio.QueueFull:
+                logger.debug("outbound queue full, ephemeral message dropped")
+            return
+        await self.outbound_queue.put((text_data, bytes_data))
+
     # to disconnect
 
 
@@ -43,6 +98,9 @@ class ConnectManageConsumer(AsyncUJsonWebsocketConsumer):
     profile: Profile
     device_code: defines.device.DeviceCode
     receiver: Union[Profile, Group, defines.message_content.SenderInfo]
+    relation_cache: RelationCache
+    inbound_limiter: InboundLimiter
+    ephemeral_coalescer: Optional[EphemeralCoalescer] = None
     channel_layer: RedisChannelLayer
     channel_name: str
 
@@ -55,6 +113,9 @@ class ConnectManageConsumer(AsyncUJsonWebsocketConsumer):
             logger.warning(f"{profile.id} connect with unknown device_code: {device_code}")
             await self.interrupt(code=defines.service.Code.DeviceRestrict)
         self.device_code = defines.device.DeviceCode(device_code)
+        self.relation_cache = RelationCache(profile.id)
+        self.inbound_limiter = InboundLimiter(profile.id)
+        self.ephemeral_coalescer = EphemeralCoalescer(local_configs.CHAT.TYPING_DEBOUNCE)
         # if await AsyncRedisUtil.r.get(
         #     keys.RedisCacheKey.ProfileConnectionKey.format(profile_id=self.profile.id, device_code=device_code)
         # ):
@@ -64,24 +125,24 @@ class ConnectManageConsumer(AsyncUJsonWebsocketConsumer):
 
     async def post_accept(self):
         # 设置在线
-        await AsyncRedisUtil.r.setbit(
-            keys.RedisCacheKey.ProfileOnlineKey.format(profile_id=self.profile.id), self.profile.id, 1
-        )
+        await presence.online(self.profile.id, self.channel_name)
         # 添加连接信息，防止重复连接
         await AsyncRedisUtil.r.set(
             keys.RedisCacheKey.ProfileConnectionKey.format(
                 profile_id=self.profile.id, device_code=self.device_code.value
             ),
             self.channel_name,
-            expire=61,
+            expire=presence.CONNECTION_EXPIRE,
         )
+        # 连接信息和在线状态由心跳定时续期
+        presence.ConnectionHeartbeat.register(self.profile.id, self.device_code.value, self.channel_name)
         # 加入系统群组
         await self.channel_layer.group_add(
             defines.chat_type.ChatTypeContextFormatKey.SystemCenter.value, self.channel_name
         )
         # 加入用户的群组
-        for group_id in await AsyncRedisUtil.r.smembers(
-            keys.RedisCacheKey.ProfileGroupSet.format(profile_id=self.profile.id), encoding="utf-8"
+        for group_id in await profile_group_cache.asmembers(
+            keys.RedisCacheKey.ProfileGroupSet.format(profile_id=self.profile.id)
         ):
             await self.channel_layer.group_add(
                 defines.chat_type.ChatTypeContextFormatKey.Group.value % int(group_id), self.channel_name
@@ -91,14 +152,24 @@ class ConnectManageConsumer(AsyncUJsonWebsocketConsumer):
             await self.channel_layer.group_add(
                 defines.chat_type.ChatTypeContextFormatKey.Group.value % int(group_id), self.channel_name
             )
+        # 推送未读数
+        for (chat_type, chat_instance_id), (count, message_id) in (await get_all_unread(self.profile.id)).items():
+            await self.send_message_unread_count(chat_instance_id, message_id, count)
+        # 推送离线消息
+        await self.send_offline_messages()
         logger.info(f"User {self.profile.id} connected with device_code: {self.device_code}")
 
     async def connect(self):
         await self.pre_accept()
-        await self.accept()
+        self.codec, subprotocol = negotiate_codec(self.scope)
+        await self.accept(subprotocol=subprotocol)
+        self.start_outbound(local_configs.CHAT.OUTBOUND_QUEUE_SIZE)
         await self.post_accept()
 
     async def disconnect(self, close_code):
+        self.stop_outbound()
+        if self.ephemeral_coalescer:
+            self.ephemeral_coalescer.close()
         if close_code not in [defines.service.Code.Unauthorized.value, defines.service.Code.DeviceRestrict.value]:
             # 用户离线
             logger.info(
@@ -111,23 +182,26 @@ class ConnectManageConsumer(AsyncUJsonWebsocketConsumer):
             )
 
             # 离开用户群组
-            for group_id in await AsyncRedisUtil.r.smembers(
-                keys.RedisCacheKey.ProfileGroupSet.format(profile_id=self.profile.id), encoding="utf-8"
+            for group_id in await profile_group_cache.asmembers(
+                keys.RedisCacheKey.ProfileGroupSet.format(profile_id=self.profile.id)
             ):
                 await self.channel_layer.group_discard(
                     defines.chat_type.ChatTypeContextFormatKey.Group.value % int(group_id), self.channel_name
                 )
-            # 删除连接信息
-            await AsyncRedisUtil.r.delete(
-                keys.RedisCacheKey.ProfileConnectionKey.format(
-                    profile_id=self.profile.id, device_code=self.device_code.value
-                )
+            # 删除连接信息, 同设备新连接已覆盖时保留
+            await AsyncRedisUtil.r.eval(
+                presence.RELEASE_ROUTE_SCRIPT,
+                keys=[
+                    keys.RedisCacheKey.ProfileConnectionKey.format(
+                        profile_id=self.profile.id, device_code=self.device_code.value
+                    )
+                ],
+                args=[self.channel_name],
             )
 
-            # TODO: 多设备的离线判断
-            await AsyncRedisUtil.r.setbit(
-                keys.RedisCacheKey.ProfileOnlineKey.format(profile_id=self.profile.id), self.profile.id, 0
-            )
+            # 全部设备断开后离线
+            presence.ConnectionHeartbeat.unregister(self.channel_name)
+            await presence.offline(self.profile.id, self.channel_name)
 
 
 class ReplyMixin(ConnectManageConsumer, ABC):
@@ -139,7 +213,15 @@ class ReplyMixin(ConnectManageConsumer, ABC):
     async def group_message(self, message: defines.channels_message.ChannelsMessageData):
         # Send message to WebSocket
         logger.debug(f"message is: {message}")
-        await self.send(bytes_data=ujson.dumps(message["content"]).encode())
+        await self.send(
+            bytes_data=self.codec.encode(message["content"]),
+            ephemeral=message["content"]["message_type"] in EPHEMERAL_MESSAGE_TYPES,
+        )
+
+    # Receive unread count from the channel layer
+    async def unread_count(self, message: defines.channels_message.ChannelsUnreadCountData):
+        content = message["content"]
+        await self.send_message_unread_count(content["chat_instance_id"], content["message_id"], content["count"])
 
     @staticmethod
     def gen_reply(
@@ -173,7 +255,7 @@ class ReplyMixin(ConnectManageConsumer, ABC):
         time: datetime,
         content: Any = None,
     ):
-        return ujson.dumps(self.gen_reply(code, message_type, chat_type, sender_info, context, time, content)).encode()
+        return self.codec.encode(self.gen_reply(code, message_type, chat_type, sender_info, context, time, content))
 
     async def send_error(self, code: defines.service.Code, message: Optional[str]):
         await self.send(
@@ -298,6 +380,29 @@ class ReplyMixin(ConnectManageConsumer, ABC):
             )
         )
 
+    async def send_offline_messages(self):
+        """
+        离线消息合并为一帧推送, 客户端以 last_id 回复 inbox_ack 确认
+        """
+        last_id, messages = await read_inbox(self.profile.id)
+        if not messages:
+            return
+        for message in messages:
+            message["context"] = self.channel_name
+        # 收件箱不保存签名 URL, 推送时重新获取
+        await sign_reply_files(messages)
+        await self.send(
+            bytes_data=self.gen_reply_bytes(
+                code=defines.service.Code.Success,
+                message_type=defines.message_type.MessageType.OfflineMessages,
+                chat_type=defines.chat_type.ChatType.SystemCenter,
+                sender_info=await get_system_sender(),
+                context=defines.chat_type.ChatTypeContextFormatKey.SystemCenter.value,
+                time=datetime.now(),
+                content=defines.message_content.OfflineMessagesContent(last_id=last_id, messages=messages),
+            )
+        )
+
 
 class ServerReply(ReplyMixin, ABC):
     """
@@ -306,7 +411,24 @@ class ServerReply(ReplyMixin, ABC):
 
     handler = None  # BaseHandler
 
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        # 字符数或字节数, 解码前拦截
+        if len(text_data or bytes_data or "") > local_configs.CHAT.MAX_FRAME_SIZE:
+            logger.warning(f"User {self.profile.id} sent oversize frame")
+            await self.send_error(
+                code=defines.service.Code.FrameTooLarge, message=defines.service.Message.FrameTooLarge
+            )
+            return
+        await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
+
     async def receive_json(self, content, **kwargs):
+        decision = await self.inbound_limiter.check(content.get("message_type") if isinstance(content, dict) else None)
+        if decision is FrameDecision.Drop:
+            return
+        if decision is FrameDecision.Reject:
+            logger.warning(f"User {self.profile.id} rate limited")
+            await self.send_error(code=defines.service.Code.RateLimited, message=defines.service.Message.RateLimited)
+            return
         await self.pre_handle(content, **kwargs)
         try:
             await self.handler.handle(self, content, **kwargs)
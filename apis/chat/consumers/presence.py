@@ -0,0 +1,238 @@
+"""
+在线状态
+    Profile:Online 全部用户共用一个 bitmap, offset 为 profile_id, 用于批量查询
+    Profile:Presence:{profile_id} 记录用户每个连接的最近心跳时间, 全部连接断开或过期后才置为离线
+"""
+import time
+import asyncio
+import logging
+from typing import Dict, List, Tuple, Iterable, Optional
+
+from storages.redis import RedisUtil, AsyncRedisUtil, keys
+
+logger = logging.getLogger("chat.consumers.presence")
+
+PRESENCE_HEARTBEAT_INTERVAL = 30
+# 超过该时间未心跳的连接视为已断开(如进程异常退出)
+PRESENCE_EXPIRE = PRESENCE_HEARTBEAT_INTERVAL * 3
+# 路由信息 ProfileConnectionKey 过期时间, 由 ConnectionHeartbeat 续期
+CONNECTION_EXPIRE = PRESENCE_EXPIRE
+
+# KEYS: presence hash, online bitmap; ARGV: channel_name, now, profile_id, expire
+CONNECT_SCRIPT = """
+redis.call("HSET", KEYS[1], ARGV[1], ARGV[2])
+redis.call("EXPIRE", KEYS[1], ARGV[4])
+redis.call("SETBIT", KEYS[2], ARGV[3], 1)
+return redis.call("HLEN", KEYS[1])
+"""
+
+# KEYS: presence hash, online bitmap; ARGV: channel_name, profile_id, stale_before
+DISCONNECT_SCRIPT = """
+redis.call("HDEL", KEYS[1], ARGV[1])
+local entries = redis.call("HGETALL", KEYS[1])
+for i = 1, #entries, 2 do
+    if tonumber(entries[i + 1]) < tonumber(ARGV[3]) then
+        redis.call("HDEL", KEYS[1], entries[i])
+    end
+end
+local remain = redis.call("HLEN", KEYS[1])
+if remain == 0 then
+    redis.call("SETBIT", KEYS[2], ARGV[2], 0)
+end
+return remain
+"""
+
+# KEYS: presence hash, online bitmap; ARGV: profile_id
+SWEEP_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    redis.call("SETBIT", KEYS[2], ARGV[1], 0)
+    return 1
+end
+return 0
+"""
+
+# KEYS: connection key; ARGV: channel_name, expire(秒); 不存在或仍指向该连接时写入, 不覆盖同设备新连接的路由
+REFRESH_ROUTE_SCRIPT = """
+local current = redis.call("GET", KEYS[1])
+if current and current ~= ARGV[1] then
+    return 0
+end
+redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+return 1
+"""
+
+# KEYS: connection key; ARGV: channel_name, 仍指向该连接时删除
+RELEASE_ROUTE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+def presence_key(profile_id: int) -> str:
+    return keys.RedisCacheKey.ProfilePresenceKey.format(profile_id=profile_id)
+
+
+async def online(profile_id: int, channel_name: str) -> int:
+    """
+    返回当前在线连接数
+    """
+    return await AsyncRedisUtil.r.eval(
+        CONNECT_SCRIPT,
+        keys=[presence_key(profile_id), keys.RedisCacheKey.ProfileOnlineKey.value],
+        args=[channel_name, int(time.time()), profile_id, PRESENCE_EXPIRE],
+    )
+
+
+async def offline(profile_id: int, channel_name: str) -> int:
+    """
+    返回剩余在线连接数, 为 0 时用户离线
+    """
+    return await AsyncRedisUtil.r.eval(
+        DISCONNECT_SCRIPT,
+        keys=[presence_key(profile_id), keys.RedisCacheKey.ProfileOnlineKey.value],
+        args=[channel_name, profile_id, int(time.time()) - PRESENCE_EXPIRE],
+    )
+
+
+def _bitfield_get_args(profile_ids: List[int]) -> List:
+    args = []
+    for profile_id in profile_ids:
+        args.extend(["GET", "u1", int(profile_id)])
+    return args
+
+
+async def get_online_status(profile_ids: Iterable[int]) -> Dict[int, bool]:
+    """
+    批量查询在线状态, 一次 BITFIELD 调用
+    """
+    profile_ids = list(profile_ids)
+    if not profile_ids:
+        return {}
+    bits = await AsyncRedisUtil.r.execute(
+        "BITFIELD", keys.RedisCacheKey.ProfileOnlineKey.value, *_bitfield_get_args(profile_ids)
+    )
+    return {int(profile_id): bool(bit) for profile_id, bit in zip(profile_ids, bits)}
+
+
+def get_online_status_sync(profile_ids: Iterable[int]) -> Dict[int, bool]:
+    profile_ids = list(profile_ids)
+    if not profile_ids:
+        return {}
+    bits = RedisUtil.r.execute_command(
+        "BITFIELD", keys.RedisCacheKey.ProfileOnlineKey.value, *_bitfield_get_args(profile_ids)
+    )
+    return {int(profile_id): bool(bit) for profile_id, bit in zip(profile_ids, bits)}
+
+
+async def get_online_count() -> int:
+    return await AsyncRedisUtil.r.bitcount(keys.RedisCacheKey.ProfileOnlineKey.value)
+
+
+def _iter_set_bits(chunk: bytes, base: int):
+    # bitmap 中 offset 0 为首字节最高位
+    for byte_index, byte in enumerate(chunk):
+        if not byte:
+            continue
+        for bit in range(8):
+            if byte & (0x80 >> bit):
+                yield base + byte_index * 8 + bit
+
+
+def sweep_offline(chunk_size: int = 4096):
+    """
+    清理心跳已过期(进程异常退出未执行 disconnect)用户的在线标记, 按块读取 bitmap
+    """
+    online_key = keys.RedisCacheKey.ProfileOnlineKey.value
+    cleared = 0
+    for offset in range(0, RedisUtil.r.strlen(online_key), chunk_size):
+        chunk = RedisUtil.r.getrange(online_key, offset, offset + chunk_size - 1)
+        profile_ids = list(_iter_set_bits(chunk, offset * 8))
+        if not profile_ids:
+            continue
+        with RedisUtil.r.pipeline(transaction=False) as pipe:
+            for profile_id in profile_ids:
+                pipe.exists(presence_key(profile_id))
+            exists = pipe.execute()
+        with RedisUtil.r.pipeline(transaction=False) as pipe:
+            for profile_id, exist in zip(profile_ids, exists):
+                if not exist:
+                    pipe.eval(SWEEP_SCRIPT, 2, presence_key(profile_id), online_key, profile_id)
+            cleared += sum(pipe.execute())
+    logger.info(f"Presence swept, cleared: {cleared}")
+
+
+class ConnectionHeartbeat:
+    """
+    进程内连接心跳, 时间轮调度
+        连接注册时放入 interval 秒后的槽位, 之后每转一圈(interval 秒)刷新一次
+        每个 tick 只刷新当前槽位的连接, 一次 pipeline: 重新写入路由信息 ProfileConnectionKey、在线心跳
+        连接注册时间分散, 刷新负载均匀分布在各 tick 上
+    """
+
+    tick: float = 1
+    slots: int = int(PRESENCE_HEARTBEAT_INTERVAL / tick)
+
+    _wheel: List[Dict[str, Tuple[int, str]]] = [{} for _ in range(slots)]  # channel_name: (profile_id, device_code)
+    _slot_of: Dict[str, int] = {}  # channel_name: slot
+    _cursor: int = 0
+    _task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def register(cls, profile_id: int, device_code: str, channel_name: str):
+        cls.unregister(channel_name)
+        # 当前槽位刚执行过, 放到前一个槽位即一整圈后执行
+        slot = (cls._cursor - 1) % cls.slots
+        cls._wheel[slot][channel_name] = (profile_id, device_code)
+        cls._slot_of[channel_name] = slot
+        if cls._task is None or cls._task.done():
+            cls._task = asyncio.get_running_loop().create_task(cls._run())
+
+    @classmethod
+    def unregister(cls, channel_name: str):
+        slot = cls._slot_of.pop(channel_name, None)
+        if slot is not None:
+            cls._wheel[slot].pop(channel_name, None)
+
+    @classmethod
+    async def beat(cls, connections: Dict[str, Tuple[int, str]]):
+        # 跳过已注销的连接, 避免重新写入已关闭连接的在线心跳
+        connections = {
+            channel_name: connection for channel_name, connection in connections.items() if channel_name in cls._slot_of
+        }
+        if not connections:
+            return
+        now = int(time.time())
+        pipe = AsyncRedisUtil.r.pipeline()
+        for channel_name, (profile_id, device_code) in connections.items():
+            # SET 而不是 EXPIRE: 路由信息丢失(停顿超过过期时间、被淘汰、主从切换)后由下次心跳恢复
+            pipe.eval(
+                REFRESH_ROUTE_SCRIPT,
+                keys=[keys.RedisCacheKey.ProfileConnectionKey.format(profile_id=profile_id, device_code=device_code)],
+                args=[channel_name, CONNECTION_EXPIRE],
+            )
+            pipe.hset(presence_key(profile_id), channel_name, now)
+            pipe.expire(presence_key(profile_id), PRESENCE_EXPIRE)
+        await pipe.execute()
+        # 执行期间断开的连接, disconnect 可能先于本次写入执行, 撤销本次写入
+        for channel_name, (profile_id, device_code) in connections.items():
+            if channel_name not in cls._slot_of:
+                connection_key = keys.RedisCacheKey.ProfileConnectionKey.format(
+                    profile_id=profile_id, device_code=device_code
+                )
+                await AsyncRedisUtil.r.eval(RELEASE_ROUTE_SCRIPT, keys=[connection_key], args=[channel_name])
+                await offline(profile_id, channel_name)
+
+    @classmethod
+    async def _run(cls):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while cls._slot_of:
+            deadline += cls.tick
+            await asyncio.sleep(max(deadline - loop.time(), 0))
+            cls._cursor = (cls._cursor + 1) % cls.slots
+            try:
+                await cls.beat(dict(cls._wheel[cls._cursor]))
+            except Exception as e:
+                logger.exception(e)
@@ -0,0 +1,176 @@
+"""
+群聊已读回执
+    每个成员只记录一个已读水位(最后已读的消息 id), 不按成员 * 消息记录
+    Chat:Read:Group:{group_id} Hash, field 为 profile_id, 字段 loaded 表示已从数据库加载
+    Chat:Read:Group:{group_id}:Rank ZSet, 分数为已读水位, 消息的已读人数为 ZCOUNT [message_id, +inf)
+    水位只增不减, 变化的群组记录到 Chat:Read:Group:Dirty, 由定时任务(tasks.timed.receipt)批量写入 GroupMembership.last_read_message_id
+"""
+import logging
+from typing import Dict, List, Tuple, Iterable
+
+import ujson
+from channels.db import database_sync_to_async
+
+from storages.redis import RedisUtil, AsyncRedisUtil, keys
+from apis.chat.consumers import defines
+from apis.chat.consumers.history import history_key
+from storages.relational.models import GroupMessage, GroupMembership
+
+logger = logging.getLogger("chat.consumers.receipt")
+
+READ_WATERMARK_EXPIRE = 60 * 60 * 24 * 7
+LOADED_FIELD = "loaded"
+FLUSH_BATCH_SIZE = 100
+
+# KEYS: watermark hash, rank zset, dirty set; ARGV: expire, group_id, load(1 从数据库加载), profile_id, message_id, ...
+# 未加载时返回 -1, 由调用方加载后重试; 否则返回水位前进的成员数
+MARK_READ_SCRIPT = """
+local load = ARGV[3] == "1"
+if not load and redis.call("HEXISTS", KEYS[1], "loaded") == 0 then
+    return -1
+end
+local changed = 0
+for i = 4, #ARGV, 2 do
+    local current = redis.call("HGET", KEYS[1], ARGV[i])
+    if not current or tonumber(ARGV[i + 1]) > tonumber(current) then
+        redis.call("HSET", KEYS[1], ARGV[i], ARGV[i + 1])
+        redis.call("ZADD", KEYS[2], ARGV[i + 1], ARGV[i])
+        changed = changed + 1
+    end
+end
+if load then
+    redis.call("HSET", KEYS[1], "loaded", 1)
+elseif changed > 0 then
+    redis.call("SADD", KEYS[3], ARGV[2])
+end
+redis.call("EXPIRE", KEYS[1], ARGV[1])
+redis.call("EXPIRE", KEYS[2], ARGV[1])
+return changed
+"""
+
+
+def watermark_key(group_id: int) -> str:
+    return keys.RedisCacheKey.ChatGroupReadKey.format(group_id=group_id)
+
+
+def rank_key(group_id: int) -> str:
+    return keys.RedisCacheKey.ChatGroupReadRankKey.format(group_id=group_id)
+
+
+def _script_keys(group_id: int) -> List[str]:
+    return [watermark_key(group_id), rank_key(group_id), keys.RedisCacheKey.ChatGroupReadDirtySet.value]
+
+
+def _script_args(group_id: int, load: bool, watermarks: Iterable[Tuple[int, int]]) -> list:
+    args = [READ_WATERMARK_EXPIRE, group_id, 1 if load else 0]
+    for profile_id, message_id in watermarks:
+        args.extend((profile_id, message_id))
+    return args
+
+
+def get_db_watermarks(group_id: int) -> List[Tuple[int, int]]:
+    return list(
+        GroupMembership.objects.filter(group_id=group_id, last_read_message_id__gt=0).values_list(
+            "profile_id", "last_read_message_id"
+        )
+    )
+
+
+def get_latest_message_id(group_id: int) -> int:
+    message_id = (
+        GroupMessage.objects.filter(group_id=group_id).order_by("-id").values_list("id", flat=True).first()
+    )
+    return message_id or 0
+
+
+async def _get_latest_message_id(group_id: int) -> int:
+    """
+    最近消息缓存的第一条即为最新消息
+    """
+    head = await AsyncRedisUtil.r.lindex(history_key(defines.chat_type.ChatType.Group, group_id), 0)
+    if head:
+        return ujson.loads(head)["id"]
+    return await database_sync_to_async(get_latest_message_id)(group_id)
+
+
+async def mark_group_read(group_id: int, profile_id: int, message_id: int) -> bool:
+    """
+    更新成员已读水位, 超过群组最新消息 id 的部分忽略; 返回水位是否前进
+    """
+    message_id = min(int(message_id), await _get_latest_message_id(group_id))
+    if message_id <= 0:
+        return False
+    changed = await AsyncRedisUtil.r.eval(
+        MARK_READ_SCRIPT, keys=_script_keys(group_id), args=_script_args(group_id, False, [(profile_id, message_id)])
+    )
+    if changed == -1:
+        watermarks = await database_sync_to_async(get_db_watermarks)(group_id)
+        await AsyncRedisUtil.r.eval(
+            MARK_READ_SCRIPT, keys=_script_keys(group_id), args=_script_args(group_id, True, watermarks)
+        )
+        changed = await AsyncRedisUtil.r.eval(
+            MARK_READ_SCRIPT,
+            keys=_script_keys(group_id),
+            args=_script_args(group_id, False, [(profile_id, message_id)]),
+        )
+    return changed > 0
+
+
+def get_read_counts(group_id: int, message_ids: List[int]) -> Dict[int, int]:
+    """
+    {message_id: 已读人数}, 每条消息一次 ZCOUNT
+    """
+    for _ in range(2):
+        with RedisUtil.r.pipeline(transaction=False) as pipe:
+            pipe.hexists(watermark_key(group_id), LOADED_FIELD)
+            for message_id in message_ids:
+                pipe.zcount(rank_key(group_id), message_id, "+inf")
+            loaded, *counts = pipe.execute()
+        if loaded:
+            break
+        RedisUtil.r.eval(
+            MARK_READ_SCRIPT, 3, *_script_keys(group_id), *_script_args(group_id, True, get_db_watermarks(group_id))
+        )
+    return dict(zip(message_ids, counts))
+
+
+def _flush_group(group_id: int) -> int:
+    watermarks = {
+        int(profile_id): int(message_id)
+        for profile_id, message_id in RedisUtil.r.hgetall(watermark_key(group_id)).items()
+        if profile_id != LOADED_FIELD.encode()
+    }
+    if not watermarks:
+        return 0
+    changed = []
+    for membership in GroupMembership.objects.filter(group_id=group_id).only(
+        "id", "profile_id", "last_read_message_id"
+    ):
+        message_id = watermarks.get(membership.profile_id, 0)
+        if message_id > membership.last_read_message_id:
+            membership.last_read_message_id = message_id
+            changed.append(membership)
+    GroupMembership.objects.bulk_update(changed, ["last_read_message_id"], batch_size=500)
+    return len(changed)
+
+
+def flush_group_watermarks():
+    """
+    水位有变化的群组写入数据库, 失败的群组放回待写入集合
+    """
+    dirty_key = keys.RedisCacheKey.ChatGroupReadDirtySet.value
+    failed, groups, memberships = [], 0, 0
+    while True:
+        group_ids = RedisUtil.r.spop(dirty_key, FLUSH_BATCH_SIZE)
+        if not group_ids:
+            break
+        for group_id in group_ids:
+            try:
+                memberships += _flush_group(int(group_id))
+                groups += 1
+            except Exception as e:
+                logger.exception(e)
+                failed.append(group_id)
+    if failed:
+        RedisUtil.r.sadd(dirty_key, *failed)
+    logger.info(f"Group read watermarks flushed, groups: {groups}, memberships: {memberships}, failed: {len(failed)}")
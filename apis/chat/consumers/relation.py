@@ -0,0 +1,70 @@
+import logging
+from typing import Tuple, Optional
+
+from cachetools import TTLCache
+
+from storages.redis import AsyncRedisUtil, keys
+from apis.chat.consumers import defines
+from apis.chat.consumers.db_operations import get_chat_instance
+
+logger = logging.getLogger("chat.consumers.relation")
+
+# Redis 共享缓存过期时间, 兜底未经过 signal 的变更(如 QuerySet.update)
+RELATION_CACHE_EXPIRE = 60 * 60
+# 连接内缓存过期时间, 即关系变更在其他连接上生效的最大延迟
+LOCAL_RELATION_CACHE_EXPIRE = 30
+LOCAL_RELATION_CACHE_SIZE = 1024
+
+
+def relation_cache_key(chat_type: defines.chat_type.ChatType, profile_id: int, receiver_id: int) -> str:
+    """
+    Group: 圈子与用户; Dialog: 无序的两个用户, 小的 id 在前
+    """
+    if chat_type == defines.chat_type.ChatType.Group:
+        return keys.RedisCacheKey.GroupRelationKey.format(group_id=receiver_id, profile_id=profile_id)
+    left_user_id, right_user_id = sorted((int(profile_id), int(receiver_id)))
+    return keys.RedisCacheKey.DialogRelationKey.format(left_user_id=left_user_id, right_user_id=right_user_id)
+
+
+class RelationCache:
+    """
+    单连接的聊天关系缓存
+    连接内存 -> Redis 共享缓存 -> 数据库, 逐级回填; 关系不存在时不缓存
+    Redis 缓存在 GroupMembership、Dialog 保存或删除时失效, 见 apis.chat.signals
+    """
+
+    def __init__(
+        self, profile_id: int, maxsize: int = LOCAL_RELATION_CACHE_SIZE, ttl: int = LOCAL_RELATION_CACHE_EXPIRE
+    ):
+        self.profile_id = profile_id
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get_chat_instance_id(
+        self, chat_type: defines.chat_type.ChatType, receiver_id: int, load: bool = True
+    ) -> Optional[int]:
+        """
+        load 为 False 时只查缓存, 未命中返回 None
+        """
+        local_key: Tuple[defines.chat_type.ChatType, int] = (chat_type, receiver_id)
+        chat_instance_id = self._local.get(local_key)
+        if chat_instance_id is not None:
+            return chat_instance_id
+
+        key = relation_cache_key(chat_type, self.profile_id, receiver_id)
+        chat_instance_id = await AsyncRedisUtil.r.get(key, encoding="utf-8")
+        if chat_instance_id is None:
+            if not load:
+                return None
+            chat_instance = await get_chat_instance(chat_type, self.profile_id, receiver_id)
+            if not chat_instance:
+                return None
+            chat_instance_id = chat_instance.id
+            await AsyncRedisUtil.r.set(key, chat_instance_id, expire=RELATION_CACHE_EXPIRE)
+            logger.debug(f"Relation cache filled: {key}")
+
+        chat_instance_id = int(chat_instance_id)
+        self._local[local_key] = chat_instance_id
+        return chat_instance_id
+
+    def discard(self, chat_type: defines.chat_type.ChatType, receiver_id: int):
+        self._local.pop((chat_type, receiver_id), None)
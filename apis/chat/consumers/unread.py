@@ -0,0 +1,111 @@
+"""
+未读数计数器, 发送时累加、已读时清零, 定时任务与数据库对账(tasks.timed.chat)
+群聊未读数不逐人累加, 目前仅私聊使用
+"""
+import logging
+from typing import Dict, Tuple
+from collections import defaultdict
+
+from django.db.models import Max, Count
+
+from storages.redis import RedisUtil, AsyncRedisUtil, keys
+from apis.chat.consumers import defines
+from storages.relational.models import DialogMessage
+
+logger = logging.getLogger("chat.consumers.unread")
+
+COUNT_FIELD_SUFFIX = ":count"
+MESSAGE_ID_FIELD_SUFFIX = ":message_id"
+
+
+def unread_key(profile_id: int) -> str:
+    return keys.RedisCacheKey.ProfileGroupUnreadInfo.format(profile_id=profile_id)
+
+
+def unread_field(chat_type: defines.chat_type.ChatType, chat_instance_id: int) -> str:
+    return f"{chat_type.value}-{chat_instance_id}"
+
+
+async def incr_unread(
+    profile_id: int, chat_type: defines.chat_type.ChatType, chat_instance_id: int, message_id: int
+) -> int:
+    """
+    接收方未读数 +1, 返回累加后的未读数
+    """
+    field = unread_field(chat_type, chat_instance_id)
+    tr = AsyncRedisUtil.r.multi_exec()
+    tr.hincrby(unread_key(profile_id), field + COUNT_FIELD_SUFFIX, 1)
+    tr.hset(unread_key(profile_id), field + MESSAGE_ID_FIELD_SUFFIX, message_id)
+    count, _ = await tr.execute()
+    return count
+
+
+async def reset_unread(profile_id: int, chat_type: defines.chat_type.ChatType, chat_instance_id: int):
+    field = unread_field(chat_type, chat_instance_id)
+    await AsyncRedisUtil.r.hdel(unread_key(profile_id), field + COUNT_FIELD_SUFFIX, field + MESSAGE_ID_FIELD_SUFFIX)
+
+
+async def get_all_unread(profile_id: int) -> Dict[Tuple[str, int], Tuple[int, int]]:
+    """
+    {(chat_type, chat_instance_id): (count, message_id)}
+    """
+    values = await AsyncRedisUtil.r.hgetall(unread_key(profile_id), encoding="utf-8")
+    result = {}
+    for field, count in values.items():
+        if not field.endswith(COUNT_FIELD_SUFFIX):
+            continue
+        field = field[: -len(COUNT_FIELD_SUFFIX)]
+        chat_type, chat_instance_id = field.split("-", 1)
+        message_id = values.get(field + MESSAGE_ID_FIELD_SUFFIX, 0)
+        result[(chat_type, int(chat_instance_id))] = (int(count), int(message_id))
+    return result
+
+
+def _flush_profile_unread(pipe, profile_id: int, mapping: Dict[str, int]):
+    pipe.delete(unread_key(profile_id))
+    if mapping:
+        pipe.hset(unread_key(profile_id), mapping=mapping)
+
+
+def reconcile_dialog_unread():
+    """
+    以数据库为准重建私聊未读数, 对账期间新增的计数以下一次对账为准
+    """
+    seen_profile_ids = set()
+    rows = (
+        DialogMessage.objects.filter(read=False)
+        .values("receiver_id", "dialog_id")
+        .annotate(count=Count("id"), message_id=Max("id"))
+        .order_by("receiver_id")
+    )
+    current_profile_id, mapping = None, {}
+    with RedisUtil.r.pipeline() as pipe:
+        for row in rows.iterator():
+            if row["receiver_id"] != current_profile_id:
+                if current_profile_id is not None:
+                    _flush_profile_unread(pipe, current_profile_id, mapping)
+                current_profile_id, mapping = row["receiver_id"], {}
+                seen_profile_ids.add(current_profile_id)
+            field = unread_field(defines.chat_type.ChatType.Dialog, row["dialog_id"])
+            mapping[field + COUNT_FIELD_SUFFIX] = row["count"]
+            mapping[field + MESSAGE_ID_FIELD_SUFFIX] = row["message_id"]
+            if len(pipe) >= 1000:
+                pipe.execute()
+        if current_profile_id is not None:
+            _flush_profile_unread(pipe, current_profile_id, mapping)
+        pipe.execute()
+
+    # 数据库中已无未读的用户, 清除私聊计数
+    stale = defaultdict(list)
+    for key in RedisUtil.r.scan_iter(match=unread_key("*"), count=1000):
+        profile_id = int(key.decode("utf-8").rsplit(":", 1)[-1])
+        if profile_id in seen_profile_ids:
+            continue
+        for field in RedisUtil.r.hkeys(key):
+            if field.decode("utf-8").startswith(defines.chat_type.ChatType.Dialog.value + "-"):
+                stale[key].append(field)
+    with RedisUtil.r.pipeline() as pipe:
+        for key, fields in stale.items():
+            pipe.hdel(key, *fields)
+        pipe.execute()
+    logger.info(f"Dialog unread reconciled, profiles: {len(seen_profile_ids)}, stale: {len(stale)}")
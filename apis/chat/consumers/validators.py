@@ -0,0 +1,96 @@
+"""
+根据 defines.message_content 中的类型定义预先生成 content 校验函数, 校验时不再解析类型
+"""
+import enum
+import typing
+from typing import Any, Dict, Callable, Iterable, Optional
+
+from apis.chat.consumers import defines
+
+Checker = Callable[[Any], bool]
+
+
+def _is_typed_dict(tp) -> bool:
+    return isinstance(tp, type) and issubclass(tp, dict) and hasattr(tp, "__annotations__")
+
+
+def _is_optional(tp) -> bool:
+    return typing.get_origin(tp) is typing.Union and type(None) in typing.get_args(tp)
+
+
+def _check_int(v) -> bool:
+    # 兼容客户端以字符串传递 id
+    return (isinstance(v, int) and not isinstance(v, bool)) or (isinstance(v, str) and v.isdigit())
+
+
+def _check_float(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _check_str(v) -> bool:
+    return isinstance(v, str)
+
+
+def compile_checker(tp, required: Optional[Iterable[str]] = None) -> Checker:
+    """
+    TypedDict 默认非 Optional 字段必填, 可通过 required 指定
+    """
+    supertype = getattr(tp, "__supertype__", None)  # NewType
+    if supertype is not None:
+        return compile_checker(supertype)
+    if tp is int:
+        return _check_int
+    if tp is float:
+        return _check_float
+    if tp is str:
+        return _check_str
+    if isinstance(tp, type) and issubclass(tp, enum.Enum):
+        values = frozenset(i.value for i in tp)
+        return lambda v: isinstance(v, str) and v in values
+    if _is_typed_dict(tp):
+        hints = typing.get_type_hints(tp)
+        checkers: Dict[str, Checker] = {name: compile_checker(hint) for name, hint in hints.items()}
+        required = frozenset(
+            required if required is not None else [name for name, hint in hints.items() if not _is_optional(hint)]
+        )
+
+        def check_typed_dict(v) -> bool:
+            if not isinstance(v, dict):
+                return False
+            for name in required:
+                if name not in v:
+                    return False
+            for name, field_value in v.items():
+                checker = checkers.get(name)
+                if checker is not None and not checker(field_value):
+                    return False
+            return True
+
+        return check_typed_dict
+
+    origin, args = typing.get_origin(tp), typing.get_args(tp)
+    if origin is typing.Union:
+        arg_checkers = [(lambda v: v is None) if arg is type(None) else compile_checker(arg) for arg in args]
+        return lambda v: any(checker(v) for checker in arg_checkers)
+    if origin is list:
+        item_checker = compile_checker(args[0]) if args else (lambda v: True)
+        return lambda v: isinstance(v, list) and all(item_checker(i) for i in v)
+    return lambda v: True
+
+
+_file_checker = compile_checker(defines.message_content.FileContent, required=("id",))
+
+# message_type: content 校验函数, 未配置的类型不校验结构
+CONTENT_CHECKERS: Dict[str, Checker] = {
+    defines.message_type.ClientMessageType.Text.value: compile_checker(defines.message_content.ContentTextType),
+    defines.message_type.ClientMessageType.Picture.value: _file_checker,
+    defines.message_type.ClientMessageType.Video.value: _file_checker,
+    defines.message_type.ClientMessageType.Audio.value: _file_checker,
+    defines.message_type.ClientMessageType.File.value: _file_checker,
+    defines.message_type.ClientMessageType.Location.value: compile_checker(defines.message_content.LocationContent),
+    defines.message_type.ClientMessageType.Share.value: compile_checker(defines.message_content.ShareContent),
+    defines.message_type.ClientMessageType.MessageRead.value: compile_checker(
+        defines.message_content.MessageIDContent, required=("message_id",)
+    ),
+    defines.message_type.ClientMessageType.InboxAck.value: compile_checker(defines.message_content.InboxAckContent),
+}
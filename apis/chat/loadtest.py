@@ -0,0 +1,401 @@
+"""
+聊天压测
+    模拟 N 个客户端连接 ChatConsumer, 按比例发送私聊、群聊及 typing 消息,
+    统计端到端延迟(p50/p99)、吞吐及每条持久化消息的数据库查询数
+    transport:
+        communicator: 进程内 channels WebsocketCommunicator, 不经过网络
+        uvicorn: 进程内启动 uvicorn(ChatWebSocketProtocol), 通过 websockets 客户端连接;
+            指定 url 时连接已运行的服务, 服务端不在本进程, 不统计查询数
+    依赖真实的 Redis(channel layer) 与数据库; 压测用户、私聊及群组按手机号前缀创建并复用
+"""
+import time
+import random
+import socket
+import asyncio
+import logging
+import secrets
+from typing import Dict, List, Tuple, Union, Optional
+from collections import Counter, defaultdict
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.db.backends.signals import connection_created
+from rest_framework_jwt.serializers import jwt_encode_handler, jwt_payload_handler
+
+from storages import enums
+from conf.config import local_configs
+from storages.redis import RedisUtil, keys
+from storages.redis.client_cache import profile_group_cache
+from storages.relational.models import Group, Dialog, Profile, GroupMembership
+from apis.chat.consumers.codec import CODECS, SUBPROTOCOL_PREFIX, JsonCodec
+
+logger = logging.getLogger("chat.loadtest")
+
+LOAD_TEST_PHONE_PREFIX = "199"
+LOAD_TEST_GROUP_LABEL = "load-test"
+LOAD_TEST_DEVICE_CODE = "mobile"
+CONNECT_TIMEOUT = 10
+
+KIND_DIALOG = "dialog"
+KIND_GROUP = "group"
+KIND_TYPING = "typing"
+KINDS = (KIND_DIALOG, KIND_GROUP, KIND_TYPING)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+
+def dialog_peer(index: int, clients: int) -> int:
+    """
+    两两结对私聊, 人数为奇数时最后一人与第一人结对
+    """
+    peer = index ^ 1
+    return peer if peer < clients else 0
+
+
+def prepare_fixtures(clients: int) -> Tuple[List[Profile], Group, List[str]]:
+    """
+    返回 (用户, 群组, token)
+    """
+    profiles = []
+    for index in range(clients):
+        phone = f"{LOAD_TEST_PHONE_PREFIX}{index:08d}"
+        profile = Profile.objects.filter(phone=phone).first()
+        if not profile:
+            profile = Profile.objects.create_user(username=f"load-test-{index}", phone=phone, password=phone)
+        profiles.append(profile)
+    group = Group.objects.filter(label=LOAD_TEST_GROUP_LABEL, creator=profiles[0]).first()
+    if not group:
+        group = Group.objects.create(label=LOAD_TEST_GROUP_LABEL, creator=profiles[0])
+    for profile in profiles:
+        membership, _ = GroupMembership.objects.get_or_create(group=group, profile=profile)
+        if membership.status != enums.Status.enable.value:
+            membership.status = enums.Status.enable.value
+            membership.save(update_fields=["status"])
+        group_key = keys.RedisCacheKey.ProfileGroupSet.format(profile_id=profile.id)
+        RedisUtil.sadd(group_key, group.id)
+        profile_group_cache.invalidate(group_key)
+    if group.count < clients:
+        group.count = clients
+        group.save(update_fields=["count"])
+    for index, profile in enumerate(profiles):
+        Dialog.create_or_update(profile.id, profiles[dialog_peer(index, clients)].id)
+    return profiles, group, [jwt_encode_handler(jwt_payload_handler(profile)) for profile in profiles]
+
+
+class QueryCounter:
+    """
+    统计本进程内全部数据库连接执行的查询数, 新建的连接通过 connection_created 挂载
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def _on_connection_created(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def install(self):
+        connection_created.connect(self._on_connection_created)
+
+    def uninstall(self):
+        connection_created.disconnect(self._on_connection_created)
+
+
+class CommunicatorConnection:
+    def __init__(self, application, path: str, subprotocols: List[str]):
+        self.communicator = WebsocketCommunicator(application, path, subprotocols=subprotocols)
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=CONNECT_TIMEOUT)
+        if not connected:
+            raise ConnectionError("websocket rejected")
+
+    async def send(self, data: bytes):
+        await self.communicator.send_to(bytes_data=data)
+
+    async def receive(self) -> Union[str, bytes]:
+        message = await self.communicator.receive_output(timeout=None)
+        if message["type"] != "websocket.send":
+            raise ConnectionError(f"websocket closed: {message.get('code')}")
+        return message.get("bytes") or message.get("text")
+
+    async def close(self):
+        await self.communicator.disconnect(timeout=CONNECT_TIMEOUT)
+
+
+class WebsocketConnection:
+    def __init__(self, url: str, subprotocols: List[str]):
+        self.url = url
+        self.subprotocols = subprotocols
+        self.websocket = None
+
+    async def connect(self):
+        import websockets
+
+        self.websocket = await websockets.connect(
+            self.url, subprotocols=self.subprotocols or None, open_timeout=CONNECT_TIMEOUT, max_size=None
+        )
+
+    async def send(self, data: bytes):
+        await self.websocket.send(data)
+
+    async def receive(self) -> Union[str, bytes]:
+        return await self.websocket.recv()
+
+    async def close(self):
+        await self.websocket.close()
+
+
+class LoadTestStats:
+    def __init__(self):
+        self.sent: Dict[str, int] = Counter()
+        self.sent_at: Dict[str, Tuple[str, float]] = {}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.received: Dict[str, int] = Counter()
+        self.errors: Dict[int, int] = Counter()
+        self.expected = 0
+        self.delivered = 0
+
+    def record_sent(self, kind: str, marker: Optional[str], expected: int):
+        self.sent[kind] += 1
+        self.expected += expected
+        if marker:
+            self.sent_at[marker] = (kind, time.perf_counter())
+
+    def record_received(self, reply: dict):
+        message_type = reply.get("message_type")
+        self.received[message_type] += 1
+        if message_type == "error":
+            self.errors[reply.get("code")] += 1
+            return
+        content = reply.get("content")
+        if message_type != "text" or not isinstance(content, list) or not content:
+            return
+        sent = self.sent_at.get(content[0].get("value"))
+        if sent is None:
+            return
+        kind, sent_at = sent
+        self.latencies[kind].append(time.perf_counter() - sent_at)
+        self.delivered += 1
+
+
+class SimulatedClient:
+    def __init__(
+        self,
+        index: int,
+        connection: Union[CommunicatorConnection, WebsocketConnection],
+        codec: JsonCodec,
+        stats: LoadTestStats,
+    ):
+        self.index = index
+        self.connection = connection
+        self.codec = codec
+        self.stats = stats
+        self._reader: Optional[asyncio.Task] = None
+
+    async def connect(self) -> float:
+        start = time.perf_counter()
+        await self.connection.connect()
+        self._reader = asyncio.get_running_loop().create_task(self._read())
+        return time.perf_counter() - start
+
+    async def _read(self):
+        while True:
+            try:
+                data = await self.connection.receive()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"client {self.index} stopped receiving: {e}")
+                return
+            self.stats.record_received(self.codec.decode(data))
+
+    async def run(
+        self,
+        run_id: str,
+        messages: int,
+        rate: float,
+        weights: List[float],
+        peer_id: int,
+        group_id: int,
+        group_size: int,
+        rng: random.Random,
+    ):
+        interval = 1 / rate if rate > 0 else 0
+        if interval:
+            # 错开各客户端的发送时刻
+            await asyncio.sleep(rng.random() * interval)
+        for seq in range(messages):
+            kind = rng.choices(KINDS, weights)[0]
+            if kind == KIND_TYPING:
+                frame = {
+                    "chat_type": "Dialog",
+                    "message_type": "typing",
+                    "receiver_id": peer_id,
+                    "content": {"typing": True},
+                }
+                marker, expected = None, 0
+            else:
+                marker = f"lt:{run_id}:{self.index}:{seq}"
+                frame = {
+                    "chat_type": "Dialog" if kind == KIND_DIALOG else "Group",
+                    "message_type": "text",
+                    "receiver_id": peer_id if kind == KIND_DIALOG else group_id,
+                    "content": [{"tag": "text", "value": marker}],
+                }
+                expected = 1 if kind == KIND_DIALOG else group_size
+            self.stats.record_sent(kind, marker, expected)
+            await self.connection.send(self.codec.encode(frame))
+            if interval:
+                await asyncio.sleep(interval)
+
+    async def close(self):
+        if self._reader:
+            self._reader.cancel()
+        try:
+            await self.connection.close()
+        except Exception as e:
+            logger.warning(f"client {self.index} close failed: {e}")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _start_uvicorn(application):
+    import uvicorn
+
+    from core.websocket import ChatWebSocketProtocol
+
+    config = uvicorn.Config(
+        application,
+        host="127.0.0.1",
+        port=_free_port(),
+        ws=ChatWebSocketProtocol,
+        ws_per_message_deflate=local_configs.CHAT.WS_PER_MESSAGE_DEFLATE,
+        lifespan="off",
+        log_level="warning",
+    )
+    server = uvicorn.Server(config)
+    task = asyncio.get_running_loop().create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task, f"ws://{config.host}:{config.port}"
+
+
+async def run_load_test(
+    clients: int = 100,
+    messages: int = 20,
+    rate: float = 2,
+    mix: Tuple[float, float, float] = (6, 3, 1),
+    transport: str = "communicator",
+    url: Optional[str] = None,
+    codec: str = JsonCodec.name,
+    drain: float = 10,
+    seed: Optional[int] = None,
+) -> dict:
+    """
+    mix: 私聊、群聊、typing 的发送比例; rate: 单客户端每秒发送数, 0 为不限速
+    """
+    from channels.routing import ProtocolTypeRouter
+
+    from core.urls import websocket
+
+    assert clients >= 2, "at least 2 clients"
+    assert transport in ("communicator", "uvicorn"), f"unknown transport: {transport}"
+    profiles, group, tokens = await database_sync_to_async(prepare_fixtures)(clients)
+    application = ProtocolTypeRouter({"websocket": websocket})
+    server, server_task = None, None
+    if transport == "uvicorn" and not url:
+        server, server_task, url = await _start_uvicorn(application)
+    count_queries = transport == "communicator" or server is not None
+    subprotocols = [] if codec == JsonCodec.name else [f"{SUBPROTOCOL_PREFIX}{codec}"]
+
+    stats = LoadTestStats()
+    simulated_clients = []
+    for index, token in enumerate(tokens):
+        path = f"/websocket.chat.{LOAD_TEST_DEVICE_CODE}?token={token}"
+        if transport == "communicator":
+            connection = CommunicatorConnection(application, path, subprotocols)
+        else:
+            connection = WebsocketConnection(url.rstrip("/") + path, subprotocols)
+        simulated_clients.append(SimulatedClient(index, connection, CODECS[codec], stats))
+
+    query_counter = QueryCounter()
+    query_counter.install()
+    try:
+        connect_latencies = await asyncio.gather(*[client.connect() for client in simulated_clients])
+        connect_queries, query_counter.count = query_counter.count, 0
+
+        run_id = secrets.token_hex(4)
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[
+                client.run(
+                    run_id,
+                    messages,
+                    rate,
+                    list(mix),
+                    profiles[dialog_peer(client.index, clients)].id,
+                    group.id,
+                    clients,
+                    random.Random(rng.random()),
+                )
+                for client in simulated_clients
+            ]
+        )
+        send_elapsed = time.perf_counter() - start
+        # 等待在途消息投递完成
+        deadline = time.perf_counter() + drain
+        while stats.delivered < stats.expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        if stats.delivered < stats.expected:
+            logger.warning(f"{stats.expected - stats.delivered} deliveries missing after {drain}s")
+        elapsed = time.perf_counter() - start
+        traffic_queries = query_counter.count
+    finally:
+        await asyncio.gather(*[client.close() for client in simulated_clients])
+        query_counter.uninstall()
+        if server is not None:
+            server.should_exit = True
+            await server_task
+
+    persistent = stats.sent[KIND_DIALOG] + stats.sent[KIND_GROUP]
+    all_latencies = [latency for latencies in stats.latencies.values() for latency in latencies]
+    return {
+        "clients": clients,
+        "target": transport if transport == "communicator" else url,
+        "codec": codec,
+        "connect_p50_ms": percentile(connect_latencies, 50) * 1000,
+        "connect_p99_ms": percentile(connect_latencies, 99) * 1000,
+        "sent": dict(stats.sent),
+        "expected": stats.expected,
+        "delivered": stats.delivered,
+        "received": dict(stats.received),
+        "errors": dict(stats.errors),
+        "send_elapsed": send_elapsed,
+        "elapsed": elapsed,
+        "send_throughput": sum(stats.sent.values()) / send_elapsed,
+        "delivery_throughput": stats.delivered / elapsed,
+        "latency_ms": {
+            kind: (percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, max(latencies) * 1000)
+            for kind, latencies in dict(stats.latencies, all=all_latencies).items()
+            if latencies
+        },
+        "connect_queries_per_client": connect_queries / clients if count_queries else None,
+        "queries_per_message": traffic_queries / max(persistent, 1) if count_queries else None,
+    }
@@ -0,0 +1,33 @@
+"""
+聊天关系缓存失效、文件元数据缓存, QuerySet.update/bulk_create 不触发 signal, 依赖缓存过期兜底
+"""
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete
+
+from storages.redis import RedisUtil
+from apis.chat.consumers import defines
+from apis.chat.consumers.files import cache_file_meta, invalidate_file_meta
+from storages.relational.models import Dialog, UploadedFile, GroupMembership
+from apis.chat.consumers.relation import relation_cache_key
+
+
+@receiver([post_save, post_delete], sender=GroupMembership)
+def invalidate_group_relation(sender, instance: GroupMembership, **kwargs):  # noqa
+    RedisUtil.delete(relation_cache_key(defines.chat_type.ChatType.Group, instance.profile_id, instance.group_id))
+
+
+@receiver([post_save, post_delete], sender=Dialog)
+def invalidate_dialog_relation(sender, instance: Dialog, **kwargs):  # noqa
+    RedisUtil.delete(
+        relation_cache_key(defines.chat_type.ChatType.Dialog, instance.left_user_id, instance.right_user_id)
+    )
+
+
+@receiver(post_save, sender=UploadedFile)
+def cache_uploaded_file(sender, instance: UploadedFile, **kwargs):  # noqa
+    cache_file_meta(instance)
+
+
+@receiver(post_delete, sender=UploadedFile)
+def invalidate_uploaded_file(sender, instance: UploadedFile, **kwargs):  # noqa
+    invalidate_file_meta(instance.id)
@@ -1,3 +1,25 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.test import TestCase, TransactionTestCase
 
-# Create your tests here.
+from apis.chat.loadtest import percentile, dialog_peer, run_load_test
+
+
+class LoadTestHelperTest(TestCase):
+    def test_percentile(self):
+        values = [i / 100 for i in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 0.51)
+        self.assertEqual(percentile(values, 99), 1.0)
+        self.assertEqual(percentile([], 99), 0.0)
+
+    def test_dialog_peer(self):
+        self.assertEqual([dialog_peer(i, 4) for i in range(4)], [1, 0, 3, 2])
+        self.assertEqual(dialog_peer(4, 5), 0)
+
+
+# 需要 Redis
+class LoadTestTest(TransactionTestCase):
+    def test_communicator(self):
+        report = async_to_sync(run_load_test)(clients=4, messages=5, rate=0, seed=1)
+        self.assertEqual(report["delivered"], report["expected"])
+        self.assertFalse(report["errors"])
+        self.assertIsNotNone(report["queries_per_message"])
@@ -1,13 +1,24 @@
 import ujson
 from django.shortcuts import render
+from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny
 from rest_framework_jwt.serializers import jwt_encode_handler, jwt_payload_handler
 
+from common import messages
 from apis.chat import serializers
+from apis.responses import RestResponse
 from common.drf.mixins import RestModelViewSet
 from storages.relational import models
+from apis.chat.consumers.history import HISTORY_PAGE_SIZE, HISTORY_CACHE_SIZE, get_history
+from apis.chat.consumers.files import sign_history_files
+from apis.chat.consumers.receipt import get_read_counts
+from apis.chat.consumers.presence import get_online_status_sync
+from apis.chat.consumers.defines.chat_type import ChatType
 from storages.relational.models.account import Profile
 
+ONLINE_STATUS_QUERY_LIMIT = 500
+READ_COUNT_QUERY_LIMIT = 100
+
 
 def index(request):
     return render(request, "index.html")
@@ -37,6 +48,19 @@ def chat_online(request, phone, device_code, chat_type, receiver_id):
         return render(request, "index.html")
 
 
+def _history_response(request, chat_type: ChatType, chat_id_param: str):
+    chat_id = request.GET.get(chat_id_param, "")
+    before_id = request.GET.get("before_id", "")
+    limit = request.GET.get("limit", "")
+    if not chat_id.isdigit():
+        return RestResponse.fail(message=messages.Invalid % chat_id_param)
+    limit = min(int(limit), HISTORY_CACHE_SIZE) if limit.isdigit() and int(limit) > 0 else HISTORY_PAGE_SIZE
+    history = get_history(chat_type, int(chat_id), int(before_id) if before_id.isdigit() else None, limit)
+    # 历史消息不保存签名 URL, 读取时重新获取
+    sign_history_files(history)
+    return RestResponse.ok(data=history)
+
+
 class GroupMessageViewSet(RestModelViewSet):
     serializer_class = serializers.GroupMessageSerializer
     queryset = models.GroupMessage.objects.filter().select_related("profile")
@@ -44,6 +68,25 @@ class GroupMessageViewSet(RestModelViewSet):
     filterset_fields = ("profile", "group", "type")
     permission_classes = (AllowAny,)
 
+    @action(methods=["get"], detail=False)
+    def history(self, request, *args, **kwargs):
+        """
+        群聊历史消息, 参数 group、before_id、limit, 最近消息走缓存
+        """
+        return _history_response(request, ChatType.Group, "group")
+
+    @action(methods=["get"], detail=False)
+    def read_counts(self, request, *args, **kwargs):
+        """
+        群聊消息已读人数, 参数 group、message_ids(逗号分隔)
+        """
+        group_id = request.GET.get("group", "")
+        if not group_id.isdigit():
+            return RestResponse.fail(message=messages.Invalid % "group")
+        message_ids = [i.strip() for i in request.GET.get("message_ids", "").split(",")]
+        message_ids = [int(i) for i in message_ids if i.isdigit()][:READ_COUNT_QUERY_LIMIT]
+        return RestResponse.ok(data={str(k): v for k, v in get_read_counts(int(group_id), message_ids).items()})
+
 
 class DialogViewSet(RestModelViewSet):
     serializer_class = serializers.DialogSerializer
@@ -55,6 +98,15 @@ class DialogViewSet(RestModelViewSet):
     )
     permission_classes = (AllowAny,)
 
+    @action(methods=["get"], detail=False)
+    def online_status(self, request, *args, **kwargs):
+        """
+        批量查询用户在线状态, profile_ids 逗号分隔
+        """
+        profile_ids = [i.strip() for i in request.GET.get("profile_ids", "").split(",")]
+        profile_ids = [int(i) for i in profile_ids if i.isdigit()][:ONLINE_STATUS_QUERY_LIMIT]
+        return RestResponse.ok(data={str(k): v for k, v in get_online_status_sync(profile_ids).items()})
+
 
 class DialogMessageViewSet(RestModelViewSet):
     serializer_class = serializers.DialogMessageSerializer
@@ -62,3 +114,10 @@ class DialogMessageViewSet(RestModelViewSet):
     search_fields = ()
     filterset_fields = ("sender", "receiver", "type", "read")
     permission_classes = (AllowAny,)
+
+    @action(methods=["get"], detail=False)
+    def history(self, request, *args, **kwargs):
+        """
+        私聊历史消息, 参数 dialog、before_id、limit, 最近消息走缓存
+        """
+        return _history_response(request, ChatType.Dialog, "dialog")
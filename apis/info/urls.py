@@ -10,4 +10,5 @@ urlpatterns = router.urls
 urlpatterns += [
     path("enums/", views.EnumsView.as_view()),
     path(r'download_template', views.DownloadTemplateView.as_view()),
+    path("redis-pool-stats/", views.RedisPoolStatsView.as_view()),
 ]
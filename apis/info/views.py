@@ -1,3 +1,5 @@
+import os
+
 from drf_yasg import openapi
 from rest_framework import status
 from rest_framework.views import APIView
@@ -5,7 +7,9 @@ from rest_framework.permissions import AllowAny
 from django.contrib.staticfiles.storage import staticfiles_storage
 
 from apis.info import schemas
+from storages.redis import RedisUtil
 from apis.responses import RestResponse
+from apis.permissions import AuthorizedServicePermission
 from storages.enums import get_enum_content
 from common.decorators import custom_swagger_auto_schema
 
@@ -52,3 +56,41 @@ class DownloadTemplateView(APIView):
         url = staticfiles_storage.url('%s.xlsx' % template_name)
         url = self.request.build_absolute_uri(url)
         return RestResponse.ok(data={"template_name": template_name, 'path': url})
+
+
+class RedisPoolStatsView(APIView):
+    """Redis 连接池监控
+    """
+
+    permission_classes = (AuthorizedServicePermission,)
+
+    @custom_swagger_auto_schema(
+        responses={
+            status.HTTP_200_OK: openapi.Response(  # noqa
+                description="处理本次请求的进程中各连接池的使用情况",
+                examples={
+                    "application/json": RestResponse.ok(
+                        data={
+                            "pid": 1,
+                            "pools": {
+                                "127.0.0.1:6379/0": {
+                                    "in_use": 1,
+                                    "idle": 4,
+                                    "created": 5,
+                                    "max_connections": 50,
+                                    "total_created": 6,
+                                    "total_reaped": 1,
+                                }
+                            },
+                        }
+                    ).dict()
+                },
+            )
+        },
+        page_info=False,
+    )
+    def get(self, request, *args, **kwargs):
+        """
+        Redis 连接池使用情况, 仅为处理请求的 worker 进程
+        """
+        return RestResponse.ok(data={"pid": os.getpid(), "pools": RedisUtil.pool_stats()})
@@ -2,7 +2,7 @@ import sys
 import enum
 import inspect
 import threading
-from typing import List, Union
+from typing import List, Union, Optional
 from functools import wraps
 from functools import partial as raw_partial
 
@@ -162,6 +162,24 @@ def custom_swagger_auto_schema(**kwargs):
     return decorator
 
 
+def rate_limit(rate: str, key: str = "user", name: Optional[str] = None):
+    """
+    接口限流, 由 core.middlewares.RateLimitMiddleware 执行, 可叠加多条
+    rate: "10/60" 或 "10/m", period 秒内最多 limit 次; key: user 按用户(未登录按 ip), ip 按客户端 ip;
+    name: 限流计数名称, 默认为视图方法的完整路径, name 与 rate 相同的接口共用计数
+    """
+    from storages.redis.rate_limit import RateLimiter
+
+    assert key in ("user", "ip"), f"unknown rate limit key: {key}"
+
+    def decorator(func):
+        limiter = RateLimiter.from_rate(f"{name or func.__module__ + '.' + func.__qualname__}:{rate}", rate)
+        func.rate_limits = [(limiter, key)] + list(getattr(func, "rate_limits", []))
+        return func
+
+    return decorator
+
+
 def camelCaseAction(methods=None, detail=None, url_path=None, url_name=None, **kwargs):
     """
     生成驼峰路径的action
@@ -23,3 +23,5 @@ NonExists = "%s不存在"
 Invalid = "无效%s"
 
 ParamRequired = "缺少参数%s"
+
+TooManyRequests = "请求过于频繁, 请稍后再试"
@@ -6,10 +6,8 @@ import random
 import string
 import logging
 from typing import Any, List, Union, Callable, Hashable, Optional
-from asyncio import sleep
 from datetime import datetime
 from itertools import chain
-from contextlib import contextmanager
 from collections import namedtuple
 
 import pytz
@@ -18,7 +16,9 @@ from django.http import HttpRequest
 from django.db.models import QuerySet
 
 from storages.redis import RedisUtil, get_sync_redis
+from storages.redis.lock import DistributedLock
 from storages.redis.keys import RedisCacheKey
+from storages.redis.rate_limit import RateLimiter
 
 logger = logging.getLogger()
 
@@ -133,6 +133,7 @@ def get_random_host_and_port(servers: List[str]):
 def make_redis_lock(get_redis: Callable[[], Redis], timeout: int = 60):
     """
     redis key 做为锁标示，相当于资源的互斥锁，是非可重入锁注意避免死锁
+    timeout 为锁的过期时间, 加锁一直等待, 需要等待超时、自动续期等使用 storages.redis.lock.DistributedLock
     usage:
     >>> from storages.redis import keys
     >>> r_lock = make_redis_lock(get_sync_redis)
@@ -149,34 +150,8 @@ def make_redis_lock(get_redis: Callable[[], Redis], timeout: int = 60):
 
         return redis
 
-    @contextmanager
     def lock(key):
-        r = _get_redis()
-        v = os.urandom(20)
-
-        _acc = False
-
-        while not _acc:
-            _acc = r.set(key, v, ex=timeout, nx=True)
-
-            if not _acc:
-                sleep(1)
-
-        try:
-            yield
-        finally:
-            r.eval(
-                """
-                if redis.call("get", KEYS[1]) == ARGV[1]
-                then
-                    return redis.call("del", KEYS[1])
-                else
-                    return 0
-                end
-            """,
-                [key],
-                [v],
-            )
+        return DistributedLock(key, client=_get_redis(), ttl=timeout)
 
     _redis_lock = RedisLock(lock=lock,)
 
@@ -412,10 +387,19 @@ def verify_code(phone, code, scene):
     return False
 
 
+# 同一手机号每分钟 1 条, 每天 10 条
+_verify_code_limiters = [
+    RateLimiter.from_rate("verify_code", "1/m"),
+    RateLimiter.from_rate("verify_code_daily", "10/d"),
+]
+
+
 def send_verify_code(phone, code, scene, ttl=600):
     """
-    发送验证码
+    发送验证码, 超过发送频率限制时返回 False
     """
+    if any(limiter.hit(phone) for limiter in _verify_code_limiters):
+        return False
     key = RedisCacheKey.VerifyCodeKey.format(phone=phone, scene=scene)
     RedisUtil.set(key, code, ttl)
     return True
@@ -33,6 +33,15 @@ class Redis(HostAndPort):
     USERNAME: Optional[str] = None
     PASSWORD: Optional[str] = None
     DB: int = 0
+    # 每个 (host, port, db) 连接池的连接数上限, 耗尽时等待 POOL_TIMEOUT 秒
+    MAX_CONNECTIONS: int = 50
+    POOL_TIMEOUT: int = 20
+    # 连接空闲超过该秒数后使用前 PING 检查
+    HEALTH_CHECK_INTERVAL: int = 30
+    # 空闲超过该秒数的连接关闭
+    IDLE_TIMEOUT: int = 300
+    # 热点 key 进程内缓存(client-side caching), 见 storages.redis.client_cache
+    CLIENT_SIDE_CACHE: bool = False
 
 
 class Oss(BaseModel):
@@ -82,6 +91,35 @@ class Project(BaseModel):
         return v
 
 
+class Chat(BaseModel):
+    """
+    聊天 websocket 配置
+    """
+
+    # 入站限流: 每秒令牌数、桶容量, 连接级与用户级(同进程内的全部连接)
+    CONNECTION_RATE: float = 10
+    CONNECTION_BURST: int = 20
+    PROFILE_RATE: float = 20
+    PROFILE_BURST: int = 40
+    # 剩余令牌低于容量的该比例时, 丢弃 typing 等临时事件
+    EPHEMERAL_RESERVE_RATIO: float = 0.5
+    # 跨进程的用户级限流, 每帧多一次 Redis 调用
+    REDIS_RATE_LIMIT: bool = False
+    MAX_FRAME_SIZE: int = 64 * 1024
+    # 单连接待发送消息上限, 满时丢弃临时事件、阻塞其他消息
+    OUTBOUND_QUEUE_SIZE: int = 256
+    # typing 事件合并窗口(秒), 窗口内同一接收方只投递最新状态
+    TYPING_DEBOUNCE: float = 3.0
+    # permessage-deflate, 小于阈值(字节)的帧不压缩直接发送
+    WS_PER_MESSAGE_DEFLATE: bool = True
+    WS_DEFLATE_THRESHOLD: int = 512
+    # 离线收件箱最大条数及过期时间(秒)
+    INBOX_MAXLEN: int = 500
+    INBOX_EXPIRE: int = 7 * 24 * 60 * 60
+    # channel layer 节点, 如 ["redis://127.0.0.1:6380/0"], 为空时使用 REDIS
+    CHANNEL_LAYER_HOSTS: list = []
+
+
 class Hbase(BaseModel):
     SERVERS: list = []
 
@@ -155,6 +193,8 @@ class LocalConfig(BaseSettings):
 
     THIRD_API_CONFIGS: Optional[ThirdApiConfigs]
 
+    CHAT: Chat = Chat()
+
     # ApiInfo
 
     # API_V1_ROUTE: str = "/api"
@@ -34,3 +34,10 @@ max_requests_jitter = 512
 graceful_timeout = 120
 timeout = 180
 keepalive = 5
+
+
+def post_fork(server, worker):
+    # 丢弃 master 进程中创建的 Redis 连接, 各 worker 首次使用时重新连接
+    from storages.redis import reset_after_fork
+
+    reset_after_fork()
@@ -3,6 +3,7 @@ from django.core.management import call_command
 
 from core.asgi import application
 from conf.config import local_configs
+from core.websocket import ChatWebSocketProtocol
 
 app = application
 
@@ -17,6 +18,8 @@ def run():
         debug=local_configs.PROJECT.DEBUG,
         reload=local_configs.PROJECT.DEBUG,
         workers=local_configs.SERVER.WORKERS_NUM,
+        ws=ChatWebSocketProtocol,
+        ws_per_message_deflate=local_configs.CHAT.WS_PER_MESSAGE_DEFLATE,
         log_level="debug" if local_configs.PROJECT.DEBUG else "info",
         use_colors=True if local_configs.PROJECT.DEBUG else False,
     )
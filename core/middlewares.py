@@ -1,3 +1,4 @@
+import math
 from urllib.parse import parse_qs
 
 import jwt
@@ -24,6 +25,7 @@ from common import messages
 from storages import enums
 from conf.config import local_configs
 from common.types import ContentTypeEnum, RequestMethodEnum
+from common.utils import get_client_ip
 from apis.responses import RestResponse
 
 
@@ -291,6 +293,46 @@ class AuthenticationMiddlewareJWT:
         return response
 
 
+class RateLimitMiddleware:
+    """
+    接口限流, 规则由 common.decorators.rate_limit 声明在视图方法上, 超限返回 429 及 Retry-After
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest):
+        return self.get_response(request)
+
+    def process_view(self, request: HttpRequest, view_processor, *view_args, **view_kwargs):
+        cls = getattr(view_processor, "cls", None)
+        if not cls:
+            return
+        actions = getattr(view_processor, "actions", None)
+        if actions:
+            view_func = getattr(cls, actions.get(request.method.lower(), ""), None)
+        else:
+            view_func = getattr(cls, request.method.lower(), None)
+        rate_limits = getattr(view_func, "rate_limits", None)
+        if not rate_limits:
+            return
+
+        user = getattr(request, "user", None)
+        retry_after = 0
+        for limiter, key in rate_limits:
+            if key == "user" and user is not None and user.is_authenticated:
+                identity = f"user:{user.pk}"
+            else:
+                identity = f"ip:{get_client_ip(request)}"
+            retry_after = max(retry_after, limiter.hit(identity))
+        if retry_after:
+            response = middleware_response(
+                status=status.HTTP_429_TOO_MANY_REQUESTS, data={"message": messages.TooManyRequests}
+            )
+            response["Retry-After"] = str(math.ceil(retry_after))
+            return response
+
+
 class ChannelsAuthenticationMiddlewareJWT(BaseMiddleware):
     def __init__(self, inner):
         """
@@ -72,6 +72,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     # ===================================================
     "core.middlewares.AuthenticationMiddlewareJWT",
+    "core.middlewares.RateLimitMiddleware",
     "core.middlewares.ResponseProcessMiddleware",
     "core.middlewares.RequestProcessMiddleware",
 ]
@@ -111,8 +112,10 @@ ASGI_APPLICATION = "core.asgi.application"
 DATABASES = local_configs.DATABASES
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {"hosts": [(local_configs.REDIS.HOST, local_configs.REDIS.PORT)]},
+        "BACKEND": "storages.redis.channel_layer.ShardedRedisChannelLayer",
+        "CONFIG": {
+            "hosts": local_configs.CHAT.CHANNEL_LAYER_HOSTS or [(local_configs.REDIS.HOST, local_configs.REDIS.PORT)]
+        },
     },
 }
 
@@ -0,0 +1,131 @@
+"""
+uvicorn WebSocket 协议扩展
+    permessage-deflate 按帧大小决定是否压缩: 小于阈值的单帧消息不压缩(RSV1 置 0), 其余与 websockets 默认实现一致
+    按帧大小分桶统计压缩前后字节数及压缩耗时, 定时累加到 Redis, 见 manage.py chat deflate-stats
+"""
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+from collections import defaultdict
+
+from websockets import frames
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+
+from conf.config import local_configs
+from storages.redis import AsyncRedisUtil, keys
+
+logger = logging.getLogger("core.websocket")
+
+# (上限, 桶名), 按帧原始大小分桶
+DEFLATE_BUCKETS = ((256, "lt256"), (1024, "lt1k"), (4096, "lt4k"), (16384, "lt16k"), (None, "ge16k"))
+DEFLATE_METRICS_FLUSH_INTERVAL = 60
+
+
+def deflate_bucket(size: int) -> str:
+    for limit, name in DEFLATE_BUCKETS:
+        if limit is None or size < limit:
+            return name
+
+
+class DeflateMetrics:
+    """
+    进程内计数, 定时以 HINCRBY 累加到 Redis 后清零
+    """
+
+    _counters: Dict[str, int] = defaultdict(int)
+    _task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def record(cls, raw_size: int, compressed_size: Optional[int] = None, elapsed_ns: int = 0):
+        """
+        compressed_size 为 None 表示未压缩
+        """
+        bucket = "skipped" if compressed_size is None else deflate_bucket(raw_size)
+        cls._counters[f"{bucket}:frames"] += 1
+        cls._counters[f"{bucket}:raw_bytes"] += raw_size
+        if compressed_size is not None:
+            cls._counters[f"{bucket}:compressed_bytes"] += compressed_size
+            cls._counters[f"{bucket}:cpu_ns"] += elapsed_ns
+        if cls._task is None or cls._task.done():
+            cls._task = asyncio.get_running_loop().create_task(cls._run())
+
+    @classmethod
+    async def flush(cls):
+        if not cls._counters:
+            return
+        counters, cls._counters = cls._counters, defaultdict(int)
+        pipe = AsyncRedisUtil.r.pipeline()
+        for field, value in counters.items():
+            pipe.hincrby(keys.RedisCacheKey.ChatDeflateMetrics.value, field, value)
+        await pipe.execute()
+
+    @classmethod
+    async def _run(cls):
+        while True:
+            await asyncio.sleep(DEFLATE_METRICS_FLUSH_INTERVAL)
+            try:
+                await cls.flush()
+            except Exception as e:
+                logger.exception(e)
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """
+    RFC 7692 允许逐条消息决定是否压缩, 未压缩的消息不更新压缩上下文
+    """
+
+    def __init__(self, *args, threshold: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+        self.encode_cont_data = True
+
+    def encode(self, frame: frames.Frame) -> frames.Frame:
+        if frame.opcode in frames.CTRL_OPCODES:
+            return frame
+        if frame.opcode is not frames.OP_CONT:
+            # 分片消息始终压缩, 只在首帧判断
+            self.encode_cont_data = not frame.fin or len(frame.data) >= self.threshold
+            if not self.encode_cont_data:
+                DeflateMetrics.record(len(frame.data))
+                return frame
+        elif not self.encode_cont_data:
+            return frame
+        start = time.perf_counter_ns()
+        encoded = super().encode(frame)
+        DeflateMetrics.record(len(frame.data), len(encoded.data), time.perf_counter_ns() - start)
+        return encoded
+
+
+class ThresholdPerMessageDeflateFactory(ServerPerMessageDeflateFactory):
+    def __init__(self, *args, threshold: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return (
+            response_params,
+            ThresholdPerMessageDeflate(
+                extension.remote_no_context_takeover,
+                extension.local_no_context_takeover,
+                extension.remote_max_window_bits,
+                extension.local_max_window_bits,
+                extension.compress_settings,
+                threshold=self.threshold,
+            ),
+        )
+
+
+class ChatWebSocketProtocol(WebSocketProtocol):
+    """
+    uvicorn.run(ws=ChatWebSocketProtocol)
+    """
+
+    def __init__(self, config, server_state, _loop=None):
+        super().__init__(config, server_state, _loop)
+        if self.config.ws_per_message_deflate:
+            self.available_extensions = [
+                ThresholdPerMessageDeflateFactory(threshold=local_configs.CHAT.WS_DEFLATE_THRESHOLD)
+            ]
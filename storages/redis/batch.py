@@ -0,0 +1,104 @@
+"""
+批量操作与管道
+    decode_value 统一处理返回值解码: None 返回默认值, str 解码 bytes, 其他为任意可调用对象(int、float、ujson.loads 等)
+    PipelineContext/AsyncPipelineContext 收集调用并在退出时一次往返执行, 每个调用返回 Deferred, 执行后通过 .value 取值
+
+    with RedisUtil.pipeline() as pipe:
+        count = pipe.hget(key, field, decode=int, default=0)
+        pipe.expire(key, 60)
+    count.value
+"""
+from typing import Any, List, Callable, Optional
+
+Decoder = Optional[Callable[[Any], Any]]
+
+
+def decode_value(raw: Any, decode: Decoder = None, default: Any = None) -> Any:
+    if raw is None:
+        return default
+    if decode is None:
+        return raw
+    if decode is str:
+        return raw.decode("utf-8") if isinstance(raw, bytes) else str(raw)
+    return decode(raw)
+
+
+class Deferred:
+    __slots__ = ("decode", "default", "value")
+
+    def __init__(self, decode: Decoder = None, default: Any = None):
+        self.decode = decode
+        self.default = default
+        self.value: Any = None
+
+    def resolve(self, raw: Any):
+        self.value = decode_value(raw, self.decode, self.default)
+
+
+class PipelineContext:
+    """
+    redis-py pipeline, 异常退出时丢弃已收集的调用
+    """
+
+    def __init__(self, client, transaction: bool = False):
+        self._pipe = client.pipeline(transaction=transaction)
+        self._deferred: List[Deferred] = []
+
+    def __getattr__(self, name: str):
+        command = getattr(self._pipe, name)
+
+        def call(*args, decode: Decoder = None, default: Any = None, **kwargs) -> Deferred:
+            command(*args, **kwargs)
+            deferred = Deferred(decode, default)
+            self._deferred.append(deferred)
+            return deferred
+
+        return call
+
+    def __len__(self):
+        return len(self._deferred)
+
+    def execute(self) -> List[Any]:
+        deferred, self._deferred = self._deferred, []
+        if not deferred:
+            return []
+        for item, raw in zip(deferred, self._pipe.execute()):
+            item.resolve(raw)
+        return [item.value for item in deferred]
+
+    def __enter__(self) -> "PipelineContext":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.execute()
+        finally:
+            self._deferred = []
+            self._pipe.reset()
+
+
+class AsyncPipelineContext(PipelineContext):
+    """
+    aioredis pipeline/multi_exec, 调用不需要 await
+    """
+
+    def __init__(self, client, transaction: bool = False):  # noqa
+        self._pipe = client.multi_exec() if transaction else client.pipeline()
+        self._deferred: List[Deferred] = []
+
+    async def execute(self) -> List[Any]:
+        deferred, self._deferred = self._deferred, []
+        if not deferred:
+            return []
+        for item, raw in zip(deferred, await self._pipe.execute()):
+            item.resolve(raw)
+        return [item.value for item in deferred]
+
+    async def __aenter__(self) -> "AsyncPipelineContext":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.execute()
+        self._deferred = []
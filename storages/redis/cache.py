@@ -0,0 +1,268 @@
+"""
+两级缓存
+    L1: 进程内 TTLCache(容量上限 + 短过期), L2: Redis(Cache:{namespace}:{key}, pickle 序列化)
+    - 同一进程内同一 key 的回源合并为一次(single-flight), 其余调用方等待结果
+    - 回源结果为 None 时按 negative_ttl 缓存, 0、""、[] 等假值正常缓存
+    - L2 过期时间按 jitter 比例随机浮动, 避免同时过期
+    - set/delete 通过 pub/sub(Cache:Invalidate) 通知全部进程清除 L1; 不经过本模块的 Redis 写入不会通知, 依赖 L1 过期
+    同步(get_or_set 等)与异步(aget_or_set 等)接口语义一致, 共用 L1
+"""
+import os
+import random
+import pickle
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Callable, Optional, Awaitable
+
+import ujson
+from cachetools import TTLCache
+
+from storages.redis import RedisUtil, AsyncRedisUtil, keys
+
+logger = logging.getLogger("storages.redis.cache")
+
+_MISSING = object()
+
+
+class _Flight:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class _InvalidationListener:
+    """
+    每个进程一个订阅线程, 按 namespace 分发到已注册的缓存
+    """
+
+    _caches: Dict[str, "TwoTierCache"] = {}
+    _pid: Optional[int] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def register(cls, cache: "TwoTierCache"):
+        cls._caches[cache.namespace] = cache
+
+    @classmethod
+    def ensure_started(cls):
+        # fork 后子进程没有订阅线程, 按 pid 重新启动
+        if cls._pid == os.getpid():
+            return
+        with cls._lock:
+            if cls._pid == os.getpid():
+                return
+            pubsub = RedisUtil.r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{keys.RedisCacheKey.CacheInvalidateChannel.value: cls._on_message})
+            pubsub.run_in_thread(sleep_time=1, daemon=True)
+            cls._pid = os.getpid()
+
+    @classmethod
+    async def aensure_started(cls):
+        """
+        订阅为阻塞网络 I/O, 在线程池中执行, 不阻塞事件循环
+        """
+        if cls._pid != os.getpid():
+            await asyncio.get_running_loop().run_in_executor(None, cls.ensure_started)
+
+    @classmethod
+    def _on_message(cls, message):
+        try:
+            namespace, key = ujson.loads(message["data"])
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid cache invalidation message: {message['data']}")
+            return
+        cache = cls._caches.get(namespace)
+        if cache:
+            cache.l1_pop(key)
+
+
+class TwoTierCache:
+    def __init__(
+        self,
+        namespace: str,
+        ttl: int = 300,
+        l1_ttl: float = 5,
+        l1_maxsize: int = 1024,
+        negative_ttl: int = 30,
+        jitter: float = 0.1,
+        load_timeout: float = 10,
+    ):
+        """
+        ttl: L2 过期时间; negative_ttl: None 结果的过期时间, 0 表示不缓存;
+        load_timeout: 等待其他调用方回源的最长时间, 超时后自行回源
+        """
+        self.namespace = namespace
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.jitter = jitter
+        self.load_timeout = load_timeout
+        self._l1 = TTLCache(maxsize=l1_maxsize, ttl=l1_ttl)
+        self._l1_lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._async_flights: Dict[str, asyncio.Future] = {}
+        _InvalidationListener.register(self)
+
+    def redis_key(self, key: str) -> str:
+        return keys.RedisCacheKey.CacheKey.format(namespace=self.namespace, key=key)
+
+    def _expire(self, value: Any, ttl: Optional[int]) -> int:
+        ttl = self.negative_ttl if value is None else (ttl or self.ttl)
+        return max(int(ttl * (1 + random.uniform(-self.jitter, self.jitter))), 1)
+
+    def _invalidation_message(self, key: str) -> str:
+        return ujson.dumps([self.namespace, key])
+
+    def l1_get(self, key: str) -> Any:
+        with self._l1_lock:
+            return self._l1.get(key, _MISSING)
+
+    def l1_set(self, key: str, value: Any):
+        with self._l1_lock:
+            self._l1[key] = value
+
+    def l1_pop(self, key: str):
+        with self._l1_lock:
+            self._l1.pop(key, None)
+
+    @staticmethod
+    def _loads(data: Optional[bytes]) -> Any:
+        return _MISSING if data is None else pickle.loads(data)
+
+    # 同步接口
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.l1_get(key)
+        if value is _MISSING:
+            _InvalidationListener.ensure_started()
+            value = self._loads(RedisUtil.r.get(self.redis_key(key)))
+            if value is _MISSING:
+                return default
+            self.l1_set(key, value)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        if value is None and not self.negative_ttl:
+            return self.delete(key)
+        with RedisUtil.r.pipeline(transaction=False) as pipe:
+            pipe.set(self.redis_key(key), pickle.dumps(value), ex=self._expire(value, ttl))
+            pipe.publish(keys.RedisCacheKey.CacheInvalidateChannel.value, self._invalidation_message(key))
+            pipe.execute()
+        self.l1_set(key, value)
+
+    def delete(self, key: str):
+        self.l1_pop(key)
+        with RedisUtil.r.pipeline(transaction=False) as pipe:
+            pipe.delete(self.redis_key(key))
+            pipe.publish(keys.RedisCacheKey.CacheInvalidateChannel.value, self._invalidation_message(key))
+            pipe.execute()
+
+    def get_or_set(self, key: str, loader: Callable[[], Any], ttl: Optional[int] = None) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._l1_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if flight.event.wait(self.load_timeout):
+                if flight.error is not None:
+                    raise flight.error
+                return flight.value
+            return self._load(key, loader, ttl)
+        try:
+            flight.value = self._load(key, loader, ttl)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._l1_lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def _load(self, key: str, loader: Callable[[], Any], ttl: Optional[int]) -> Any:
+        # 等待期间可能已被其他进程写入
+        value = self._loads(RedisUtil.r.get(self.redis_key(key)))
+        if value is _MISSING:
+            value = loader()
+            if value is None and not self.negative_ttl:
+                return value
+            RedisUtil.r.set(self.redis_key(key), pickle.dumps(value), ex=self._expire(value, ttl))
+        self.l1_set(key, value)
+        return value
+
+    # 异步接口
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        value = self.l1_get(key)
+        if value is _MISSING:
+            await _InvalidationListener.aensure_started()
+            value = self._loads(await AsyncRedisUtil.r.get(self.redis_key(key)))
+            if value is _MISSING:
+                return default
+            self.l1_set(key, value)
+        return value
+
+    async def aset(self, key: str, value: Any, ttl: Optional[int] = None):
+        if value is None and not self.negative_ttl:
+            return await self.adelete(key)
+        pipe = AsyncRedisUtil.r.pipeline()
+        pipe.set(self.redis_key(key), pickle.dumps(value), expire=self._expire(value, ttl))
+        pipe.publish(keys.RedisCacheKey.CacheInvalidateChannel.value, self._invalidation_message(key))
+        await pipe.execute()
+        self.l1_set(key, value)
+
+    async def adelete(self, key: str):
+        self.l1_pop(key)
+        pipe = AsyncRedisUtil.r.pipeline()
+        pipe.delete(self.redis_key(key))
+        pipe.publish(keys.RedisCacheKey.CacheInvalidateChannel.value, self._invalidation_message(key))
+        await pipe.execute()
+
+    async def aget_or_set(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: Optional[int] = None) -> Any:
+        value = await self.aget(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        loop = asyncio.get_running_loop()
+        future = self._async_flights.get(key)
+        if future is not None and future.get_loop() is loop:
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), self.load_timeout)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # 回源方被取消时自行回源
+                if not future.cancelled():
+                    raise
+            return await self._aload(key, loader, ttl)
+        future = self._async_flights[key] = loop.create_future()
+        try:
+            value = await self._aload(key, loader, ttl)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # 没有等待方时不提示 exception was never retrieved
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            if self._async_flights.get(key) is future:
+                del self._async_flights[key]
+
+    async def _aload(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: Optional[int]) -> Any:
+        value = self._loads(await AsyncRedisUtil.r.get(self.redis_key(key)))
+        if value is _MISSING:
+            value = await loader()
+            if value is None and not self.negative_ttl:
+                return value
+            await AsyncRedisUtil.r.set(self.redis_key(key), pickle.dumps(value), expire=self._expire(value, ttl))
+        self.l1_set(key, value)
+        return value
@@ -0,0 +1,141 @@
+"""
+多 Redis 节点的 channel layer
+    节点选择使用带虚拟节点的一致性哈希环, 增减节点时只迁移相邻区间; 进程内 channel(xxx!yyy) 按进程部分(xxx!)哈希, 与接收端一致
+    群组成员按成员 channel 所在节点分片存储, group_send 并发地在每个节点执行一次 Lua,
+    由节点本地读取成员并批量写入各进程队列, 消息体每个节点只传输一次
+    脚本会访问未声明在 KEYS 中的队列 key, 只适用于独立节点, 不适用于 Redis Cluster
+"""
+import time
+import bisect
+import asyncio
+import logging
+import secrets
+import binascii
+from typing import List, Tuple
+
+import msgpack
+from channels_redis.core import RedisChannelLayer
+
+logger = logging.getLogger("storages.redis.channel_layer")
+
+# KEYS: group key; ARGV: now, group_expiry, expiry, capacity, channel key prefix, random prefix(8 bytes), message head
+# 消息 = 12 字节随机前缀 + msgpack map(最后一个字段 __asgi_channel__ 的值由脚本追加), 与 RedisChannelLayer.deserialize 兼容
+GROUP_SEND_SCRIPT = """
+local now = tonumber(ARGV[1])
+local expiry = tonumber(ARGV[3])
+local capacity = tonumber(ARGV[4])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], 0, now - tonumber(ARGV[2]))
+local members = redis.call("ZRANGE", KEYS[1], 0, -1)
+local channels, order = {}, {}
+for _, channel in ipairs(members) do
+    local pos = string.find(channel, "!", 1, true)
+    local key = ARGV[5] .. (pos and string.sub(channel, 1, pos) or channel)
+    if channels[key] == nil then
+        channels[key] = {}
+        table.insert(order, key)
+    end
+    table.insert(channels[key], channel)
+end
+local over_capacity = 0
+for i, key in ipairs(order) do
+    redis.call("ZREMRANGEBYSCORE", key, 0, now - expiry)
+    if redis.call("ZCOUNT", key, "-inf", "+inf") < capacity then
+        redis.call("ZADD", key, ARGV[1], ARGV[6] .. struct.pack(">I4", i) .. ARGV[7] .. cmsgpack.pack(channels[key]))
+        redis.call("EXPIRE", key, expiry)
+    else
+        over_capacity = over_capacity + 1
+    end
+end
+return {#members, over_capacity}
+"""
+
+
+class HashRing:
+    def __init__(self, nodes: List[str], replicas: int = 160):
+        points: List[Tuple[int, int]] = sorted(
+            (binascii.crc32(f"{node}#{replica}".encode()), index)
+            for index, node in enumerate(nodes)
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._indexes = [index for _, index in points]
+
+    def get(self, value: bytes) -> int:
+        position = bisect.bisect(self._hashes, binascii.crc32(value)) % len(self._hashes)
+        return self._indexes[position]
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    CHANNEL_LAYERS = {"default": {"BACKEND": "storages.redis.channel_layer.ShardedRedisChannelLayer", "CONFIG": {...}}}
+    配置项与 RedisChannelLayer 相同, 不支持 symmetric_encryption_keys; group_send 的队列容量统一使用 capacity
+    """
+
+    def __init__(self, *args, replicas: int = 160, **kwargs):
+        super().__init__(*args, **kwargs)
+        assert not self.crypter, "symmetric_encryption_keys is not supported"
+        self.ring = HashRing([str(host.get("address")) for host in self.hosts], replicas)
+        self._packer = msgpack.Packer(use_bin_type=True)
+
+    def consistent_hash(self, value):
+        if self.ring_size == 1:
+            return 0
+        if isinstance(value, bytes):
+            value = value.decode("utf8")
+        if "!" in value:
+            value = self.non_local_name(value)
+        return self.ring.get(value.encode("utf8"))
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        group_key = self._group_key(group)
+        async with self.connection(self.consistent_hash(channel)) as connection:
+            await connection.zadd(group_key, time.time(), channel)
+            await connection.expire(group_key, self.group_expiry)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        async with self.connection(self.consistent_hash(channel)) as connection:
+            await connection.zrem(self._group_key(group), channel)
+
+    def _message_head(self, message: dict) -> bytes:
+        assert "__asgi_channel__" not in message
+        packer = self._packer
+        return (
+            packer.pack_map_header(len(message) + 1)
+            + b"".join(packer.pack(k) + packer.pack(v) for k, v in message.items())
+            + packer.pack("__asgi_channel__")
+        )
+
+    async def _shard_group_send(self, index: int, group_key: bytes, head: bytes) -> Tuple[int, int]:
+        async with self.connection(index) as connection:
+            return await connection.eval(
+                GROUP_SEND_SCRIPT,
+                keys=[group_key],
+                args=[
+                    time.time(),
+                    self.group_expiry,
+                    int(self.expiry),
+                    self.capacity,
+                    self.prefix,
+                    secrets.token_bytes(8),
+                    head,
+                ],
+            )
+
+    async def group_send(self, group, message):
+        assert self.valid_group_name(group), "Group name not valid"
+        group_key, head = self._group_key(group), self._message_head(message)
+        results = await asyncio.gather(
+            *[self._shard_group_send(index, group_key, head) for index in range(self.ring_size)]
+        )
+        over_capacity = sum(over for _, over in results)
+        if over_capacity:
+            logger.info(
+                "%s channel queues over capacity in group %s of %s members",
+                over_capacity,
+                group,
+                sum(members for members, _ in results),
+            )
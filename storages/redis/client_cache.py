@@ -0,0 +1,231 @@
+"""
+客户端缓存(client-side caching)
+    读多写少的 key 在进程内缓存, 命中时不访问 Redis; 只缓存 prefixes 下的 key, 其余 key 直接读取
+    失效通知:
+    - Redis 6+: 独立连接开启 CLIENT TRACKING BCAST(RESP2, REDIRECT 到自身)并订阅 __redis__:invalidate,
+      prefixes 下的 key 无论由谁修改, 服务端都会通知
+    - 旧版本(或 tracking=False): 订阅 ClientCache:Invalidate, 只有调用 invalidate 的写入会通知, 其余依赖 ttl 过期
+    通知连接断开期间不使用缓存, 重连后清空; 读取期间收到任何失效通知时本次结果不写入缓存
+    值统一解码为 str: get -> Optional[str], smembers -> FrozenSet[str], hgetall -> Dict[str, str]
+"""
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, Tuple, Optional, Sequence
+
+import redis as s_redis
+from cachetools import TTLCache
+
+from conf.config import local_configs
+from storages.redis import RedisUtil, AsyncRedisUtil, keys
+from storages.redis.batch import decode_value
+
+logger = logging.getLogger("storages.redis.client_cache")
+
+TRACKING_CHANNEL = "__redis__:invalidate"
+RECONNECT_INTERVAL = 1
+
+_MISSING = object()
+
+
+def _decode_smembers(raw) -> frozenset:
+    return frozenset(member.decode("utf-8") for member in raw)
+
+
+def _decode_hgetall(raw) -> Dict[str, str]:
+    return {k.decode("utf-8"): v.decode("utf-8") for k, v in raw.items()}
+
+
+_DECODERS = {
+    "get": lambda raw: decode_value(raw, str),
+    "smembers": _decode_smembers,
+    "hgetall": _decode_hgetall,
+}
+
+
+class ClientSideCache:
+    def __init__(
+        self,
+        prefixes: Sequence[str],
+        maxsize: int = 10000,
+        ttl: float = 300,
+        tracking: bool = True,
+        enabled: Optional[bool] = None,
+    ):
+        """
+        tracking: False 时不使用 CLIENT TRACKING, 只接收 invalidate 发布的通知;
+        enabled: 默认使用 REDIS.CLIENT_SIDE_CACHE 配置, 关闭时全部直接读取 Redis
+        """
+        self.prefixes = tuple(prefixes)
+        self.tracking = tracking
+        self.enabled = local_configs.REDIS.CLIENT_SIDE_CACHE if enabled is None else enabled
+        # key -> {command: value}, 失效时整个 key 移除
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pid: Optional[int] = None
+        # 当前通知方式, None 表示未连接
+        self.mode: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.mode is not None
+
+    def cacheable(self, key: str) -> bool:
+        return self.enabled and key.startswith(self.prefixes)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    # 失效通知
+
+    def _ensure_listener(self):
+        # fork 后子进程没有通知线程, 按 pid 重新启动
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.mode = None
+            self._entries.clear()
+        threading.Thread(target=self._listen, name="client-side-cache", daemon=True).start()
+
+    def _connect(self) -> s_redis.Connection:
+        # 订阅状态下不能 PING, 关闭健康检查; 阻塞读取, 不设置超时
+        kwargs = dict(RedisUtil.r.connection_pool.connection_kwargs)
+        kwargs.update(health_check_interval=0, socket_timeout=None, socket_keepalive=True)
+        connection = s_redis.Connection(**kwargs)
+        connection.connect()
+        channel = keys.RedisCacheKey.ClientCacheInvalidateChannel.value
+        mode = "pubsub"
+        if self.tracking:
+            connection.send_command("CLIENT", "ID")
+            client_id = connection.read_response()
+            prefixes = [arg for prefix in self.prefixes for arg in ("PREFIX", prefix)]
+            connection.send_command("CLIENT", "TRACKING", "ON", "REDIRECT", client_id, "BCAST", *prefixes)
+            try:
+                connection.read_response()
+                channel, mode = TRACKING_CHANNEL, "tracking"
+            except s_redis.ResponseError as e:
+                logger.warning(f"CLIENT TRACKING unavailable, falling back to pub/sub: {e}")
+        connection.send_command("SUBSCRIBE", channel)
+        connection.read_response()
+        self.clear()
+        self.mode = mode
+        return connection
+
+    def _listen(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            connection = None
+            try:
+                connection = self._connect()
+                while True:
+                    response = connection.read_response()
+                    if isinstance(response, list) and response[0] == b"message":
+                        self._on_invalidate(response[2])
+            except Exception as e:
+                logger.warning(f"Client side cache invalidation connection lost: {e}")
+            finally:
+                self.mode = None
+                self.clear()
+                if connection is not None:
+                    connection.disconnect()
+            time.sleep(RECONNECT_INTERVAL)
+
+    def _on_invalidate(self, data):
+        # tracking: key 列表, FLUSHDB/FLUSHALL 时为 None; pub/sub: 单个 key
+        with self._lock:
+            self._generation += 1
+            if data is None:
+                self._entries.clear()
+                return
+            for key in data if isinstance(data, list) else [data]:
+                self._entries.pop(key.decode("utf-8") if isinstance(key, bytes) else key, None)
+
+    def invalidate(self, *keys_: str):
+        """
+        写入后调用: 立即清除本进程缓存, pub/sub 模式下通知其他进程(tracking 模式由服务端通知)
+        """
+        with self._lock:
+            self._generation += 1
+            for key in keys_:
+                self._entries.pop(key, None)
+        if self.mode != "tracking" and self.enabled:
+            with RedisUtil.pipeline() as pipe:
+                for key in keys_:
+                    pipe.publish(keys.RedisCacheKey.ClientCacheInvalidateChannel.value, key)
+
+    # 读取
+
+    def _lookup(self, key: str, command: str) -> Tuple[Any, int]:
+        with self._lock:
+            value = self._entries.get(key, {}).get(command, _MISSING)
+            generation = self._generation
+        if value is _MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value, generation
+
+    def _store(self, key: str, command: str, value: Any, generation: int):
+        with self._lock:
+            if not self.ready or generation != self._generation:
+                return
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {}
+            entry[command] = value
+
+    def _read(self, key: str, command: str) -> Any:
+        decode = _DECODERS[command]
+        if not self.cacheable(key):
+            return decode(getattr(RedisUtil.r, command)(key))
+        self._ensure_listener()
+        value, generation = self._lookup(key, command)
+        if value is _MISSING:
+            value = decode(getattr(RedisUtil.r, command)(key))
+            self._store(key, command, value, generation)
+        return value
+
+    async def _aread(self, key: str, command: str) -> Any:
+        decode = _DECODERS[command]
+        if not self.cacheable(key):
+            return decode(await getattr(AsyncRedisUtil.r, command)(key))
+        self._ensure_listener()
+        value, generation = self._lookup(key, command)
+        if value is _MISSING:
+            value = decode(await getattr(AsyncRedisUtil.r, command)(key))
+            self._store(key, command, value, generation)
+        return value
+
+    def get(self, key: str) -> Optional[str]:
+        return self._read(key, "get")
+
+    def smembers(self, key: str) -> frozenset:
+        return self._read(key, "smembers")
+
+    def hgetall(self, key: str) -> Dict[str, str]:
+        return dict(self._read(key, "hgetall"))
+
+    async def aget(self, key: str) -> Optional[str]:
+        return await self._aread(key, "get")
+
+    async def asmembers(self, key: str) -> frozenset:
+        return await self._aread(key, "smembers")
+
+    async def ahgetall(self, key: str) -> Dict[str, str]:
+        return dict(await self._aread(key, "hgetall"))
+
+
+# 用户加入的群组, 每次连接建立、断开时读取, 只在加入群组时写入
+profile_group_cache = ClientSideCache([keys.RedisCacheKey.ProfileGroupSet.value.split("{")[0]])
@@ -9,13 +9,36 @@ class RedisSearchIndex(str, Enum):
 @unique
 class RedisCacheKey(str, Enum):
     # Redis锁 Key
-    ProfileOnlineKey = "Profile:Online:{profile_id}"  # 在线信息
+    ProfileOnlineKey = "Profile:Online"  # 在线信息, 全部用户共用的 bitmap, offset 为 profile_id
+    ProfilePresenceKey = "Profile:Presence:{profile_id}"  # Hash, 用户每个连接的最近心跳时间
     # 用户连接信息
     ProfileConnectionKey = "Profile:Connection:{profile_id}-{device_code}"  # 一个用户最多只有两个设备的连接
     # 用户群组
     ProfileGroupSet = "Profile:Group:{profile_id}"  # 用户加入的所有群组id
-    # {"Group": {"count": int, "message_id": int}, "Dialog": {"count": int, "message_id": int}} 数量和起始信息id
-    ProfileGroupUnreadInfo = "Profile:UnRead:{profile_id}:{chat_unique_id}"
+    ProfileInboxKey = "Profile:Inbox:{profile_id}"  # Stream, 用户全部设备离线时暂存的私聊消息
+    # 聊天关系缓存, 值为 chat_instance_id
+    GroupRelationKey = "Chat:Relation:Group:{group_id}-{profile_id}"  # GroupMembership
+    DialogRelationKey = "Chat:Relation:Dialog:{left_user_id}-{right_user_id}"  # Dialog, left_user_id < right_user_id
+    ChatHistoryKey = "Chat:History:{chat_type}:{chat_id}"  # 最近消息列表
+    ChatFileKey = "Chat:File:{file_id}"  # UploadedFile 元数据 JSON, 空串表示不存在
+    ChatFileUrlKey = "Chat:File:Url:{file_id}"  # 文件预签名 URL, 有效期内复用
+    # 群聊已读水位, Hash 与 ZSet 成对维护, field/member 为 profile_id, 值/分数为最后已读消息 id
+    ChatGroupReadKey = "Chat:Read:Group:{group_id}"
+    ChatGroupReadRankKey = "Chat:Read:Group:{group_id}:Rank"
+    ChatGroupReadDirtySet = "Chat:Read:Group:Dirty"  # Set, 已读水位待写入数据库的群组 id
+    ChatRateLimitKey = "Chat:RateLimit:{profile_id}"  # 用户级令牌桶
+    ChatDeflateMetrics = "Chat:Metrics:Deflate"  # Hash, field: {bucket}:{stat}, 全部进程累加
+    # Hash, field: {chat_type}-{chat_instance_id}:count/message_id, 未读数量和最新未读信息id
+    ProfileGroupUnreadInfo = "Profile:UnRead:{profile_id}"
     RedisLockKey = "redis_lock_{}"
+    # 分布式锁等待队列, key 为锁的 key, 见 storages.redis.lock
+    RedisLockQueueKey = "Lock:Queue:{key}"  # ZSet, 分数为排队序号
+    RedisLockWaiterKey = "Lock:Waiter:{key}"  # Hash, token -> 等待者存活截止时间(毫秒)
+    RedisLockTicketKey = "Lock:Ticket:{key}"  # 排队序号计数
+    RedisLockReleaseChannel = "Lock:Release:{key}"  # Pub/Sub, 锁释放通知
+    CacheKey = "Cache:{namespace}:{key}"  # 两级缓存的 L2, 见 storages.redis.cache
+    CacheInvalidateChannel = "Cache:Invalidate"  # Pub/Sub, 消息为 [namespace, key], 清除各进程的 L1
+    ClientCacheInvalidateChannel = "ClientCache:Invalidate"  # Pub/Sub, 不支持 CLIENT TRACKING 时的客户端缓存失效通知
     AnalysisPrefix = RedisSearchIndex.AnalysisIndex.value + ":{}"
     VerifyCodeKey = "Verify:{phone}:{scene}"  # 验证码 key
+    RateLimitKey = "RateLimit:{name}:{identity}"  # GCRA 理论到达时间(微秒), 见 storages.redis.rate_limit
@@ -0,0 +1,159 @@
+"""
+key 空间分析
+    SCAN 遍历 key, 按 RedisCacheKey 的模式分组, 统计数量、内存(MEMORY USAGE 抽样)与 TTL 分布
+    - 每批 SCAN 结果用一次管道查询 PTTL 与抽样 key 的 MEMORY USAGE, 不缓存 key 列表
+    - 每组只保留固定大小的蓄水池样本计算 p99, 内存占用与 key 数量无关
+    - 抽样时总内存按 平均大小 * key 数量 估算
+    - 匹配多个模式时取字面部分最长的, 如 Chat:File:Url:1 归入 ChatFileUrlKey 而不是 ChatFileKey
+"""
+import re
+import random
+from typing import Dict, List, Tuple, Iterable, Optional
+
+from storages.redis import keys
+
+UNMATCHED = "(unmatched)"
+
+# (上限秒数, 名称), 永不过期单独统计
+TTL_BUCKETS = [
+    (60, "<1m"),
+    (60 * 60, "<1h"),
+    (60 * 60 * 24, "<1d"),
+    (60 * 60 * 24 * 7, "<7d"),
+    (float("inf"), ">=7d"),
+]
+NO_TTL = "no ttl"
+
+_PLACEHOLDER = re.compile(r"{[^}]*}")
+
+
+class KeyPattern:
+    def __init__(self, name: str, pattern: str):
+        self.name = name
+        self.pattern = pattern
+        self.literal_length = len(_PLACEHOLDER.sub("", pattern))
+        parts = _PLACEHOLDER.split(pattern)
+        self.regex = re.compile(".+".join(re.escape(part) for part in parts) + r"\Z")
+
+    @classmethod
+    def from_enum(cls) -> List["KeyPattern"]:
+        patterns = [cls(member.name, member.value) for member in keys.RedisCacheKey]
+        return sorted(patterns, key=lambda p: p.literal_length, reverse=True)
+
+    def match(self, key: str) -> bool:
+        return self.regex.match(key) is not None
+
+
+class GroupStats:
+    def __init__(self, name: str, pattern: str, reservoir_size: int = 1000):
+        self.name = name
+        self.pattern = pattern
+        self.count = 0
+        self.sampled = 0
+        self.sampled_bytes = 0
+        self.max_bytes = 0
+        self.max_key: Optional[str] = None
+        self.ttl = dict.fromkeys([NO_TTL] + [name for _, name in TTL_BUCKETS], 0)
+        self._reservoir: List[int] = []
+        self._reservoir_size = reservoir_size
+
+    def add(self, key: str, pttl: int, size: Optional[int]):
+        self.count += 1
+        if pttl == -1:
+            self.ttl[NO_TTL] += 1
+        elif pttl >= 0:
+            for limit, name in TTL_BUCKETS:
+                if pttl < limit * 1000:
+                    self.ttl[name] += 1
+                    break
+        if size is None:
+            return
+        self.sampled += 1
+        self.sampled_bytes += size
+        if size > self.max_bytes:
+            self.max_bytes, self.max_key = size, key
+        # 蓄水池抽样
+        if len(self._reservoir) < self._reservoir_size:
+            self._reservoir.append(size)
+        else:
+            index = random.randrange(self.sampled)
+            if index < self._reservoir_size:
+                self._reservoir[index] = size
+
+    @property
+    def avg_bytes(self) -> float:
+        return self.sampled_bytes / self.sampled if self.sampled else 0
+
+    @property
+    def total_bytes(self) -> float:
+        return self.avg_bytes * self.count
+
+    def percentile(self, p: float) -> int:
+        if not self._reservoir:
+            return 0
+        values = sorted(self._reservoir)
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class KeyspaceAnalyzer:
+    def __init__(self, client, sample: float = 1.0, memory_samples: int = 5, reservoir_size: int = 1000):
+        """
+        client: redis-py 客户端; sample: 查询 MEMORY USAGE 的 key 比例;
+        memory_samples: MEMORY USAGE SAMPLES, 嵌套类型抽样的元素数量, 0 为全部元素
+        """
+        self.client = client
+        self.sample = sample
+        self.memory_samples = memory_samples
+        self.patterns = KeyPattern.from_enum()
+        self.groups: Dict[str, GroupStats] = {}
+        self._reservoir_size = reservoir_size
+        self.scanned = 0
+
+    def classify(self, key: str) -> Tuple[str, str]:
+        for pattern in self.patterns:
+            if pattern.match(key):
+                return pattern.name, pattern.pattern
+        return UNMATCHED, "*"
+
+    def _group(self, key: str) -> GroupStats:
+        name, pattern = self.classify(key)
+        group = self.groups.get(name)
+        if group is None:
+            group = self.groups[name] = GroupStats(name, pattern, self._reservoir_size)
+        return group
+
+    def add_batch(self, batch: Iterable[bytes]):
+        batch = [key.decode("utf-8", "replace") if isinstance(key, bytes) else key for key in batch]
+        groups = [self._group(key) for key in batch]
+        # 每组至少抽样一个 key, 只有一个 key 的大 key(如 Profile:Online)不会漏掉
+        sampled = [self.sample >= 1 or not group.sampled or random.random() < self.sample for group in groups]
+        with self.client.pipeline(transaction=False) as pipe:
+            for key, is_sampled in zip(batch, sampled):
+                pipe.pttl(key)
+                if is_sampled:
+                    pipe.memory_usage(key, samples=self.memory_samples)
+            results = iter(pipe.execute(raise_on_error=False))
+        for key, group, is_sampled in zip(batch, groups, sampled):
+            pttl = next(results)
+            size = next(results) if is_sampled else None
+            # 遍历期间删除的 key
+            if pttl == -2 or isinstance(pttl, Exception):
+                continue
+            group.add(key, pttl, size if isinstance(size, int) else None)
+            self.scanned += 1
+
+    def run(self, match: Optional[str] = None, count: int = 1000, limit: Optional[int] = None) -> "KeyspaceAnalyzer":
+        """
+        limit: 最多遍历的 key 数量, 达到后停止
+        """
+        cursor = 0
+        while True:
+            cursor, batch = self.client.scan(cursor, match=match, count=count)
+            if batch:
+                self.add_batch(batch)
+            if not cursor or (limit and self.scanned >= limit):
+                break
+        return self
+
+    def report(self) -> List[GroupStats]:
+        return sorted(self.groups.values(), key=lambda group: group.total_bytes, reverse=True)
@@ -0,0 +1,432 @@
+"""
+分布式锁
+    - SET NX PX 加锁, 值为随机 token, 只有持有者可以释放、续期
+    - 公平(fair=True): 等待者按到达顺序排队(Lock:Queue:{key}), 只有队首可以加锁; 等待者每次重试刷新存活时间,
+      超时未重试(进程退出等)的队首被移除, 不会永久阻塞后续等待者
+    - 等待: 释放时发布 Lock:Release:{key}, 等待方收到通知立即重试; 通知可能丢失(锁过期、订阅断开),
+      因此同时按指数退避 + 随机抖动重试, 单次等待不超过 max_backoff
+    - watchdog: 持有期间每 ttl/3 续期一次, 适用于耗时不确定的临界区
+    DistributedLock 为同步实现(gevent 下不阻塞其他协程), AsyncDistributedLock 为 asyncio 实现
+    非可重入, 同一 key 嵌套加锁会等待到超时
+"""
+import os
+import time
+import uuid
+import random
+import asyncio
+import logging
+import threading
+from typing import Set, Dict, Optional
+from collections import defaultdict
+
+import redis as s_redis
+import aioredis
+
+from storages.redis import RedisUtil, AsyncScript, AsyncRedisUtil, keys
+
+logger = logging.getLogger("storages.redis.lock")
+
+# KEYS: lock, queue(ZSet, 分数为排队序号), waiters(Hash, token -> 存活截止毫秒), ticket;
+# ARGV: token, ttl(ms), fair(1/0), waiter ttl(ms); 返回 1 加锁成功
+ACQUIRE_SCRIPT = """
+local token = ARGV[1]
+if ARGV[3] ~= "1" then
+    if redis.call("SET", KEYS[1], token, "PX", ARGV[2], "NX") then
+        return 1
+    end
+    return 0
+end
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+while true do
+    local head = redis.call("ZRANGE", KEYS[2], 0, 0)[1]
+    if not head or tonumber(redis.call("HGET", KEYS[3], head) or "0") >= now then
+        break
+    end
+    redis.call("ZREM", KEYS[2], head)
+    redis.call("HDEL", KEYS[3], head)
+end
+local head = redis.call("ZRANGE", KEYS[2], 0, 0)[1]
+if (not head or head == token) and redis.call("SET", KEYS[1], token, "PX", ARGV[2], "NX") then
+    redis.call("ZREM", KEYS[2], token)
+    redis.call("HDEL", KEYS[3], token)
+    return 1
+end
+if not redis.call("ZSCORE", KEYS[2], token) then
+    redis.call("ZADD", KEYS[2], redis.call("INCR", KEYS[4]), token)
+end
+redis.call("HSET", KEYS[3], token, now + tonumber(ARGV[4]))
+for i = 2, 4 do
+    redis.call("PEXPIRE", KEYS[i], tonumber(ARGV[4]) * 2)
+end
+return 0
+"""
+# KEYS: lock, queue, waiters; ARGV: token, channel; 放弃等待, 锁空闲时通知下一个等待者
+CANCEL_SCRIPT = """
+redis.call("ZREM", KEYS[2], ARGV[1])
+redis.call("HDEL", KEYS[3], ARGV[1])
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    redis.call("PUBLISH", ARGV[2], "1")
+end
+return 1
+"""
+# KEYS: lock; ARGV: token, channel
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    redis.call("DEL", KEYS[1])
+    redis.call("PUBLISH", ARGV[2], "1")
+    return 1
+end
+return 0
+"""
+# KEYS: lock; ARGV: token, ttl(ms)
+EXTEND_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_CHANNEL_PATTERN = keys.RedisCacheKey.RedisLockReleaseChannel.format(key="*")
+
+_DEFAULT = object()
+
+
+class LockTimeoutError(TimeoutError):
+    pass
+
+
+class _ReleaseListener:
+    """
+    每个进程一个订阅线程, 按 channel 唤醒本进程的等待者
+    """
+
+    _waiters: Dict[str, Set[threading.Event]] = defaultdict(set)
+    _pid: Optional[int] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def ensure_started(cls):
+        if cls._pid == os.getpid():
+            return
+        with cls._lock:
+            if cls._pid == os.getpid():
+                return
+            pubsub = RedisUtil.r.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(**{RELEASE_CHANNEL_PATTERN: cls._on_message})
+            pubsub.run_in_thread(sleep_time=1, daemon=True)
+            cls._pid = os.getpid()
+
+    @classmethod
+    def register(cls, channel: str) -> threading.Event:
+        event = threading.Event()
+        with cls._lock:
+            cls._waiters[channel].add(event)
+        return event
+
+    @classmethod
+    def unregister(cls, channel: str, event: threading.Event):
+        with cls._lock:
+            waiters = cls._waiters.get(channel)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del cls._waiters[channel]
+
+    @classmethod
+    def _on_message(cls, message):
+        with cls._lock:
+            waiters = list(cls._waiters.get(message["channel"].decode("utf-8"), ()))
+        for event in waiters:
+            event.set()
+
+
+class _AsyncReleaseListener:
+    """
+    每个事件循环一个订阅任务, 按 channel 唤醒该循环内的等待者
+    """
+
+    _tasks: Dict[asyncio.AbstractEventLoop, asyncio.Task] = {}
+    _waiters: Dict[asyncio.AbstractEventLoop, Dict[str, Set[asyncio.Event]]] = {}
+
+    @classmethod
+    def ensure_started(cls):
+        loop = asyncio.get_running_loop()
+        task = cls._tasks.get(loop)
+        if task is None or task.done():
+            for closed in [item for item in cls._tasks if item.is_closed()]:
+                cls._tasks.pop(closed, None)
+                cls._waiters.pop(closed, None)
+            cls._tasks[loop] = loop.create_task(cls._listen(cls._waiters.setdefault(loop, defaultdict(set))))
+
+    @classmethod
+    async def _listen(cls, waiters: Dict[str, Set[asyncio.Event]]):
+        try:
+            [channel] = await AsyncRedisUtil.r.psubscribe(RELEASE_CHANNEL_PATTERN)
+            while await channel.wait_message():
+                name, _ = await channel.get()
+                for event in list(waiters.get(name.decode("utf-8"), ())):
+                    event.set()
+        except Exception as e:
+            # 下次等待时重新订阅, 期间依赖退避重试
+            logger.warning(f"Lock release subscription lost: {e}")
+
+    @classmethod
+    def register(cls, channel: str) -> asyncio.Event:
+        event = asyncio.Event()
+        cls._waiters.setdefault(asyncio.get_running_loop(), defaultdict(set))[channel].add(event)
+        return event
+
+    @classmethod
+    def unregister(cls, channel: str, event: asyncio.Event):
+        waiters = cls._waiters.get(asyncio.get_running_loop(), {})
+        if channel in waiters:
+            waiters[channel].discard(event)
+            if not waiters[channel]:
+                del waiters[channel]
+
+
+class _LockBase:
+    def __init__(
+        self,
+        key: str,
+        ttl: float = 60,
+        timeout: Optional[float] = None,
+        watchdog: bool = False,
+        fair: bool = True,
+        min_backoff: float = 0.005,
+        max_backoff: float = 1.0,
+    ):
+        """
+        ttl: 锁过期时间(秒); timeout: 默认的加锁等待时间, None 一直等待, 0 不等待;
+        watchdog: 持有期间自动续期; min_backoff/max_backoff: 没有收到释放通知时的重试间隔范围
+        """
+        self.key = key
+        self.ttl = ttl
+        self.timeout = timeout
+        self.watchdog = watchdog
+        self.fair = fair
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.token: Optional[str] = None
+        self.channel = keys.RedisCacheKey.RedisLockReleaseChannel.format(key=key)
+        self._queue_keys = [
+            key,
+            keys.RedisCacheKey.RedisLockQueueKey.format(key=key),
+            keys.RedisCacheKey.RedisLockWaiterKey.format(key=key),
+            keys.RedisCacheKey.RedisLockTicketKey.format(key=key),
+        ]
+
+    @property
+    def locked(self) -> bool:
+        """
+        本实例是否持有锁(不检查是否已过期)
+        """
+        return self.token is not None
+
+    def _acquire_args(self, token: str) -> list:
+        # 等待者单次等待不超过 max_backoff, 3 倍内未重试视为已退出
+        return [token, int(self.ttl * 1000), 1 if self.fair else 0, int(self.max_backoff * 3000) + 1000]
+
+    def _backoff(self, attempt: int) -> float:
+        # 指数退避 + full jitter
+        return random.uniform(self.min_backoff, min(self.max_backoff, self.min_backoff * 2 ** attempt))
+
+    def _deadline(self, timeout) -> Optional[float]:
+        timeout = self.timeout if timeout is _DEFAULT else timeout
+        return None if timeout is None else time.monotonic() + timeout
+
+
+class DistributedLock(_LockBase):
+    """
+    with DistributedLock(keys.RedisCacheKey.RedisLockKey.format("name"), timeout=10):
+        pass
+    """
+
+    def __init__(self, key: str, client: Optional[s_redis.Redis] = None, **kwargs):
+        super().__init__(key, **kwargs)
+        self.client = client or RedisUtil.r
+        self._acquire_script = self.client.register_script(ACQUIRE_SCRIPT)
+        self._cancel_script = self.client.register_script(CANCEL_SCRIPT)
+        self._release_script = self.client.register_script(RELEASE_SCRIPT)
+        self._extend_script = self.client.register_script(EXTEND_SCRIPT)
+        self._watchdog_stop: Optional[threading.Event] = None
+
+    def acquire(self, timeout=_DEFAULT) -> bool:
+        assert not self.locked, "lock is not reentrant"
+        deadline = self._deadline(timeout)
+        token = uuid.uuid4().hex
+        event = None
+        attempt = 0
+        try:
+            while True:
+                if self._acquire_script(keys=self._queue_keys, args=self._acquire_args(token)):
+                    self.token = token
+                    self._start_watchdog()
+                    return True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._cancel_script(keys=self._queue_keys[:3], args=[token, self.channel])
+                    return False
+                if event is None:
+                    _ReleaseListener.ensure_started()
+                    event = _ReleaseListener.register(self.channel)
+                    # 订阅前可能已释放, 立即重试一次
+                    continue
+                delay = self._backoff(attempt)
+                event.wait(delay if remaining is None else min(delay, remaining))
+                event.clear()
+                attempt += 1
+        finally:
+            if event is not None:
+                _ReleaseListener.unregister(self.channel, event)
+
+    def release(self) -> bool:
+        """
+        返回 False 表示锁已过期或被其他持有者获取
+        """
+        if not self.locked:
+            return False
+        self._stop_watchdog()
+        token, self.token = self.token, None
+        released = bool(self._release_script(keys=[self.key], args=[token, self.channel]))
+        if not released:
+            logger.warning(f"Lock {self.key} expired before release")
+        return released
+
+    def extend(self, ttl: Optional[float] = None) -> bool:
+        """
+        重置过期时间为 ttl(默认为 self.ttl)
+        """
+        if not self.locked:
+            return False
+        return bool(self._extend_script(keys=[self.key], args=[self.token, int((ttl or self.ttl) * 1000)]))
+
+    def _start_watchdog(self):
+        if not self.watchdog:
+            return
+        stop = self._watchdog_stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.ttl / 3):
+                try:
+                    if not self.extend():
+                        logger.warning(f"Lock {self.key} lost, watchdog stopped")
+                        return
+                except s_redis.RedisError as e:
+                    logger.warning(f"Lock {self.key} extend failed: {e}")
+
+        threading.Thread(target=renew, name=f"lock-watchdog-{self.key}", daemon=True).start()
+
+    def _stop_watchdog(self):
+        if self._watchdog_stop is not None:
+            self._watchdog_stop.set()
+            self._watchdog_stop = None
+
+    def __enter__(self) -> "DistributedLock":
+        if not self.acquire():
+            raise LockTimeoutError(f"Acquire lock {self.key} timeout")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class AsyncDistributedLock(_LockBase):
+    """
+    async with AsyncDistributedLock(keys.RedisCacheKey.RedisLockKey.format("name"), timeout=10):
+        pass
+    """
+
+    _acquire_script = AsyncScript(ACQUIRE_SCRIPT)
+    _cancel_script = AsyncScript(CANCEL_SCRIPT)
+    _release_script = AsyncScript(RELEASE_SCRIPT)
+    _extend_script = AsyncScript(EXTEND_SCRIPT)
+
+    def __init__(self, key: str, **kwargs):
+        super().__init__(key, **kwargs)
+        self._watchdog_task: Optional[asyncio.Task] = None
+
+    async def acquire(self, timeout=_DEFAULT) -> bool:
+        assert not self.locked, "lock is not reentrant"
+        deadline = self._deadline(timeout)
+        token = uuid.uuid4().hex
+        event = None
+        attempt = 0
+        try:
+            while True:
+                if await self._acquire_script(AsyncRedisUtil.r, self._queue_keys, self._acquire_args(token)):
+                    self.token = token
+                    self._start_watchdog()
+                    return True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    await self._cancel_script(AsyncRedisUtil.r, self._queue_keys[:3], [token, self.channel])
+                    return False
+                if event is None:
+                    _AsyncReleaseListener.ensure_started()
+                    event = _AsyncReleaseListener.register(self.channel)
+                    continue
+                delay = self._backoff(attempt)
+                try:
+                    await asyncio.wait_for(event.wait(), delay if remaining is None else min(delay, remaining))
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+                attempt += 1
+        except asyncio.CancelledError:
+            # 取消等待时让出队首位置
+            if self.token is None:
+                await asyncio.shield(
+                    self._cancel_script(AsyncRedisUtil.r, self._queue_keys[:3], [token, self.channel])
+                )
+            raise
+        finally:
+            if event is not None:
+                _AsyncReleaseListener.unregister(self.channel, event)
+
+    async def release(self) -> bool:
+        if not self.locked:
+            return False
+        self._stop_watchdog()
+        token, self.token = self.token, None
+        released = bool(await self._release_script(AsyncRedisUtil.r, [self.key], [token, self.channel]))
+        if not released:
+            logger.warning(f"Lock {self.key} expired before release")
+        return released
+
+    async def extend(self, ttl: Optional[float] = None) -> bool:
+        if not self.locked:
+            return False
+        return bool(
+            await self._extend_script(AsyncRedisUtil.r, [self.key], [self.token, int((ttl or self.ttl) * 1000)])
+        )
+
+    def _start_watchdog(self):
+        if not self.watchdog:
+            return
+
+        async def renew():
+            while True:
+                await asyncio.sleep(self.ttl / 3)
+                try:
+                    if not await self.extend():
+                        logger.warning(f"Lock {self.key} lost, watchdog stopped")
+                        return
+                except (aioredis.RedisError, OSError) as e:
+                    logger.warning(f"Lock {self.key} extend failed: {e}")
+
+        self._watchdog_task = asyncio.get_running_loop().create_task(renew())
+
+    def _stop_watchdog(self):
+        if self._watchdog_task is not None:
+            self._watchdog_task.cancel()
+            self._watchdog_task = None
+
+    async def __aenter__(self) -> "AsyncDistributedLock":
+        if not await self.acquire():
+            raise LockTimeoutError(f"Acquire lock {self.key} timeout")
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.release()
@@ -0,0 +1,140 @@
+"""
+同步 Redis 连接池
+    按 (host, port, db) 复用连接池, 同一进程内相同节点与 db 只创建一个, 参数以首次创建为准
+    - 连接数上限 max_connections, 耗尽时最多等待 timeout 秒, 超时抛出 ConnectionError
+    - 连接空闲超过 health_check_interval 秒后, 下次使用前先 PING 检查
+    - 空闲超过 idle_timeout 秒的连接在归还连接时顺带关闭(每 idle_timeout 秒最多检查一次)
+    - fork 后子进程首次使用时自动重置(redis-py _checkpid), 不复用父进程的连接
+"""
+import time
+import logging
+import threading
+from typing import Dict, Tuple, Optional
+
+import redis as s_redis
+
+from conf.config import local_configs
+
+logger = logging.getLogger("storages.redis.pool")
+
+
+class ManagedConnectionPool(s_redis.BlockingConnectionPool):
+    def __init__(self, idle_timeout: float = 300, **kwargs):
+        self.idle_timeout = idle_timeout
+        super().__init__(**kwargs)
+
+    def reset(self):
+        # 连接 -> 最后归还时间
+        self._released_at: Dict[s_redis.Connection, float] = {}
+        self._last_reap = time.monotonic()
+        self.total_created = 0
+        self.total_reaped = 0
+        super().reset()
+
+    def make_connection(self):
+        connection = super().make_connection()
+        self.total_created += 1
+        return connection
+
+    def get_connection(self, command_name, *keys, **options):
+        try:
+            return super().get_connection(command_name, *keys, **options)
+        except s_redis.ConnectionError as e:
+            if str(e) == "No connection available.":
+                logger.warning(f"Redis connection pool exhausted: {self.connection_kwargs.get('host')}, {self.stats()}")
+            raise
+
+    def release(self, connection):
+        self._released_at[connection] = time.monotonic()
+        super().release(connection)
+        if self.idle_timeout and time.monotonic() - self._last_reap > self.idle_timeout:
+            self.reap()
+
+    def reap(self, idle_timeout: Optional[float] = None) -> int:
+        """
+        关闭空闲超时的连接, 返回关闭数量
+        """
+        idle_timeout = self.idle_timeout if idle_timeout is None else idle_timeout
+        now = time.monotonic()
+        self._last_reap = now
+        reaped = []
+        with self.pool.mutex:
+            queue = self.pool.queue
+            for index, connection in enumerate(queue):
+                if connection is None or now - self._released_at.get(connection, now) <= idle_timeout:
+                    continue
+                # 空位放回 None, 需要时重新创建
+                queue[index] = None
+                self._released_at.pop(connection, None)
+                try:
+                    self._connections.remove(connection)
+                except ValueError:
+                    pass
+                reaped.append(connection)
+        for connection in reaped:
+            connection.disconnect()
+        self.total_reaped += len(reaped)
+        return len(reaped)
+
+    def stats(self) -> Dict[str, int]:
+        with self.pool.mutex:
+            idle = sum(connection is not None for connection in self.pool.queue)
+        created = len(self._connections)
+        return {
+            "in_use": created - idle,
+            "idle": idle,
+            "created": created,
+            "max_connections": self.max_connections,
+            "total_created": self.total_created,
+            "total_reaped": self.total_reaped,
+        }
+
+
+class RedisPoolRegistry:
+    _pools: Dict[Tuple[str, int, int], ManagedConnectionPool] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, host: str, port: int, db: int = 0, **kwargs) -> ManagedConnectionPool:
+        """
+        kwargs 为连接参数, 未指定的连接池参数使用 REDIS 配置
+        """
+        key = (host, port, db)
+        pool = cls._pools.get(key)
+        if pool is not None:
+            return pool
+        with cls._lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                kwargs.setdefault("max_connections", local_configs.REDIS.MAX_CONNECTIONS)
+                kwargs.setdefault("timeout", local_configs.REDIS.POOL_TIMEOUT)
+                kwargs.setdefault("health_check_interval", local_configs.REDIS.HEALTH_CHECK_INTERVAL)
+                kwargs.setdefault("idle_timeout", local_configs.REDIS.IDLE_TIMEOUT)
+                pool = cls._pools[key] = ManagedConnectionPool(host=host, port=port, db=db, **kwargs)
+                logger.info(f"Redis connection pool created: {host}:{port}/{db}")
+        return pool
+
+    @classmethod
+    def stats(cls) -> Dict[str, Dict[str, int]]:
+        """
+        {"host:port/db": {in_use, idle, created, max_connections, total_created, total_reaped}}, 仅当前进程
+        """
+        return {f"{host}:{port}/{db}": pool.stats() for (host, port, db), pool in list(cls._pools.items())}
+
+    @classmethod
+    def reap(cls, idle_timeout: Optional[float] = None) -> int:
+        return sum(pool.reap(idle_timeout) for pool in list(cls._pools.values()))
+
+    @classmethod
+    def disconnect(cls):
+        for pool in list(cls._pools.values()):
+            pool.disconnect()
+
+    @classmethod
+    def reset(cls):
+        """
+        fork 后在子进程中调用, 丢弃继承的连接但不关闭(仍由父进程使用)
+        """
+        cls._lock = threading.Lock()
+        for pool in list(cls._pools.values()):
+            pool.reset()
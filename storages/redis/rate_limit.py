@@ -0,0 +1,109 @@
+"""
+限流
+    GCRA(通用信元速率算法): 每个 key 只存一个理论到达时间(TAT), Lua 脚本内原子计算, 时间取 Redis 服务端时间
+    limit/period: period 秒内最多 limit 次, 允许一次性突发 limit 次
+    进程内预检, 以下情况不访问 Redis 直接拒绝:
+    - Redis 已返回拒绝且未到重试时间(TAT 只增不减, 其他进程不会使其提前恢复)
+    - 本进程放行的请求已超过限额(全局放行数不少于本进程放行数), 本进程 TAT 只在放行后推进
+    Redis 不可用时放行
+"""
+import time
+import logging
+import threading
+
+from cachetools import TTLCache
+
+from storages.redis import RedisUtil, keys
+
+logger = logging.getLogger("storages.redis.rate_limit")
+
+# KEYS: tat key; ARGV: emission interval(微秒), period(微秒); 返回 0 放行, 否则为需要等待的毫秒数
+# 使用整数微秒计算, 避免浮点误差在恰好达到限额时误拒
+GCRA_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000000 + tonumber(time[2])
+local tat = math.max(tonumber(redis.call("GET", KEYS[1]) or "0"), now)
+local new_tat = tat + interval
+if new_tat - now > period then
+    return math.max(math.ceil((new_tat - now - period) / 1000), 1)
+end
+redis.call("SET", KEYS[1], new_tat, "PX", math.ceil((new_tat - now) / 1000))
+return 0
+"""
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 60 * 60 * 24}
+
+
+def parse_rate(rate: str):
+    """
+    "10/60" 或 "10/m": 60 秒 10 次, 返回 (limit, period)
+    """
+    limit, period = rate.split("/")
+    return int(limit), PERIODS[period] if period in PERIODS else float(period)
+
+
+class RateLimiter:
+    def __init__(self, name: str, limit: int, period: float, maxsize: int = 100000):
+        assert limit > 0 and period > 0, "limit and period must be positive"
+        self.name = name
+        self.limit = limit
+        self.period = period
+        # 向下取整到微秒, limit 次间隔之和不超过 period
+        self._interval_us = int(period * 1000000) // limit
+        self._period_us = int(period * 1000000)
+        self.interval = self._interval_us / 1000000
+        # identity -> 本进程 TAT / 拒绝截止时间(monotonic)
+        self._local_tat = TTLCache(maxsize=maxsize, ttl=period)
+        self._blocked = TTLCache(maxsize=maxsize, ttl=period)
+        self._lock = threading.Lock()
+        self._script = None
+
+    @classmethod
+    def from_rate(cls, name: str, rate: str) -> "RateLimiter":
+        return cls(name, *parse_rate(rate))
+
+    def redis_key(self, identity: str) -> str:
+        return keys.RedisCacheKey.RateLimitKey.format(name=self.name, identity=identity)
+
+    def _precheck(self, identity: str, now: float) -> float:
+        with self._lock:
+            blocked_until = self._blocked.get(identity)
+            if blocked_until and blocked_until > now:
+                return blocked_until - now
+            tat = max(self._local_tat.get(identity, now), now) + self.interval
+            if tat - now > self.period:
+                return tat - now - self.period
+            return 0
+
+    def _admit(self, identity: str, now: float):
+        """
+        请求放行后才推进本进程 TAT, Redis 拒绝的请求不计入
+        """
+        with self._lock:
+            self._local_tat[identity] = max(self._local_tat.get(identity, now), now) + self.interval
+
+    def hit(self, identity: str) -> float:
+        """
+        记录一次请求, 放行返回 0, 否则返回需要等待的秒数
+        """
+        now = time.monotonic()
+        retry_after = self._precheck(identity, now)
+        if retry_after:
+            return retry_after
+        if self._script is None:
+            self._script = RedisUtil.r.register_script(GCRA_SCRIPT)
+        try:
+            wait_ms = self._script(keys=[self.redis_key(identity)], args=[self._interval_us, self._period_us])
+        except Exception as e:
+            logger.warning(f"Rate limit {self.name} unavailable: {e}")
+            self._admit(identity, now)
+            return 0
+        if not wait_ms:
+            self._admit(identity, now)
+            return 0
+        retry_after = wait_ms / 1000
+        with self._lock:
+            self._blocked[identity] = now + retry_after
+        return retry_after
@@ -1,5 +1,19 @@
+"""
+RediSearch
+    每个索引一个客户端, 进程内缓存, 共用 db 0 的连接池(RediSearch 只支持 db 0)
+    search 直接把返回值解析为 dict, 不创建 Document; 指定 fields 时只返回这些字段(RETURN)
+    大结果集:
+    - iter_search: LIMIT 分页遍历 FT.SEARCH, 受服务端 MAXSEARCHRESULTS 限制
+    - iter_aggregate: FT.AGGREGATE WITHCURSOR 游标遍历, 中途退出时删除游标
+"""
+import time
+import threading
+from typing import Any, Dict, List, Union, Iterator, Optional, Sequence
+
 import redis
-from redisearch import Client
+from redisearch import Query, Client
+from redisearch._util import to_string
+from redisearch.aggregation import AggregateRequest
 
 from storages.redis import RedisUtil
 from storages.redis.keys import RedisSearchIndex
@@ -9,14 +23,114 @@ def get_sync_redis():
     return redis.Redis(connection_pool=RedisUtil.get_pool(0))  # 必须使用0
 
 
+class SearchResult:
+    __slots__ = ("total", "docs", "duration")
+
+    def __init__(self, total: int, docs: List[Dict[str, Any]], duration: float = 0):
+        self.total = total
+        self.docs = docs
+        self.duration = duration
+
+    def __repr__(self):
+        return f"SearchResult{{{self.total} total, docs: {self.docs}}}"
+
+
+def _to_query(query: Union[str, Query], fields: Optional[Sequence[str]] = None) -> Query:
+    if isinstance(query, str):
+        query = Query(query)
+    if fields:
+        query.return_fields(*[field for field in fields if field not in query._return_fields])
+    return query
+
+
+def _parse_docs(res: list, query: Query, fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """
+    与 redisearch.Result 的解析一致, fields 为空时每条结果包含 id、payload(、score)及全部字段, 否则只包含 id 与 fields
+    """
+    has_content, has_payload, with_scores = not query._no_content, query._with_payloads, query._with_scores
+    step = 1 + has_content + has_payload + with_scores
+    docs = []
+    for i in range(1, len(res), step):
+        doc = {"id": to_string(res[i])}
+        if not fields:
+            doc["payload"] = to_string(res[i + 1 + with_scores]) if has_payload else None
+            if with_scores:
+                doc["score"] = float(res[i + 1])
+        if has_content:
+            values = res[i + step - 1] or []
+            content = dict(zip(map(to_string, values[::2]), map(to_string, values[1::2])))
+            if fields:
+                doc.update((field, content.get(field)) for field in fields)
+            else:
+                content.pop("id", None)
+                if "$" in content:
+                    content["json"] = content.pop("$")
+                doc.update(content)
+        docs.append(doc)
+    return docs
+
+
 class SerializableClient(Client):
-    def search(self, query):
-        result = super(SerializableClient, self).search(query)
-        result.docs = [i.__dict__ for i in result.docs]
-        return result
+    def search(self, query: Union[str, Query], fields: Optional[Sequence[str]] = None) -> SearchResult:
+        """
+        fields: 只返回的字段
+        """
+        args, query = self._mk_query_args(_to_query(query, fields))
+        start = time.time()
+        res = self.redis.execute_command(self.SEARCH_CMD, *args)
+        return SearchResult(res[0], _parse_docs(res, query, fields), duration=(time.time() - start) * 1000)
+
+    def iter_search(
+        self, query: Union[str, Query], fields: Optional[Sequence[str]] = None, page_size: int = 1000
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        分页遍历全部结果, 每页一次往返; 遍历期间索引变化可能导致结果重复或遗漏
+        """
+        query = _to_query(query, fields)
+        offset = 0
+        while True:
+            result = self.search(query.paging(offset, page_size), fields)
+            yield from result.docs
+            offset += page_size
+            if len(result.docs) < page_size or offset >= result.total:
+                return
+
+    def iter_aggregate(
+        self, request: AggregateRequest, count: int = 1000, max_idle: int = 300
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        游标遍历聚合结果, 每次读取 count 行, 每行为 dict; max_idle: 游标空闲超过该秒数后由服务端释放
+        """
+        result = self.aggregate(request.cursor(count=count, max_idle=max_idle))
+        cursor = result.cursor
+        try:
+            while True:
+                for row in result.rows:
+                    yield dict(zip(map(to_string, row[::2]), map(to_string, row[1::2])))
+                if not cursor or not cursor.cid:
+                    return
+                cursor.count = count
+                result = self.aggregate(cursor)
+        finally:
+            if cursor and cursor.cid:
+                try:
+                    self.redis.execute_command(self.CURSOR_CMD, "DEL", self.index_name, cursor.cid)
+                except redis.ResponseError:
+                    # 游标已过期
+                    pass
+
+
+_clients: Dict[RedisSearchIndex, SerializableClient] = {}
+_lock = threading.Lock()
 
 
-def get_redis_search_client(index: RedisSearchIndex) -> Client:
+def get_redis_search_client(index: RedisSearchIndex) -> SerializableClient:
     if not isinstance(index, RedisSearchIndex):
         raise RuntimeError(f"index {index} is not RedisSearchIndex type")
-    return SerializableClient(index.value, conn=get_sync_redis())
+    client = _clients.get(index)
+    if client is None:
+        with _lock:
+            client = _clients.get(index)
+            if client is None:
+                client = _clients[index] = SerializableClient(index.value, conn=get_sync_redis())
+    return client
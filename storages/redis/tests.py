@@ -0,0 +1,135 @@
+import time
+import pickle
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+
+from storages.redis import RedisUtil, keys
+from storages.redis.cache import TwoTierCache
+from storages.redis.client_cache import ClientSideCache
+
+
+# 需要 Redis
+class TwoTierCacheTest(TestCase):
+    namespace = "Test:TwoTier"
+
+    def setUp(self) -> None:
+        self.cache = TwoTierCache(self.namespace, ttl=100, negative_ttl=10, jitter=0.2)
+        self.loads = 0
+
+    def tearDown(self) -> None:
+        RedisUtil.r.delete(*RedisUtil.r.keys(self.cache.redis_key("*")) or ["_"])
+
+    def loader(self, value=1, delay=0.0):
+        def load():
+            self.loads += 1
+            time.sleep(delay)
+            return value
+
+        return load
+
+    def aloader(self, value=1, delay=0.0):
+        async def load():
+            self.loads += 1
+            await asyncio.sleep(delay)
+            return value
+
+        return load
+
+    def test_single_flight(self):
+        with ThreadPoolExecutor(8) as executor:
+            results = list(
+                executor.map(lambda _: self.cache.get_or_set("sync", self.loader("v", delay=0.2)), range(8))
+            )
+        self.assertEqual(results, ["v"] * 8)
+        self.assertEqual(self.loads, 1)
+
+    def test_async_single_flight(self):
+        async def run():
+            return await asyncio.gather(
+                *[self.cache.aget_or_set("async", self.aloader("v", delay=0.2)) for _ in range(8)]
+            )
+
+        self.assertEqual(async_to_sync(run)(), ["v"] * 8)
+        self.assertEqual(self.loads, 1)
+
+    def test_falsy_and_negative(self):
+        for key, value in (("zero", 0), ("empty", ""), ("none", None)):
+            self.assertEqual(self.cache.get_or_set(key, self.loader(value)), value)
+            self.cache.l1_pop(key)
+            self.assertEqual(self.cache.get_or_set(key, self.loader(value)), value)
+        self.assertEqual(self.loads, 3)
+        self.assertLessEqual(RedisUtil.r.ttl(self.cache.redis_key("none")), 12)
+        # negative_ttl 为 0 时不缓存 None
+        uncached = TwoTierCache(self.namespace + ":Uncached", negative_ttl=0)
+        uncached.get_or_set("none", self.loader(None))
+        uncached.get_or_set("none", self.loader(None))
+        self.assertEqual(self.loads, 5)
+
+    def test_jittered_ttl(self):
+        expires = {self.cache._expire(1, None) for _ in range(200)}
+        self.assertTrue(all(80 <= expire <= 120 for expire in expires))
+        self.assertGreater(len(expires), 1)
+        self.cache.set("jitter", 1)
+        self.assertTrue(80 <= RedisUtil.r.ttl(self.cache.redis_key("jitter")) <= 120)
+
+    def test_invalidation(self):
+        self.assertEqual(self.cache.get_or_set("shared", self.loader(1)), 1)
+        self.assertEqual(self.cache.l1_get("shared"), 1)
+        # 模拟其他进程写入 L2 并通知
+        RedisUtil.r.set(self.cache.redis_key("shared"), pickle.dumps(2))
+        RedisUtil.r.publish(
+            keys.RedisCacheKey.CacheInvalidateChannel.value, self.cache._invalidation_message("shared")
+        )
+        deadline = time.monotonic() + 3
+        while self.cache.get("shared") != 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.cache.get("shared"), 2)
+
+
+# 需要 Redis
+class ClientSideCacheTest(TestCase):
+    key = "Test:ClientCache:1"
+
+    def setUp(self) -> None:
+        RedisUtil.r.delete(self.key)
+
+    def tearDown(self) -> None:
+        RedisUtil.r.delete(self.key)
+
+    @staticmethod
+    def wait_for(condition, timeout=3):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def assert_invalidated_after(self, cache: ClientSideCache, write):
+        RedisUtil.r.sadd(self.key, 1)
+        cache.smembers(self.key)
+        self.assertTrue(self.wait_for(lambda: cache.ready))
+        self.assertEqual(cache.smembers(self.key), {"1"})
+        misses = cache.misses
+        self.assertEqual(cache.smembers(self.key), {"1"})
+        self.assertEqual(cache.misses, misses)
+        write()
+        self.assertTrue(self.wait_for(lambda: cache.smembers(self.key) == {"1", "2"}))
+
+    def test_tracking(self):
+        cache = ClientSideCache(["Test:ClientCache:"], enabled=True)
+        self.assert_invalidated_after(cache, lambda: RedisUtil.r.sadd(self.key, 2))
+        self.assertEqual(cache.mode, "tracking")
+
+    def test_pubsub_fallback(self):
+        cache = ClientSideCache(["Test:ClientCache:"], tracking=False, enabled=True)
+        # 模拟其他进程写入后通知
+        self.assert_invalidated_after(
+            cache,
+            lambda: (
+                RedisUtil.r.sadd(self.key, 2),
+                RedisUtil.r.publish(keys.RedisCacheKey.ClientCacheInvalidateChannel.value, self.key),
+            ),
+        )
+        self.assertEqual(cache.mode, "pubsub")
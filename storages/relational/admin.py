@@ -6,7 +6,8 @@ from django.db.models import fields
 from django.contrib.admin.sites import AlreadyRegistered
 
 from conf.config import local_configs
-from storages.redis import AsyncRedisUtil, keys
+from storages.redis import RedisUtil, keys
+from storages.redis.client_cache import profile_group_cache
 from storages.relational.models.chat import GroupMembership
 from storages.relational.models.account import Profile
 
@@ -81,9 +82,9 @@ for model in app_models:  # noqa
                 obj.set_password(obj.password)
             obj.save()
             if isinstance(obj, GroupMembership) and not change:
-                AsyncRedisUtil.sadd(
-                    keys.RedisCacheKey.ProfileGroupSet.format(profile_id=obj.profile_id), [obj.group_id],
-                )
+                group_key = keys.RedisCacheKey.ProfileGroupSet.format(profile_id=obj.profile_id)
+                RedisUtil.sadd(group_key, [obj.group_id])
+                profile_group_cache.invalidate(group_key)
 
     try:  # noqa
         admin.site.register(model, XXXAdmin)
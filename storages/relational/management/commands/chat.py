@@ -0,0 +1,315 @@
+import time
+import asyncio
+import logging
+from types import SimpleNamespace
+
+from django.core.management import BaseCommand
+
+from conf.config import local_configs
+
+logger = logging.getLogger("manage.chat")
+
+
+class Command(BaseCommand):
+    help = """
+    聊天
+        bench-dispatch: 单核帧校验与分发基准(不含 IO);
+        bench-typing: 模拟按键触发的 typing 事件, 统计合并后的投递数;
+        bench-codec: 各帧编码的体积与编解码耗时;
+        deflate-stats: permessage-deflate 各大小区间的压缩率与单帧耗时;
+        bench-channel-layer: 多节点 group_send 投递校验与耗时, 如 --hosts redis://127.0.0.1:6380 redis://127.0.0.1:6381;
+        load-test: 模拟客户端压测, 如 --clients 200 --messages 50 --rate 2 --mix 6 3 1 --transport uvicorn;
+    """
+    available_actions = [
+        "bench-dispatch",
+        "bench-typing",
+        "bench-codec",
+        "deflate-stats",
+        "bench-channel-layer",
+        "load-test",
+    ]  # noqa
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", nargs=1, type=str, choices=self.available_actions)
+        parser.add_argument(
+            "--frames", action="store", type=int, default=200000, help="frames to dispatch",
+        )
+        parser.add_argument(
+            "--duration", action="store", type=float, default=20, help="seconds to simulate typing",
+        )
+        parser.add_argument(
+            "--interval", action="store", type=float, default=0.2, help="seconds between keystrokes",
+        )
+        parser.add_argument(
+            "--hosts", action="store", nargs="+", help="redis urls for the channel layer",
+        )
+        parser.add_argument(
+            "--processes", action="store", type=int, default=20, help="simulated server processes",
+        )
+        parser.add_argument(
+            "--channels", action="store", type=int, default=50, help="channels per process",
+        )
+        parser.add_argument(
+            "--clients", action="store", type=int, default=100, help="simulated websocket clients",
+        )
+        parser.add_argument(
+            "--messages", action="store", type=int, default=20, help="messages per client",
+        )
+        parser.add_argument(
+            "--rate", action="store", type=float, default=2, help="messages per second per client, 0 for unlimited",
+        )
+        parser.add_argument(
+            "--mix", action="store", type=float, nargs=3, default=[6, 3, 1], help="dialog, group and typing weights",
+        )
+        parser.add_argument(
+            "--transport", action="store", default="communicator", choices=["communicator", "uvicorn"],
+        )
+        parser.add_argument(
+            "--url", action="store", help="running server for the uvicorn transport, e.g. ws://127.0.0.1:8000",
+        )
+        parser.add_argument(
+            "--codec", action="store", default="json", help="frame codec of the simulated clients",
+        )
+
+    def handle(self, *args, **options):
+        action = options["action"][0]
+        if action == "bench-dispatch":  # noqa
+            asyncio.run(self.bench_dispatch(options["frames"]))
+        elif action == "bench-typing":
+            asyncio.run(self.bench_typing(options["duration"], options["interval"]))
+        elif action == "bench-codec":
+            self.bench_codec(options["frames"])
+        elif action == "deflate-stats":
+            self.deflate_stats()
+        elif action == "bench-channel-layer":
+            asyncio.run(
+                self.bench_channel_layer(options["hosts"], options["processes"], options["channels"], options["frames"])
+            )
+        elif action == "load-test":
+            asyncio.run(self.load_test(options))
+
+    @staticmethod
+    def _sample_frames():
+        text = [{"tag": "text", "value": "hello"}, {"tag": "emoji", "value": "smile"}]
+        return [
+            {"chat_type": "Dialog", "message_type": "text", "receiver_id": 2, "content": text},
+            {"chat_type": "Group", "message_type": "text", "receiver_id": "3", "content": text},
+            {"chat_type": "Dialog", "message_type": "picture", "receiver_id": 2, "content": {"id": 1, "size": 10}},
+            {
+                "chat_type": "Group",
+                "message_type": "location",
+                "receiver_id": 3,
+                "content": {"longitude": 120.1, "latitude": 30.2},
+            },
+            {"chat_type": "Dialog", "message_type": "typing", "receiver_id": 2, "content": {"typing": True}},
+            {"chat_type": "Dialog", "message_type": "message_read", "receiver_id": 2, "content": {"message_id": 9}},
+            # 非法帧
+            {"chat_type": "Dialog", "message_type": "unknown", "receiver_id": 2, "content": text},
+            {"chat_type": "Dialog", "message_type": "picture", "receiver_id": 2, "content": {"url": "x"}},
+        ]
+
+    async def bench_dispatch(self, frames: int):
+        from apis.chat.consumers import defines
+        from apis.chat.consumers.handler import BaseHandler
+        from apis.chat.consumers.ephemeral import EphemeralCoalescer
+
+        async def noop(*args, **kwargs):
+            pass
+
+        async def get_chat_instance_id(chat_type, receiver_id, load=True):
+            return 1
+
+        bench_handler = type(
+            "BenchHandler",
+            (BaseHandler,),
+            {f"handle_{i.value}": noop for i in defines.message_type.ClientMessageType},
+        )()
+        consumer = SimpleNamespace(
+            profile=SimpleNamespace(id=1, pk=1),
+            relation_cache=SimpleNamespace(get_chat_instance_id=get_chat_instance_id),
+            ephemeral_coalescer=EphemeralCoalescer(local_configs.CHAT.TYPING_DEBOUNCE),
+        )
+        samples = self._sample_frames()
+        logging.getLogger("chat.consumers.handler").disabled = True
+        rejected = 0
+        start = time.perf_counter()
+        for i in range(frames):
+            try:
+                await bench_handler.handle(consumer, samples[i % len(samples)])
+            except defines.exceptions.ServiceException:
+                rejected += 1
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"frames: {frames}, rejected: {rejected}, elapsed: {elapsed:.3f}s, frames/s: {frames / elapsed:.0f}"
+        )
+
+    async def bench_typing(self, duration: float, interval: float):
+        """
+        输入 4 秒后停顿 1 秒(停顿时发送一次 stop_typing), 循环至 duration
+        """
+        from apis.chat.consumers.ephemeral import EphemeralCoalescer
+
+        async def deliver():
+            pass
+
+        coalescer = EphemeralCoalescer(local_configs.CHAT.TYPING_DEBOUNCE)
+        start = time.monotonic()
+        typing = False
+        while time.monotonic() - start < duration:
+            if (time.monotonic() - start) % 5 < 4:
+                typing = True
+                await coalescer.submit(2, "typing", deliver)
+            elif typing:
+                typing = False
+                await coalescer.submit(2, "stop_typing", deliver)
+            await asyncio.sleep(interval)
+        # 等待窗口结束时的最后一次投递
+        await asyncio.sleep(coalescer.window)
+        self.stdout.write(
+            f"window: {coalescer.window}s, submitted: {coalescer.submitted}, delivered: {coalescer.delivered}, "
+            f"reduction: {coalescer.submitted / max(coalescer.delivered, 1):.1f}x"
+        )
+
+    @staticmethod
+    def _sample_replies():
+        sender = {"id": "10086", "avatar": "https://oss.example.com/avatar/10086.png", "nickname": "phoenix"}
+        reply = {
+            "code": 0,
+            "chat_type": "Dialog",
+            "sender": sender,
+            "context": "specific.inmemory!abcdefghijkl",
+            "time": "2022-10-19 10:00:00",
+        }
+        return [
+            dict(reply, message_type="text", content=[{"tag": "text", "value": "今天下午三点开会"}]),
+            dict(reply, message_type="typing", content={"typing": True}),
+            dict(
+                reply,
+                message_type="picture",
+                content={
+                    "id": 1,
+                    "url": "https://oss.example.com/1.png",
+                    "label": None,
+                    "size": 2048,
+                    "extension": "png",
+                },
+            ),
+            dict(
+                reply,
+                chat_type="SystemCenter",
+                message_type="message_new_unread",
+                content={"chat_instance_id": 12, "message_id": 3456, "count": 7},
+            ),
+        ]
+
+    def bench_codec(self, frames: int):
+        from apis.chat.consumers.codec import CODECS
+
+        samples = self._sample_replies()
+        rounds = max(frames // len(samples), 1)
+        for codec in CODECS.values():
+            encoded = [codec.encode(sample) for sample in samples]
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for sample in samples:
+                    codec.encode(sample)
+            encode_elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for data in encoded:
+                    codec.decode(data)
+            decode_elapsed = time.perf_counter() - start
+            total = rounds * len(samples)
+            self.stdout.write(
+                f"{codec.name:<8} avg bytes: {sum(map(len, encoded)) / len(encoded):.0f}, "
+                f"encode: {encode_elapsed / total * 1e6:.2f}us, decode: {decode_elapsed / total * 1e6:.2f}us"
+            )
+
+    def deflate_stats(self):
+        from core.websocket import DEFLATE_BUCKETS
+        from storages.redis import RedisUtil, keys
+
+        stats = {k: int(v) for k, v in RedisUtil.hgetall(keys.RedisCacheKey.ChatDeflateMetrics.value, {}).items()}
+        skipped = stats.get("skipped:frames", 0)
+        self.stdout.write(f"skipped(below threshold) frames: {skipped}, bytes: {stats.get('skipped:raw_bytes', 0)}")
+        for _, bucket in DEFLATE_BUCKETS:
+            frames = stats.get(f"{bucket}:frames", 0)
+            if not frames:
+                continue
+            raw_bytes = stats.get(f"{bucket}:raw_bytes", 0)
+            compressed_bytes = stats.get(f"{bucket}:compressed_bytes", 0)
+            self.stdout.write(
+                f"{bucket:<6} frames: {frames}, avg raw: {raw_bytes / frames:.0f}B, "
+                f"ratio: {compressed_bytes / max(raw_bytes, 1):.2f}, "
+                f"cpu: {stats.get(f'{bucket}:cpu_ns', 0) / frames / 1000:.1f}us/frame"
+            )
+
+    async def bench_channel_layer(self, hosts, processes: int, channels: int, sends: int):
+        """
+        每个模拟进程一个 layer 实例, 全部 channel 加入同一群组, 校验每个 channel 都收到消息
+        """
+        from collections import Counter
+
+        from storages.redis.channel_layer import ShardedRedisChannelLayer
+
+        group = "Bench-Group"
+        layers = [ShardedRedisChannelLayer(hosts=hosts) for _ in range(processes)]
+        # 不超过队列容量, 保证全部投递
+        sends = min(sends, layers[0].capacity)
+        members = []
+        for layer in layers:
+            for _ in range(channels):
+                channel = await layer.new_channel()
+                await layer.group_add(group, channel)
+                members.append((layer, channel))
+        start = time.perf_counter()
+        for i in range(sends):
+            await layers[0].group_send(group, {"type": "group.message", "content": {"index": i}})
+        elapsed = time.perf_counter() - start
+        received = 0
+        for layer, channel in members:
+            message = await asyncio.wait_for(layer.receive(channel), 5)
+            received += message["content"]["index"] == 0
+        for layer, channel in members:
+            await layer.group_discard(group, channel)
+        await layers[0].flush()
+        for layer in layers:
+            await layer.close_pools()
+        shards = Counter(layers[0].consistent_hash(channel) for _, channel in members)
+        self.stdout.write(
+            f"members: {len(members)}, shards: {dict(sorted(shards.items()))}, received: {received}, "
+            f"group_send: {elapsed / sends * 1000:.2f}ms"
+        )
+
+    async def load_test(self, options):
+        from apis.chat.loadtest import run_load_test
+
+        report = await run_load_test(
+            clients=options["clients"],
+            messages=options["messages"],
+            rate=options["rate"],
+            mix=tuple(options["mix"]),
+            transport=options["transport"],
+            url=options["url"],
+            codec=options["codec"],
+        )
+        self.stdout.write(
+            f"target: {report['target']}, codec: {report['codec']}, clients: {report['clients']}, "
+            f"connect p50/p99: {report['connect_p50_ms']:.1f}/{report['connect_p99_ms']:.1f}ms"
+        )
+        self.stdout.write(
+            f"sent: {report['sent']}, delivered: {report['delivered']}/{report['expected']}, "
+            f"errors: {report['errors']}"
+        )
+        self.stdout.write(
+            f"elapsed: {report['elapsed']:.2f}s, send: {report['send_throughput']:.0f} msg/s, "
+            f"delivery: {report['delivery_throughput']:.0f} msg/s"
+        )
+        for kind, (p50, p99, maximum) in report["latency_ms"].items():
+            self.stdout.write(f"{kind:<7} latency p50: {p50:.1f}ms, p99: {p99:.1f}ms, max: {maximum:.1f}ms")
+        if report["queries_per_message"] is not None:
+            self.stdout.write(
+                f"db queries: {report['connect_queries_per_client']:.1f}/connection, "
+                f"{report['queries_per_message']:.1f}/message"
+            )
+        self.stdout.write(f"received: {report['received']}")
@@ -1,4 +1,7 @@
+import time
+import asyncio
 import logging
+import threading
 import subprocess
 from functools import partial
 
@@ -13,11 +16,17 @@ shell = partial(subprocess.run, shell=True)
 
 class Command(BaseCommand):
     help = """
-    Redis   
+    Redis
         shell: 交互shell;
+        bench-exp-of-none: 热点 key 并发 hincrby(exp_of_none) 基准, 对比 WATCH/MULTI 实现与 Lua 脚本;
+        bench-lock: 单个锁的竞争基准, 对比 SET NX 轮询与 storages.redis.lock 的加锁延迟;
+        analyze: SCAN 遍历 key, 按 RedisCacheKey 模式分组统计数量、内存(MEMORY USAGE 抽样)与 TTL 分布;
     """
     available_actions = [
         "shell",
+        "bench-exp-of-none",
+        "bench-lock",
+        "analyze",
     ]  # noqa
 
     def add_arguments(self, parser):
@@ -25,6 +34,43 @@ class Command(BaseCommand):
         parser.add_argument(
             "--db", action="store", help="redis-db to access",
         )
+        parser.add_argument(
+            "--concurrency", action="store", type=int, default=16, help="threads / coroutines",
+        )
+        parser.add_argument(
+            "--ops", action="store", type=int, default=1000, help="operations per thread / coroutine",
+        )
+        parser.add_argument(
+            "--keys", action="store", type=int, default=2, help="hot keys shared by all workers",
+        )
+        parser.add_argument(
+            "--ttl", action="store", type=int, default=1, help="exp_of_none seconds, short to exercise key expiry",
+        )
+        parser.add_argument(
+            "--hold", action="store", type=float, default=5, help="bench-lock: milliseconds the lock is held",
+        )
+        parser.add_argument(
+            "--poll-interval", action="store", type=float, default=0.1, help="bench-lock: SET NX polling seconds",
+        )
+        parser.add_argument(
+            "--match", action="store", type=str, default=None, help="analyze: SCAN MATCH pattern",
+        )
+        parser.add_argument(
+            "--scan-count", action="store", type=int, default=1000, help="analyze: SCAN COUNT per batch",
+        )
+        parser.add_argument(
+            "--sample", action="store", type=float, default=1.0, help="analyze: ratio of keys to run MEMORY USAGE on",
+        )
+        parser.add_argument(
+            "--memory-samples",
+            action="store",
+            type=int,
+            default=5,
+            help="analyze: MEMORY USAGE SAMPLES for nested types, 0 for all elements",
+        )
+        parser.add_argument(
+            "--limit", action="store", type=int, default=None, help="analyze: stop after scanning this many keys",
+        )
 
     def handle(self, *args, **options):
         action = options["action"][0]
@@ -39,3 +85,239 @@ class Command(BaseCommand):
                     host=settings.REDIS.HOST, port=settings.REDIS.PORT, db=db,
                 )
             shell(cmd)
+        elif action == "bench-exp-of-none":
+            self.bench_exp_of_none_sync(options["concurrency"], options["ops"], options["keys"], options["ttl"])
+            asyncio.run(
+                self.bench_exp_of_none_async(options["concurrency"], options["ops"], options["keys"], options["ttl"])
+            )
+        elif action == "bench-lock":
+            self.bench_lock_sync(options["concurrency"], options["ops"], options["hold"], options["poll_interval"])
+            asyncio.run(self.bench_lock_async(options["concurrency"], options["ops"], options["hold"]))
+        elif action == "analyze":
+            self.analyze(
+                options["match"], options["scan_count"], options["sample"], options["memory_samples"], options["limit"]
+            )
+
+    @staticmethod
+    def _bench_keys(prefix: str, keys: int):
+        return [f"Bench:ExpOfNone:{prefix}:{i}" for i in range(keys)]
+
+    def _report(self, name: str, ops: int, elapsed: float, failures: int, bench_keys, client):
+        # 存在但没有过期时间的 key, 即过期时间设置失败
+        immortal = sum(client.ttl(key) == -1 for key in bench_keys)
+        self.stdout.write(
+            f"{name:<14} ops/s: {ops / elapsed:>8.0f}, failures: {failures}, keys without ttl: {immortal}"
+        )
+
+    def bench_exp_of_none_sync(self, concurrency: int, ops: int, keys: int, ttl: int):
+        import redis as s_redis
+
+        from storages.redis import RedisUtil
+
+        def watch_hincrby(key):
+            """
+            原 WATCH/TTL/MULTI/EXEC 实现, 最多重试 4 次
+            """
+            with RedisUtil.r.pipeline() as pipe:
+                for _ in range(5):
+                    try:
+                        pipe.watch(key)
+                        exp = pipe.ttl(key)
+                        pipe.multi()
+                        pipe.hincrby(key, "count", 1)
+                        if exp == -2:
+                            pipe.expire(key, ttl)
+                        return pipe.execute()[0]
+                    except s_redis.WatchError:
+                        continue
+                raise s_redis.WatchError
+
+        def script_hincrby(key):
+            return RedisUtil.hincrby(key, "count", 1, exp_of_none=ttl)
+
+        for name, fun in (("sync watch", watch_hincrby), ("sync script", script_hincrby)):
+            bench_keys = self._bench_keys(name.replace(" ", "-"), keys)
+            RedisUtil.r.delete(*bench_keys)
+            failures = []
+
+            def worker(index):
+                for i in range(ops):
+                    try:
+                        fun(bench_keys[(index + i) % keys])
+                    except s_redis.WatchError:
+                        failures.append(1)
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self._report(name, concurrency * ops, time.perf_counter() - start, len(failures), bench_keys, RedisUtil.r)
+            RedisUtil.r.delete(*bench_keys)
+
+    async def bench_exp_of_none_async(self, concurrency: int, ops: int, keys: int, ttl: int):
+        from storages.redis import RedisUtil, AsyncRedisUtil
+
+        async def exists_hincrby(key):
+            """
+            原实现, EXISTS 在事务之外
+            """
+            tr = AsyncRedisUtil.r.multi_exec()
+            exists = await AsyncRedisUtil.r.exists(key)
+            tr.hincrby(key, "count", 1)
+            if not exists:
+                tr.expire(key, ttl)
+            return (await tr.execute())[0]
+
+        async def script_hincrby(key):
+            return await AsyncRedisUtil.hincrby(key, "count", 1, exp_of_none=ttl)
+
+        for name, fun in (("async exists", exists_hincrby), ("async script", script_hincrby)):
+            bench_keys = self._bench_keys(name.replace(" ", "-"), keys)
+            RedisUtil.r.delete(*bench_keys)
+
+            async def worker(index):
+                for i in range(ops):
+                    await fun(bench_keys[(index + i) % keys])
+
+            start = time.perf_counter()
+            await asyncio.gather(*[worker(i) for i in range(concurrency)])
+            self._report(name, concurrency * ops, time.perf_counter() - start, 0, bench_keys, RedisUtil.r)
+            RedisUtil.r.delete(*bench_keys)
+        await AsyncRedisUtil.close()
+
+    BENCH_LOCK_KEY = "Bench:Lock"
+
+    def _report_lock(self, name: str, latencies, elapsed: float):
+        latencies = sorted(latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+
+        self.stdout.write(
+            f"{name:<14} acquisitions/s: {len(latencies) / elapsed:>7.0f}, wait ms p50: {percentile(50):>7.1f}, "
+            f"p99: {percentile(99):>7.1f}, max: {latencies[-1] * 1000:>7.1f}"
+        )
+
+    def _clear_lock_keys(self, client):
+        from storages.redis import keys
+
+        client.delete(
+            self.BENCH_LOCK_KEY,
+            *[
+                key.format(key=self.BENCH_LOCK_KEY)
+                for key in (
+                    keys.RedisCacheKey.RedisLockQueueKey,
+                    keys.RedisCacheKey.RedisLockWaiterKey,
+                    keys.RedisCacheKey.RedisLockTicketKey,
+                )
+            ],
+        )
+
+    def bench_lock_sync(self, concurrency: int, ops: int, hold: float, poll_interval: float):
+        import uuid
+
+        from storages.redis import RedisUtil
+        from storages.redis.lock import RELEASE_SCRIPT, DistributedLock
+
+        release = RedisUtil.r.register_script(RELEASE_SCRIPT)
+
+        def poll_lock():
+            """
+            原实现: SET NX 失败后固定间隔轮询
+            """
+            token = uuid.uuid4().hex
+            while not RedisUtil.r.set(self.BENCH_LOCK_KEY, token, ex=60, nx=True):
+                time.sleep(poll_interval)
+            time.sleep(hold / 1000)
+            release(keys=[self.BENCH_LOCK_KEY], args=[token, "Bench:Lock:Release"])
+
+        def distributed_lock(fair):
+            def run():
+                with DistributedLock(self.BENCH_LOCK_KEY, fair=fair, timeout=60):
+                    time.sleep(hold / 1000)
+
+            return run
+
+        for name, fun in (
+            (f"poll {poll_interval}s", poll_lock),
+            ("sync unfair", distributed_lock(False)),
+            ("sync fair", distributed_lock(True)),
+        ):
+            self._clear_lock_keys(RedisUtil.r)
+            latencies = []
+
+            def worker():
+                for _ in range(ops):
+                    start = time.perf_counter()
+                    fun()
+                    # 加锁等待时间, 不含持有时间
+                    latencies.append(time.perf_counter() - start - hold / 1000)
+
+            threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self._report_lock(name, latencies, time.perf_counter() - start)
+        self._clear_lock_keys(RedisUtil.r)
+
+    async def bench_lock_async(self, concurrency: int, ops: int, hold: float):
+        from storages.redis import RedisUtil, AsyncRedisUtil
+        from storages.redis.lock import AsyncDistributedLock
+
+        for name, fair in (("async unfair", False), ("async fair", True)):
+            self._clear_lock_keys(RedisUtil.r)
+            latencies = []
+
+            async def worker():
+                for _ in range(ops):
+                    start = time.perf_counter()
+                    async with AsyncDistributedLock(self.BENCH_LOCK_KEY, fair=fair, timeout=60):
+                        latencies.append(time.perf_counter() - start)
+                        await asyncio.sleep(hold / 1000)
+
+            start = time.perf_counter()
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+            self._report_lock(name, latencies, time.perf_counter() - start)
+        self._clear_lock_keys(RedisUtil.r)
+        await AsyncRedisUtil.close()
+
+    @staticmethod
+    def _human_size(size: float) -> str:
+        for unit in ("B", "K", "M", "G"):
+            if size < 1024:
+                return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+            size /= 1024
+        return f"{size:.1f}T"
+
+    def analyze(self, match: str, scan_count: int, sample: float, memory_samples: int, limit: int):
+        from storages.redis import RedisUtil
+        from storages.redis.keyspace import TTL_BUCKETS, NO_TTL, KeyspaceAnalyzer
+
+        start = time.perf_counter()
+        analyzer = KeyspaceAnalyzer(RedisUtil.r, sample=sample, memory_samples=memory_samples).run(
+            match=match, count=scan_count, limit=limit
+        )
+        ttl_names = [NO_TTL] + [name for _, name in TTL_BUCKETS]
+        self.stdout.write(
+            f"{'group':<28} {'pattern':<52} {'keys':>9} {'sampled':>8} {'total':>9} {'avg':>8} {'p99':>8} "
+            f"{'max':>8}  " + " ".join(f"{name:>8}" for name in ttl_names)
+        )
+        for group in analyzer.report():
+            self.stdout.write(
+                f"{group.name:<28} {group.pattern:<52} {group.count:>9} {group.sampled:>8} "
+                f"{self._human_size(group.total_bytes):>9} {self._human_size(group.avg_bytes):>8} "
+                f"{self._human_size(group.percentile(99)):>8} {self._human_size(group.max_bytes):>8}  "
+                + " ".join(f"{group.ttl[name]:>8}" for name in ttl_names)
+            )
+        self.stdout.write("\nlargest key per group:")
+        for group in analyzer.report():
+            if group.max_key:
+                self.stdout.write(f"  {group.name:<28} {self._human_size(group.max_bytes):>8}  {group.max_key}")
+        self.stdout.write(
+            f"\nscanned {analyzer.scanned} keys in {time.perf_counter() - start:.1f}s, "
+            f"estimated total {self._human_size(sum(group.total_bytes for group in analyzer.groups.values()))}"
+        )
@@ -61,6 +61,8 @@ class Group(BaseModel, LabelFieldMixin, OrderWeightFieldMixin):
 
 class GroupMembership(BaseModel, ProfileFieldMixin, StatusFieldMixin):
     group = models.ForeignKey(to=Group, verbose_name="圈子", help_text="圈子", on_delete=models.CASCADE)
+    # 以 Redis 中的已读水位为准, 定时写入
+    last_read_message_id = models.IntegerField(verbose_name="最后已读消息", help_text="最后已读消息id", default=0)
 
     @staticmethod
     def get_group_membership(profile_id: int, group_id: int):
@@ -0,0 +1,20 @@
+"""
+聊天相关定时任务
+"""
+from tasks import TaskType, task_manager
+
+
+@task_manager.task(type_=TaskType.timed, cron="*/30 * * * *")
+def reconcile_dialog_unread():
+    """
+    私聊未读数对账
+    """
+    from apis.chat.consumers.unread import reconcile_dialog_unread as _reconcile
+
+    _reconcile()
+
+
+if __name__ == "__main__":
+    from scripts import django_setup  # noqa
+
+    reconcile_dialog_unread()
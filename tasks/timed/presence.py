@@ -0,0 +1,20 @@
+"""
+在线状态定时任务
+"""
+from tasks import TaskType, task_manager
+
+
+@task_manager.task(type_=TaskType.timed, cron="*/5 * * * *")
+def sweep_offline_presence():
+    """
+    清理过期在线状态
+    """
+    from apis.chat.consumers.presence import sweep_offline
+
+    sweep_offline()
+
+
+if __name__ == "__main__":
+    from scripts import django_setup  # noqa
+
+    sweep_offline_presence()
@@ -0,0 +1,20 @@
+"""
+已读回执定时任务
+"""
+from tasks import TaskType, task_manager
+
+
+@task_manager.task(type_=TaskType.timed, cron="* * * * *")
+def flush_group_read_watermarks():
+    """
+    群聊已读水位写入数据库
+    """
+    from apis.chat.consumers.receipt import flush_group_watermarks
+
+    flush_group_watermarks()
+
+
+if __name__ == "__main__":
+    from scripts import django_setup  # noqa
+
+    flush_group_read_watermarks()